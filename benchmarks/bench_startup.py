@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Benchmark the startup cost of the RU-WRF extraction tools
+# Each command is run in a fresh interpreter, so the times include all module imports.
+# Example: python benchmarks/bench_startup.py -n 10
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+#------------------------------
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = [
+  ('python', ['-c', 'pass']),
+  ('wrfconv --help', ['-m', 'wrfconv', '--help']),
+  ('wrfconv points --help', ['-m', 'wrfconv', 'points', '--help']),
+  ('import wrfconv.points', ['-c', 'import wrfconv.points']),
+  ('import wrfconv.grid', ['-c', 'import wrfconv.grid']),
+]
+
+
+def time_command(args, repeat):
+  '''Return the best wall clock time of a python command'''
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+#------------------------------
+def main():
+  """Main function for command line execution"""
+  parser = argparse.ArgumentParser(description='Benchmark wrfconv startup time')
+  parser.add_argument('-n','--repeat', type=int,
+    default=5,
+    help='Number of times to run each command, the best time is reported')
+  args = parser.parse_args()
+
+  print('%-28s %10s' % ('command', 'best (ms)'))
+  for label, cmd in COMMANDS:
+    print('%-28s %10.1f' % (label, 1000*time_command(cmd, args.repeat)))
+
+
+if __name__ == '__main__':
+  main()
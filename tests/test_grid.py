@@ -0,0 +1,48 @@
+# Tests of the grid extraction, run on small synthetic RU-WRF NetCDF files
+
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import xarray as xr
+from wrfconv import cli
+
+pytest.importorskip('scipy')
+
+
+#------------------------------
+def make_model_files(directory, run, hours, ny=12, nx=14):
+  '''Write wrfproc files of a model run with random winds on a small lat/lon grid'''
+  folder = os.path.join(directory, run.strftime('%Y%m%d'))
+  os.makedirs(folder, exist_ok=True)
+  lat = np.linspace(38, 41, ny)[:,None] * np.ones((1,nx))
+  lon = np.linspace(-75, -72, nx)[None,:] * np.ones((ny,1))
+  heights = np.arange(10, 230, 10)
+  for h in hours:
+    rng = np.random.default_rng(h)
+    ds = xr.Dataset({
+      'U': (('Time','height','south_north','west_east'), rng.normal(5, 2, (1,len(heights),ny,nx)).astype('f4')),
+      'V': (('Time','height','south_north','west_east'), rng.normal(2, 2, (1,len(heights),ny,nx)).astype('f4')),
+      'U10': (('Time','south_north','west_east'), rng.normal(4, 2, (1,ny,nx)).astype('f4')),
+      'V10': (('Time','south_north','west_east'), rng.normal(1, 2, (1,ny,nx)).astype('f4'))},
+      coords={'XLAT': (('Time','south_north','west_east'), lat[None].astype('f4')),
+              'XLONG': (('Time','south_north','west_east'), lon[None].astype('f4')),
+              'height': heights, 'Time': [np.datetime64(run + timedelta(hours=h))]})
+    ds.to_netcdf(os.path.join(folder, 'wrfproc_3km_%s_00Z_H%03d.nc' % (run.strftime('%Y%m%d'), h)))
+
+
+def test_regrid_with_diagnostics(tmp_path, monkeypatch):
+  '''Regridded grids keep the wind resource diagnostics, calculated from the regridded winds'''
+  make_model_files(str(tmp_path / 'wrf'), datetime(2019,4,1), range(6, 12))
+  monkeypatch.chdir(tmp_path)
+  cli.main(['subgrid', '20190401', '--source', 'nc', '--directory', str(tmp_path / 'wrf') + '/', '-p', 'rg',
+    '--regrid', '38.5,40.5,-74.5,-72.5,0.25', '--weights-dir', str(tmp_path), '--diagnostics'])
+
+  with xr.open_dataset(str(tmp_path / 'rg_20190401_20190401.nc')) as ds:
+    for name in ['wind_shear_10_100m', 'wind_veer_10_100m', 'wind_shear_100_140m', 'wind_veer_100_140m',
+                 'wind_speed_rotor_equivalent']:
+      assert name in ds
+      assert ds[name].dims == ('time', 'lat', 'lon')
+    ws = ds['wind_speed']
+    expected = np.log(ws.sel(z=100) / ws.sel(z=10)) / np.log(10.)
+    np.testing.assert_allclose(ds['wind_shear_10_100m'].values, expected.values, rtol=1e-5)
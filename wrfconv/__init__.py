@@ -0,0 +1,2 @@
+# Shared code for the RU-WRF extraction scripts
+# Rutgers University Center for Ocean Observing Leadership (RU COOL)
@@ -0,0 +1,3 @@
+from wrfconv.cli import main
+
+main()
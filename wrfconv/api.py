@@ -0,0 +1,119 @@
+# Library interface to the RU-WRF extractors
+# Each function takes plain arguments (dates as yyyymmdd strings or datetimes, stations as a DataFrame, csv file,
+# dict or list) and returns the xarray Dataset the command line would have written, so notebooks and services can
+# use the results in memory without writing and re-opening a NetCDF file.  The iter_ functions yield the same
+# datasets a few days at a time, so long ranges can be consumed without holding the whole period.
+#
+#   from wrfconv import api
+#   ds = api.extract_points('20190401', 30, 'wrf_wea_points.csv', heights=[100,120])
+#   for day in api.iter_grid('20190401', 30, bbox=[38.5,40,-75,-73]):
+#     ...
+
+from datetime import datetime,timedelta
+import pandas as pd
+from wrfconv import common, grid, points
+
+
+#------------------------------
+def as_date(start):
+  '''Convert a yyyymmdd string, date or Timestamp to a datetime'''
+  if isinstance(start, str):
+    return common.parse_date(start)
+  return datetime(start.year, start.month, start.day)
+
+
+def load_stations(stations):
+  '''Convert stations to the name, latitude, longitude DataFrame used by the extractors
+
+  Accepts a DataFrame (or csv file) with those columns, a {name: (lat, lon)} dict or a list of (name, lat, lon).'''
+  if isinstance(stations, pd.DataFrame):
+    sites = stations
+  elif isinstance(stations, str):
+    sites = pd.read_csv(stations, skipinitialspace=True)
+  elif isinstance(stations, dict):
+    sites = pd.DataFrame([(name, lat, lon) for name, (lat, lon) in stations.items()], columns=['name','latitude','longitude'])
+  else:
+    sites = pd.DataFrame(list(stations), columns=['name','latitude','longitude'])
+  missing = set(['name','latitude','longitude']) - set(sites.columns)
+  if missing:
+    raise ValueError('The stations need %s columns' % ', '.join(sorted(missing)))
+  return sites.reset_index(drop=True)
+
+
+def day_chunks(start, days, chunk_days):
+  '''Split a range of days into (start_date, days) chunks'''
+  start_date = as_date(start)
+  return [(start_date + timedelta(d), min(chunk_days, days - d)) for d in range(0, days, chunk_days)]
+
+
+def chosen_reader(ds, reader):
+  '''Keep the reader picked for the first chunk of a range, so it is only probed once'''
+  if reader == 'auto' and ds is not None and 'reader' in ds.attrs:
+    return ds.attrs['reader'].split(' ')[0]
+  return reader
+
+
+#------------------------------
+def extract_points(start, days=1, stations='wrf_vmt_points.csv', heights=points.HEIGHTS, offset=6, variables=None,
+                   source='nc', directory=None, reader='auto', lead_cube=False, domains=None, cache=None, max_memory=None,
+                   diagnostics=False):
+  '''Extract the selected variables at each station, like wrfconv points
+
+  domains is a comma separated list (see nesting.parse_domains) and cache a cache.ExtractionCache.  diagnostics adds
+  the wind resource diagnostics of derive.wind_diagnostics.'''
+  if isinstance(domains, str):
+    from wrfconv import nesting
+    domains = nesting.parse_domains(domains)
+  return points.extract_points(as_date(start), days, load_stations(stations), source=source, variables=variables,
+    heights=heights, forecast_offset=offset, directory=directory, lead_cube=lead_cube, reader=reader,
+    max_memory=max_memory, cache=cache, domains=domains, diagnostics=diagnostics)
+
+
+def iter_points(start, days=1, stations='wrf_vmt_points.csv', chunk_days=1, reader='auto', **kwargs):
+  '''Yield the point datasets of a range of days, chunk_days at a time
+
+  Takes the same arguments as extract_points.'''
+  sites = load_stations(stations)
+  for start_date, ndays in day_chunks(start, days, chunk_days):
+    ds = extract_points(start_date, ndays, sites, reader=reader, **kwargs)
+    reader = chosen_reader(ds, reader)
+    yield ds
+
+
+def extract_grid(start, days=1, heights=grid.HEIGHTS, offset=6, source='grib', bbox=None, power=False,
+                 directory=None, reader='auto', diagnostics=False):
+  '''Extract the wind layers of the model grid (or a lat_min,lat_max,lon_min,lon_max box), like wrfconv grid
+
+  Returns None if none of the model files could be read.'''
+  return grid.extract_grid(as_date(start), days, source=source, forecast_offset=offset, directory=directory,
+    heights=heights, bbox=bbox, power=power, reader=reader, diagnostics=diagnostics)
+
+
+def iter_grid(start, days=1, chunk_days=1, reader='auto', **kwargs):
+  '''Yield the grid datasets of a range of days, chunk_days at a time, skipping days without any model files
+
+  Takes the same arguments as extract_grid.'''
+  for start_date, ndays in day_chunks(start, days, chunk_days):
+    ds = extract_grid(start_date, ndays, reader=reader, **kwargs)
+    if ds is not None:
+      reader = chosen_reader(ds, reader)
+      yield ds
+
+
+def extract_profiles(start, days=1, stations='wrf_vmt_points.csv', offset=6, source='nc', directory=None, reader='auto'):
+  '''Extract the wind at every model level at each station, like wrfconv profile'''
+  from wrfconv import profiles
+  return profiles.extract_profiles(as_date(start), days, load_stations(stations), source=source,
+    forecast_offset=offset, directory=directory, reader=reader)
+
+
+def extract_areas(start, days=1, areas=None, heights=points.HEIGHTS, offset=6, variables=None, source='nc',
+                  directory=None, reader='auto', how='mean', mask_directory='.'):
+  '''Extract the selected variables combined over polygon areas, like wrfconv areas
+
+  areas is a GeoJSON or csv file, or a list of (name, polygons) from areas.read_areas.'''
+  from wrfconv import areas as area_module
+  if isinstance(areas, str):
+    areas = area_module.read_areas(areas)
+  return area_module.extract_areas(as_date(start), days, areas, source=source, variables=variables, heights=heights,
+    forecast_offset=offset, directory=directory, reader=reader, how=how, mask_directory=mask_directory)
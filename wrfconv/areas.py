@@ -0,0 +1,306 @@
+# Extract RU-WRF Model Data averaged (or summed) over polygon areas, like wind energy lease areas
+# Each polygon is rasterized once per model grid into the fraction of every model cell it covers.  The masks are
+# saved, and each hour's layers are reduced to one value per area with a dot product against the mask weights.
+
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import catalog, common, derive, points, plan, readers, sources
+
+#------------------------------
+MASK_DIRECTORY = '.'
+SAMPLES = 5 # Sub-samples across each model cell, so 25 points per cell are tested against the polygons
+REDUCTIONS = ['mean','sum']
+
+
+#------------------------------
+def parse_wkt(text):
+  '''Parse a WKT POLYGON or MULTIPOLYGON into a list of polygons, each a list of (lon,lat) rings'''
+  text = text.strip()
+  kind = text.split('(')[0].strip().upper()
+  if kind not in ('POLYGON','MULTIPOLYGON'):
+    raise ValueError('Only POLYGON and MULTIPOLYGON areas are supported, not ' + (kind or text))
+  # Rewrite the coordinate lists as JSON, e.g. ((x y, x y)) becomes [[[x,y],[x,y]]]
+  body = re.sub(r'([-+.\deE]+)\s+([-+.\deE]+)(\s+[-+.\deE]+)?', r'[\1,\2]', text[text.index('('):])
+  coords = json.loads(body.replace('(','[').replace(')',']'))
+  return coords if kind == 'MULTIPOLYGON' else [coords]
+
+
+def geojson_polygons(geometry):
+  '''Return the polygons of a GeoJSON Polygon or MultiPolygon geometry'''
+  if geometry['type'] == 'Polygon':
+    return [geometry['coordinates']]
+  if geometry['type'] == 'MultiPolygon':
+    return geometry['coordinates']
+  raise ValueError('Only Polygon and MultiPolygon areas are supported, not ' + geometry['type'])
+
+
+def read_areas(filename):
+  '''Load the areas from a GeoJSON file, or a csv file with name and wkt columns
+
+  Returns a list of (name, polygons), with each polygon a list of (lon,lat) rings.  The first ring of a
+  polygon is its outline and any others are holes.'''
+  if os.path.splitext(filename)[1].lower() in ('.geojson','.json'):
+    with open(filename) as f:
+      gj = json.load(f)
+    features = gj['features'] if gj['type'] == 'FeatureCollection' else [gj]
+    areas = []
+    for k,feature in enumerate(features):
+      geometry = feature['geometry'] if feature['type'] == 'Feature' else feature
+      props = feature.get('properties') or {}
+      name = props.get('name', props.get('NAME', feature.get('id', 'area%d' % (k+1))))
+      areas.append((str(name), geojson_polygons(geometry)))
+  else:
+    table = pd.read_csv(filename, skipinitialspace=True)
+    areas = [(str(row['name']), parse_wkt(row['wkt'])) for index, row in table.iterrows()]
+  if len(set([name for name, polygons in areas])) != len(areas):
+    raise ValueError('The area names in %s are not unique' % filename)
+  return areas
+
+
+#------------------------------
+def inside(x, y, polygons):
+  '''Test which points are inside any of the polygons, using the even-odd rule so holes are excluded'''
+  result = np.zeros(x.shape, dtype=bool)
+  for rings in polygons:
+    odd = np.zeros(x.shape, dtype=bool)
+    for ring in rings:
+      ring = np.asarray(ring, dtype='float64')[:,:2]
+      x0, y0 = ring[:,0], ring[:,1]
+      x1, y1 = np.roll(x0,-1), np.roll(y0,-1)
+      for k in range(len(ring)):
+        if y0[k] == y1[k]:
+          continue # Horizontal edges never cross the ray
+        crosses = (y0[k] > y) != (y1[k] > y)
+        xc = x0[k] + (y - y0[k]) * (x1[k] - x0[k]) / (y1[k] - y0[k])
+        odd ^= crosses & (x < xc)
+    result |= odd
+  return result
+
+
+def cell_fractions(lat, lon, polygons, samples=SAMPLES):
+  '''Calculate the fraction of each model cell covered by the polygons
+
+  Each cell is sub-sampled on a samples x samples pattern, using the local grid spacing to place the points.
+  Returns the flat indices of the covered cells and their fractions.'''
+  dlat_i, dlat_j = np.gradient(lat)
+  dlon_i, dlon_j = np.gradient(lon)
+
+  # Only test the cells near the polygons
+  allpts = np.concatenate([np.asarray(ring, dtype='float64')[:,:2] for rings in polygons for ring in rings])
+  margin = np.hypot(np.abs(dlat_i).max() + np.abs(dlat_j).max(), np.abs(dlon_i).max() + np.abs(dlon_j).max())
+  near = np.flatnonzero((lon.ravel() >= allpts[:,0].min() - margin) & (lon.ravel() <= allpts[:,0].max() + margin) &
+                        (lat.ravel() >= allpts[:,1].min() - margin) & (lat.ravel() <= allpts[:,1].max() + margin))
+  offsets = (np.arange(samples) + 0.5) / samples - 0.5
+  a, b = [o.ravel() for o in np.meshgrid(offsets, offsets, indexing='ij')]
+  slat = lat.ravel()[near,None] + a * dlat_i.ravel()[near,None] + b * dlat_j.ravel()[near,None]
+  slon = lon.ravel()[near,None] + a * dlon_i.ravel()[near,None] + b * dlon_j.ravel()[near,None]
+  fraction = inside(slon, slat, polygons).mean(axis=1)
+  covered = fraction > 0
+  return near[covered], fraction[covered]
+
+
+def mask_file(lat, lon, areas, samples=SAMPLES, directory=MASK_DIRECTORY):
+  '''Name the mask file for a model grid and set of areas'''
+  key = hashlib.sha1()
+  key.update(np.ascontiguousarray(lat, dtype='float32').tobytes())
+  key.update(np.ascontiguousarray(lon, dtype='float32').tobytes())
+  key.update(json.dumps([areas, samples]).encode())
+  return os.path.join(directory, 'wrf_areas_%s.npz' % key.hexdigest()[:16])
+
+
+def compute_masks(lat, lon, areas, samples=SAMPLES):
+  '''Rasterize the areas into a (area, cell) weight matrix over the union of their cells
+
+  An area smaller than the sub-sampling gets the single model cell nearest its center.'''
+  found = []
+  for name, polygons in areas:
+    cells, fraction = cell_fractions(lat, lon, polygons, samples)
+    if len(cells) == 0:
+      ring = np.asarray(polygons[0][0], dtype='float64')
+      cells = np.array([(abs(lat - ring[:,1].mean()) + abs(lon - ring[:,0].mean())).argmin()])
+      fraction = np.ones(1)
+      print('Area %s is smaller than a model cell, using the nearest cell' % name)
+    found.append((cells, fraction))
+  union = np.unique(np.concatenate([cells for cells, fraction in found]))
+  weights = np.zeros((len(areas), len(union)), dtype='float64')
+  for k, (cells, fraction) in enumerate(found):
+    weights[k, np.searchsorted(union, cells)] = fraction
+  return union, weights
+
+
+def load_masks(lat, lon, areas, samples=SAMPLES, directory=MASK_DIRECTORY):
+  '''Load the masks for a model grid and set of areas, calculating and saving them the first time'''
+  filename = mask_file(lat, lon, areas, samples, directory)
+  if os.path.exists(filename):
+    with np.load(filename) as f:
+      cells, weights = f['cells'], f['weights']
+    print('Using area masks ' + filename)
+  else:
+    cells, weights = compute_masks(lat, lon, areas, samples)
+    tmp_file = filename + '.tmp.npz'
+    np.savez_compressed(tmp_file, cells=cells, weights=weights, names=np.array([name for name, polygons in areas]),
+      shape=np.array(lat.shape))
+    os.replace(tmp_file, filename)
+    print('Saved area masks ' + filename)
+  clat, clon = lat.ravel()[cells], lon.ravel()[cells]
+  return {'cells':cells, 'weights':weights, 'file':filename, 'shape':lat.shape,
+          'latitude':weights.dot(clat) / weights.sum(axis=1), 'longitude':weights.dot(clon) / weights.sum(axis=1),
+          'cell_count':weights.sum(axis=1)}
+
+
+def reduce_layer(masks, values, how='mean'):
+  '''Reduce the values of the masked cells to one value per area, skipping missing values
+
+  The values are the layer at masks['cells'] (or a full 2D layer).  The mean is weighted by the fraction of
+  each cell inside the area, and the sum adds up each cell's value times its fraction.'''
+  values = np.asarray(values, dtype='float64')
+  if values.shape == tuple(masks['shape']):
+    values = values.ravel()[masks['cells']]
+  valid = np.isfinite(values)
+  total = masks['weights'].dot(np.where(valid, values, 0))
+  if how == 'sum':
+    return np.where(masks['weights'].dot(valid) > 0, total, np.nan)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return total / masks['weights'].dot(valid)
+
+
+#------------------------------
+def extract_areas(start_date, days, areas, source='nc', variables=None, heights=points.HEIGHTS, forecast_offset=6,
+                  directory=None, reader='auto', how='mean', mask_directory=MASK_DIRECTORY, samples=SAMPLES):
+  '''Extract a dataset of the selected variables reduced over each area
+
+  The masks are loaded (or calculated) for the first file, and again whenever the model grid changes.  Wind
+  speed and power are calculated for each cell before they are reduced, so they are not underestimated
+  where the wind direction varies across an area.'''
+  if directory is None:
+    directory = sources.DIRECTORIES[source]
+  if variables is None:
+    variables = points.DEFAULT_VARIABLES[source]
+  variables = catalog.parse_variables(variables)
+  read_vars = catalog.source_variables(variables, source)
+  heights = np.array(heights, dtype='int32')
+  wind = 'u_velocity' in variables and 'v_velocity' in variables
+  power_curve = derive.load_power_curve() if wind else None
+
+  #------------------------------
+  # Setup default arrays
+  names = np.array([name for name, polygons in areas]).astype('S')
+  times = pd.date_range(start_date, common.end_date(start_date,days), freq="h")
+  arrays = {}
+  for name in read_vars:
+    arrays[name] = catalog.make_array(name, times, names, heights)
+  cell_speed = catalog.make_array('u_velocity', times, names, heights)
+  cell_power = catalog.make_array('u_velocity', times, names, heights)
+  steps = [(t, sources.make_wrf_file(source,t,forecast_offset)) for t in times]
+  reader_cls, probe_times = readers.select_for_files([directory + f for t,f in steps], source, 'grid',
+    read_vars, heights, reader)
+  if reader_cls is None: # None of the files exist
+    return None
+
+  #------------------------------
+  masks = None
+  grid = None
+  for t, wrf_file in steps:
+    try:
+      handle = reader_cls(directory + wrf_file, source)
+    except readers.READ_ERRORS:
+      print('Could not open ' + wrf_file)
+      continue
+    try:
+      lat, lon = handle.latlon()
+      if grid is None or lat.shape != grid[0].shape or not (np.array_equal(lat, grid[0]) and np.array_equal(lon, grid[1])):
+        grid = (lat, lon)
+        masks = load_masks(lat, lon, areas, samples, mask_directory)
+      print('Processing: ' + str(t) + ' File: ' + wrf_file)
+
+      # Read each selected layer once, keeping only the masked cells
+      cells = {}
+      for name in read_vars:
+        for h,source_var in catalog.layers(name, source, heights):
+          cells[(name,h)] = np.asarray(handle.read(name, h), dtype='float64').ravel()[masks['cells']]
+          loc = {'time':t} if h is None else {'time':t, 'height':h}
+          arrays[name].loc[loc] = reduce_layer(masks, cells[(name,h)], how)
+      if wind:
+        for h in heights:
+          ws = np.hypot(cells[('u_velocity',h)], cells[('v_velocity',h)])
+          cell_speed.loc[{'time':t, 'height':h}] = reduce_layer(masks, ws, how)
+          cell_power.loc[{'time':t, 'height':h}] = reduce_layer(masks,
+            np.where(np.isfinite(ws), np.interp(ws, power_curve['Wind Speed'], power_curve['Power']), np.nan), how)
+    except readers.READ_ERRORS as e:
+      print('Could not read %s: %s' % (wrf_file, e))
+    finally:
+      handle.close()
+
+  if masks is None:
+    return None
+
+  #------------------------------
+  # Output variables, with the wind speed and power of each cell reduced over the areas
+  final_dataset = xr.Dataset(points.output_variables(arrays, variables))
+  if wind:
+    final_dataset['wind_speed'] = final_dataset['wind_speed'].copy(data=cell_speed.values)
+    final_dataset['wind_power'] = final_dataset['wind_power'].copy(data=cell_power.values)
+    final_dataset['wind_speed'].attrs['comment'] = 'Wind Speed is calculated from the Zonal and Meridional wind speeds of each model cell, before the cells are combined.'
+    final_dataset['wind_dir'].attrs['comment'] = 'The direction from which winds are coming from, in degrees clockwise from true N, calculated from the combined Zonal and Meridional wind speeds.'
+  final_dataset = final_dataset.rename({'station':'area'})
+  final_dataset['area'].attrs = {'long_name':'Area Name', 'comment':'The name of each polygon area the model cells are combined over.'}
+  final_dataset['latitude'] = ('area', masks['latitude'], {'units':'degrees_north', 'standard_name':'latitude',
+    'long_name':'Latitude', 'comment':'The mean latitude of the model cells in the area.'})
+  final_dataset['longitude'] = ('area', masks['longitude'], {'units':'degrees_east', 'standard_name':'longitude',
+    'long_name':'Longitude', 'comment':'The mean longitude of the model cells in the area.'})
+  final_dataset['cell_count'] = ('area', masks['cell_count'], {'long_name':'Model Cells in Area',
+    'comment':'The number of model cells covered by the area, counting partly covered cells by the fraction inside it.'})
+  for name in final_dataset.data_vars:
+    if 'time' in final_dataset[name].dims:
+      final_dataset[name].attrs['cell_methods'] = 'area: %s where area (fraction weighted)' % how
+
+  # Add global metadata
+  ftype = {'nc':'NetCDF', 'grib':'GRIB'}[source]
+  final_dataset.attrs['forecast_offset'] = forecast_offset
+  final_dataset.attrs['source'] = source
+  final_dataset.attrs['source_directory'] = directory
+  if reader_cls is not None:
+    final_dataset.attrs['reader'] = readers.describe(reader_cls, probe_times)
+  final_dataset.attrs['area_reduction'] = how
+  final_dataset.attrs['area_masks'] = os.path.basename(masks['file'])
+  final_dataset.attrs['date_created'] = str(datetime.today())
+
+  final_dataset.attrs['acknowledgement'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_name'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_url'] = "https://rucool.marine.rutgers.edu"
+  final_dataset.attrs['creator_email'] = "sage@marine.rutgers.edu"
+  final_dataset.attrs['summary'] = "Wind data extracted from %s files produced by Rutgers University's 3km WRF model run and combined over each area.  The model is run daily at 00Z and forecast files are saved every hour.  Times in this file are UTC based on the forecast run times.  Each value is the %s of the model cells inside the area, weighted by the fraction of each cell inside it.  The forecast_offset specifies how many hours of model spin up are allowed before the data is used." % (ftype, how)
+  final_dataset.attrs['project'] = "RU COOL BPU Wind Energy Project"
+  final_dataset.attrs['title'] = "Rutgers WRF 3km Model output over selected areas"
+  final_dataset.attrs['Conventions'] = 'CF-1.6'
+  return final_dataset
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  # Specify Date Range to Process
+  start_date = common.parse_date(args.date)
+  end_date = common.end_date(start_date,args.days)
+
+  final_dataset = extract_areas(start_date, args.days, read_areas(args.areas), source=args.source,
+    variables=args.variables, heights=args.heights, forecast_offset=args.forecast_offset, directory=args.directory,
+    reader=args.reader, how=args.reduce, mask_directory=args.weights_dir)
+  if final_dataset is None:
+    print('No data found, skipping.')
+    return
+  final_dataset.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+  plan.record_run(args, (datetime.now() - script_start_time).total_seconds())
+
+  # Output final datafile
+  output_datafile = common.output_filename(args.prefix, start_date, end_date)
+  final_dataset.to_netcdf(output_datafile, encoding=points.make_encoding(final_dataset))
+  print('Outputted ' + output_datafile)
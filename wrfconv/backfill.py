@@ -0,0 +1,147 @@
+# Fill the missing hours of a point extraction file from alternate model runs
+# Like the gap filling in wrf2nc.py, an hour whose usual model file was missing can be taken from the previous
+# day's run (forecast hour + 24) or the same day's run.  Only the missing hours are read and patched in.
+
+import os
+from datetime import datetime,timedelta
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import catalog, common, derive, merge, points, readers, sources, update
+
+
+#------------------------------
+def missing_hours(ds):
+  '''Find the times where every value of an extracted variable is missing'''
+  missing = np.zeros(len(ds['time']), dtype=bool)
+  for name in [v for v in ds.data_vars if v in catalog.VARIABLES]:
+    others = [d for d in ds[name].dims if d != 'time']
+    missing |= ds[name].isnull().all(others).values
+  return pd.DatetimeIndex(ds['time'].values[missing])
+
+
+def alternate_files(source, t, forecast_offset=6):
+  '''List the (run, forecast hour, filename) options for a time, in order of preference
+
+  The usual file for the forecast offset comes first, then the previous day's run and the same day's run.'''
+  day = datetime(t.year, t.month, t.day)
+  runs = [day - timedelta(1) if t.hour < forecast_offset else day, day - timedelta(1), day]
+  options = []
+  for run in runs:
+    hour = int((t - run).total_seconds() // 3600)
+    option = (run, hour, sources.make_run_file(source, run, hour))
+    if option not in options:
+      options.append(option)
+  return options
+
+
+def add_provenance(ds):
+  '''Add the variables recording which model run filled each hour, if they are not there already'''
+  if 'backfill_run' not in ds:
+    ds['backfill_run'] = xr.DataArray(np.full(len(ds['time']), np.datetime64('NaT'), dtype='datetime64[ns]'),
+      coords={'time':ds['time']}, dims=['time'], attrs={
+        'long_name':'Backfill Model Run',
+        'comment':'The model run used for hours filled in by wrfconv backfill, empty for hours from the usual forecast_offset file.'})
+    ds['backfill_lead_time'] = xr.DataArray(np.full(len(ds['time']), -1, dtype='int32'),
+      coords={'time':ds['time']}, dims=['time'], attrs={
+        'units':'hours',
+        'long_name':'Backfill Forecast Hour',
+        'comment':'The forecast hour of backfill_run used for hours filled in by wrfconv backfill, -1 for hours from the usual forecast_offset file.'})
+  return ds
+
+
+def backfill_points(ds, directory=None, reader='auto'):
+  '''Re-extract the missing hours of a point dataset from alternate model runs
+
+  Any wind resource diagnostics in the dataset are recalculated for the filled hours, including the density
+  corrected power from the psfc and t2 read along with them.  Returns the patched dataset and a list of
+  (time, filename) for the hours that were filled.'''
+  if 'lead_time' in ds.dims:
+    raise ValueError('Lead time cubes keep every model run, so there are no alternate runs to fill them from')
+  source = update.guess_source(ds)
+  if directory is None:
+    directory = ds.attrs.get('source_directory', sources.DIRECTORIES[source])
+  forecast_offset = int(ds.attrs.get('forecast_offset',6))
+  variables = [v for v in ds.data_vars if v in catalog.VARIABLES]
+  read_vars = catalog.source_variables(variables, source)
+  heights = ds['height'].values if 'height' in ds.coords else points.HEIGHTS
+  sites = update.file_sites(ds)
+
+  # Find the available model files for each missing hour
+  todo = []
+  for t in missing_hours(ds):
+    options = [(run, hour, wrf_file) for run, hour, wrf_file in alternate_files(source, t, forecast_offset)
+               if os.path.exists(directory + wrf_file)]
+    if options:
+      todo.append((t, options))
+    else:
+      print('No model run found for ' + str(t))
+  if not todo:
+    return ds, []
+
+  reader_cls, probe_times = readers.select_for_files([directory + f for t,options in todo for r,h,f in options], source,
+    'points', read_vars, heights, reader)
+  arrays = {}
+  for name in read_vars:
+    arrays[name] = catalog.make_array(name, pd.DatetimeIndex([t for t,options in todo]), ds['station'].values, heights)
+
+  # Extract the selected variables for each missing hour, from the first of its model files that can be read
+  filled = []
+  for t, options in todo:
+    for run, hour, wrf_file in options:
+      try:
+        values = points.extract_file(directory + wrf_file, reader_cls, source, sites, read_vars, heights)
+        print('Filling: ' + str(t) + ' File: ' + wrf_file)
+        break
+      except readers.READ_ERRORS:
+        print('Could not open ' + wrf_file)
+    else:
+      continue
+    for (name,h),v in values.items():
+      loc = {'time':t}
+      if h is not None:
+        loc['height'] = h
+      arrays[name].loc[loc] = v
+    filled.append((t, run, hour, wrf_file))
+  if not filled:
+    return ds, []
+
+  # Patch the filled hours into the dataset
+  times = pd.DatetimeIndex([t for t,r,h,f in filled])
+  patch = points.output_variables(arrays, variables, diagnostics=len(derive.diagnostic_names(ds.data_vars)) > 0)
+  for name, da in patch.items():
+    if name in ds:
+      ds[name].loc[{'time':times}] = da.sel(time=times).transpose(*ds[name].dims).values
+  ds = add_provenance(ds)
+  ds['backfill_run'].loc[{'time':times}] = np.array([r for t,r,h,f in filled], dtype='datetime64[ns]')
+  ds['backfill_lead_time'].loc[{'time':times}] = [h for t,r,h,f in filled]
+  history = '%s: backfilled %d hours from alternate model runs' % (datetime.today().strftime('%Y-%m-%d %H:%M:%S'), len(filled))
+  ds.attrs['history'] = (ds.attrs['history'] + '\n' + history) if 'history' in ds.attrs else history
+  return ds, [(t,f) for t,r,h,f in filled]
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  ds = xr.open_dataset(args.file)
+  ds.load()
+  ds.close()
+  missing = len(missing_hours(ds))
+  if missing == 0:
+    print('No missing hours in ' + args.file)
+    return
+  dsout, filled = backfill_points(ds, args.directory, args.reader)
+  print('Filled %d of %d missing hours' % (len(filled), missing))
+  if not filled:
+    return
+
+  dsout.attrs['date_modified'] = str(datetime.today())
+  dsout.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+  output_datafile = args.output or args.file
+  encoding = points.make_encoding(dsout)
+  for name, var_encoding in merge.file_encoding(ds, dim=None).items(): # Keep the packing and chunks the file was written with
+    encoding.setdefault(name, {}).update(var_encoding)
+  common.replace_netcdf(dsout, output_datafile, encoding)
+  print('Outputted ' + output_datafile)
@@ -0,0 +1,180 @@
+# Local cache of the values extracted from each model file
+# Entries are keyed by the model file (path, size and modification time) and hold the values of each layer at the
+# grid cells extracted so far, so reruns over overlapping dates, and runs with added stations, only read the files
+# and cells that have not been extracted before.  The least recently used entries are removed to fit a size limit.
+
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+from wrfconv import catalog, memory, points
+
+#------------------------------
+CACHE_DIRECTORY = '~/.cache/wrfconv'
+CACHE_SIZE = 2 * 1024**3
+
+
+#------------------------------
+def layer_key(name, height):
+  '''Name the arrays of a variable and height in a cache entry'''
+  return name if height is None else '%s@%d' % (name, height)
+
+
+class ExtractionCache(object):
+  '''Cache of the point values extracted from each model file'''
+
+  def __init__(self, directory=CACHE_DIRECTORY, max_size=CACHE_SIZE):
+    self.directory = os.path.expanduser(directory)
+    self.max_size = max_size
+    self.grids = {}  # Model grids by id
+    self.cells = {}  # Station cells by grid id
+    self.hits = 0    # Files fully extracted from the cache
+    self.reads = 0   # Files opened
+    os.makedirs(self.directory, exist_ok=True)
+    self.entries, self.total = self.scan()
+
+  def file_key(self, path):
+    '''Identify a model file by its path, size and modification time'''
+    st = os.stat(path)
+    return hashlib.sha1(('%s|%d|%d' % (os.path.abspath(path), st.st_size, st.st_mtime_ns)).encode()).hexdigest()
+
+  def entry_file(self, key):
+    return os.path.join(self.directory, key[:2], key + '.npz')
+
+  def load(self, key):
+    '''Load a cache entry as {layer: (cells, values)} and its grid id, or (None, None) if it is not cached'''
+    filename = self.entry_file(key)
+    try:
+      with np.load(filename) as f:
+        layers = dict([(k[:-6], (f[k], f[k[:-6] + ':values'])) for k in f.files if k.endswith(':cells')])
+        grid_id = str(f['grid'])
+    except (IOError, OSError, ValueError, KeyError):
+      return None, None
+    os.utime(filename) # Mark as recently used
+    if filename in self.entries:
+      self.entries.move_to_end(filename)
+    return layers, grid_id
+
+  def save(self, key, layers, grid_id):
+    '''Save a cache entry, then remove the least recently used entries if the cache is over its size limit'''
+    filename = self.entry_file(key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    arrays = {'grid':np.array(grid_id)}
+    for k, (cells, values) in layers.items():
+      arrays[k + ':cells'] = cells
+      arrays[k + ':values'] = values
+    tmp_file = filename + '.tmp.npz'
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, filename)
+    self.total += os.path.getsize(filename) - self.entries.pop(filename, 0)
+    self.entries[filename] = os.path.getsize(filename)
+    self.evict()
+
+  def grid(self, grid_id):
+    '''Load a cached model grid'''
+    if grid_id not in self.grids:
+      with np.load(os.path.join(self.directory, 'grid_%s.npz' % grid_id)) as f:
+        self.grids[grid_id] = (f['lat'], f['lon'])
+    return self.grids[grid_id]
+
+  def save_grid(self, lats, lons):
+    '''Save a model grid, returning its id'''
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(lats, dtype='float32').tobytes())
+    key.update(np.ascontiguousarray(lons, dtype='float32').tobytes())
+    grid_id = key.hexdigest()[:16]
+    filename = os.path.join(self.directory, 'grid_%s.npz' % grid_id)
+    if not os.path.exists(filename):
+      tmp_file = filename + '.tmp.npz'
+      np.savez(tmp_file, lat=lats, lon=lons)
+      os.replace(tmp_file, filename)
+    self.grids[grid_id] = (lats, lons)
+    return grid_id
+
+  def station_cells(self, grid_id, sites):
+    '''Find the flat grid index of the model cell nearest each station'''
+    key = (grid_id, sites['latitude'].values.tobytes(), sites['longitude'].values.tobytes())
+    if key not in self.cells:
+      lats, lons = self.grid(grid_id)
+      ii,jj = points.nearest_points(lats, lons, sites)
+      self.cells[key] = np.ravel_multi_index((ii,jj), lats.shape)
+    return self.cells[key]
+
+  def scan(self):
+    '''List the cache entries once, as an {entry file: size} OrderedDict from least to most recently used, and
+    their total size, which is then kept up to date as entries are saved and removed'''
+    entries = []
+    for root, dirs, files in os.walk(self.directory):
+      for f in files:
+        if f.endswith('.npz') and not f.startswith('grid_') and not f.endswith('.tmp.npz'):
+          st = os.stat(os.path.join(root, f))
+          entries.append((st.st_mtime, os.path.join(root, f), st.st_size))
+    entries.sort()
+    return OrderedDict([(filename, size) for mtime, filename, size in entries]), sum([e[2] for e in entries])
+
+  def evict(self):
+    '''Remove the least recently used entries until the cache fits its size limit'''
+    while self.total > self.max_size and self.entries:
+      filename, size = self.entries.popitem(last=False)
+      self.total -= size
+      try:
+        os.remove(filename)
+      except OSError:
+        pass # Already removed, e.g. by another run sharing the cache
+
+  #------------------------------
+  def extract_file(self, path, reader, source, sites, read_vars, heights):
+    '''Extract the selected variables at each station from one WRF file, like points.extract_file
+
+    Only the layers and cells missing from the cache entry for the file are read.'''
+    key = self.file_key(path)
+    layers, grid_id = self.load(key)
+    if layers is None:
+      layers = {}
+    wanted = [(name, h) for name in read_vars for h,source_var in catalog.layers(name, source, heights)]
+
+    handle = None
+    try:
+      if grid_id is None:
+        handle = reader(path, source)
+        grid_id = self.save_grid(*handle.latlon())
+      cells = self.station_cells(grid_id, sites)
+      shape = self.grid(grid_id)[0].shape
+
+      # Read the cells of each layer that are not cached yet
+      changed = False
+      for name, h in wanted:
+        stored_cells, stored_values = layers.get(layer_key(name, h), (np.zeros(0, dtype='int64'), np.zeros(0)))
+        need = np.setdiff1d(cells, stored_cells)
+        if len(need) == 0:
+          continue
+        if handle is None:
+          handle = reader(path, source)
+        ii,jj = np.unravel_index(need, shape)
+        values = np.asarray(handle.read_points(name, h, ii, jj), dtype='float64')
+        all_cells = np.concatenate([stored_cells, need])
+        order = np.argsort(all_cells)
+        layers[layer_key(name, h)] = (all_cells[order], np.concatenate([stored_values, values])[order])
+        changed = True
+    finally:
+      if handle is not None:
+        handle.close()
+    if changed:
+      self.save(key, layers, grid_id)
+      self.reads += 1
+    else:
+      self.hits += 1
+
+    values = {}
+    for name, h in wanted:
+      stored_cells, stored_values = layers[layer_key(name, h)]
+      values[(name,h)] = stored_values[np.searchsorted(stored_cells, cells)]
+    return values
+
+  def size(self):
+    '''Return the total size of the cache files in bytes'''
+    return sum([os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(self.directory) for f in files])
+
+  def report(self):
+    '''Summarize the cache use of a run'''
+    return '%d files from the cache, %d read, cache size %s' % (self.hits, self.reads, memory.format_size(self.total))
@@ -0,0 +1,210 @@
+# Variable catalog for the RU-WRF point extractors
+# Maps each output variable to its source in the NetCDF (wrfproc) and GRIB (RUWRF) model files,
+# so any selected set of variables can be pulled from the same read of each file.
+# numpy and xarray are only imported when arrays are created, so the command line can list the catalog quickly.
+
+#------------------------------
+# Output variable catalog
+#   heights - True if the variable is extracted at several heights, False for surface fields
+#   nc      - NetCDF source as (variable, level index), or a {height: source} dict
+#   grib    - GRIB source as (message name, message index), or a {height: source} dict
+#   pynio   - GRIB source when read with PyNIO, as (variable, height)
+#   column  - Source of every model level for profiles, as {file type: (variable, first level height, level spacing)}.
+#             A first height of None means the level heights are read from the file.
+#   derive  - For calculated variables, the catalog variables it is derived from
+#   attrs   - CF attributes written to the output file
+# A source of None means the variable is not available from that file type.
+VARIABLES = {
+  'u_velocity': {
+    'heights': True,
+    'nc': {10:('U10',None), 100:('U',7), 120:('U',9), 140:('U',11)},
+    'grib': {10:('10 metre U wind component',0), 50:('U component of wind',3), 100:('U component of wind',8),
+             120:('U component of wind',10), 140:('U component of wind',12)},
+    'pynio': dict([(h,('UGRD_P0_L103_GLC0',h)) for h in [10,50,100,120,140]]),
+    'column': {'nc':('U',30,10), 'grib':('U component of wind',20,10), 'pynio':('UGRD_P0_L103_GLC0',None,None)},
+    'attrs': {
+      'units':'m s-1',
+      'standard_name':'eastward_wind',
+      'long_name':'Wind Speed, Zonal',
+      'comment':'The zonal wind speed (m/s) indicates the u (positive eastward) component of where the wind is going.',
+    },
+  },
+  'v_velocity': {
+    'heights': True,
+    'nc': {10:('V10',None), 100:('V',7), 120:('V',9), 140:('V',11)},
+    'grib': {10:('10 metre V wind component',0), 50:('V component of wind',3), 100:('V component of wind',8),
+             120:('V component of wind',10), 140:('V component of wind',12)},
+    'pynio': dict([(h,('VGRD_P0_L103_GLC0',h)) for h in [10,50,100,120,140]]),
+    'column': {'nc':('V',30,10), 'grib':('V component of wind',20,10), 'pynio':('VGRD_P0_L103_GLC0',None,None)},
+    'attrs': {
+      'units':'m s-1',
+      'standard_name':'northward_wind',
+      'long_name':'Wind Speed, Meridional',
+      'comment':'The meridional wind speed (m/s) indicates the v (positive northward) component of where the wind is going.',
+    },
+  },
+  't2': {
+    'heights': False,
+    'nc': ('T2',None),
+    'grib': ('2 metre temperature',0),
+    'attrs': {
+      'units':'K',
+      'standard_name':'air_temperature',
+      'long_name':'Air Temperature at 2m',
+      'comment':'Air temperature 2 meters above the surface.',
+    },
+  },
+  'psfc': {
+    'heights': False,
+    'nc': ('PSFC',None),
+    'grib': ('Surface pressure',0),
+    'attrs': {
+      'units':'Pa',
+      'standard_name':'surface_air_pressure',
+      'long_name':'Surface Pressure',
+      'comment':'Air pressure at the model surface.',
+    },
+  },
+  'sst': {
+    'heights': False,
+    'nc': ('SST',None),
+    'grib': None,
+    'attrs': {
+      'units':'K',
+      'standard_name':'sea_surface_temperature',
+      'long_name':'Sea Surface Temperature',
+      'comment':'Sea surface temperature used by the model.  Values over land are not meaningful.',
+    },
+  },
+  'swdown': {
+    'heights': False,
+    'nc': ('SWDOWN',None),
+    'grib': ('Downward short-wave radiation flux',0),
+    'attrs': {
+      'units':'W m-2',
+      'standard_name':'surface_downwelling_shortwave_flux_in_air',
+      'long_name':'Shortwave down',
+      'comment':'Downward shortwave flux at ground surface.',
+    },
+  },
+  'air_density': {
+    'heights': False,
+    'derive': ['psfc','t2'],
+    'attrs': {
+      'units':'kg m-3',
+      'standard_name':'air_density',
+      'long_name':'Air Density',
+      'comment':'Air density near the surface, calculated from the surface pressure and 2m air temperature using the ideal gas law for dry air.',
+    },
+  },
+}
+
+R_DRY = 287.05 # Gas constant for dry air (J kg-1 K-1)
+
+
+#------------------------------
+def parse_variables(names):
+  '''Check a comma separated list (or list) of catalog variables'''
+  if isinstance(names, str):
+    names = [n.strip() for n in names.split(',') if n.strip()]
+  for name in names:
+    if name not in VARIABLES:
+      raise ValueError('Unknown variable %s, please choose from: %s' % (name, ', '.join(VARIABLES)))
+  return list(names)
+
+
+def source_variables(names, ftype):
+  '''List the variables that need to be read from the model files, including those needed for derived variables'''
+  out = []
+  for name in names:
+    for n in VARIABLES[name].get('derive', [name]):
+      if VARIABLES[n].get(ftype) is None:
+        raise ValueError('Variable %s is not available from %s files' % (n, ftype))
+      if n not in out:
+        out.append(n)
+  return out
+
+
+def layers(name, ftype, heights):
+  '''Return a list of (height, source) pairs to read for a variable, height is None for surface fields'''
+  source = VARIABLES[name][ftype]
+  if not VARIABLES[name]['heights']:
+    return [(None, source)]
+  missing = [h for h in heights if h not in source]
+  if missing:
+    raise ValueError('Variable %s is not available at heights %s in %s files' % (name, missing, ftype))
+  return [(h, source[h]) for h in heights]
+
+
+def layer_source(name, ftype, height=None):
+  '''Return the source of a variable at one height (None for surface fields)'''
+  source = VARIABLES[name].get(ftype)
+  if source is None:
+    raise ValueError('Variable %s is not available from %s files' % (name, ftype))
+  if not VARIABLES[name]['heights']:
+    return source
+  if height not in source:
+    raise ValueError('Variable %s is not available at height %s in %s files' % (name, height, ftype))
+  return source[height]
+
+
+def column_source(name, ftype):
+  '''Return the (variable, first level height, level spacing) source of every model level of a variable'''
+  source = VARIABLES[name].get('column', {}).get(ftype)
+  if source is None:
+    raise ValueError('Variable %s is not available as a profile from %s files' % (name, ftype))
+  return source
+
+
+#------------------------------
+def make_array(name, times, stations, heights, dtype='float64'):
+  '''Create an empty DataArray for a catalog variable'''
+  import numpy as np
+  import xarray as xr
+  if VARIABLES[name]['heights']:
+    data = np.full((len(times),len(stations),len(heights)), np.nan, dtype=dtype)
+    da = xr.DataArray(data, coords=[times, stations, heights], dims=['time','station','height'])
+    da['height'].attrs['units'] = 'm'
+    da['height'].attrs['standard_name'] = 'height'
+    da['height'].attrs['long_name'] = 'Height'
+  else:
+    data = np.full((len(times),len(stations)), np.nan, dtype=dtype)
+    da = xr.DataArray(data, coords=[times, stations], dims=['time','station'])
+  da.attrs.update(VARIABLES[name]['attrs'])
+
+  da['time'].attrs['standard_name'] = 'time'
+  da['time'].attrs['long_name'] = 'Time'
+
+  da['station'].attrs['standard_name'] = 'station_id'
+  da['station'].attrs['long_name'] = 'Station ID'
+  da['station'].attrs['comment'] = 'A string specifying a unique station ID, created to allow easy referencing of the selected grid points extracted from the WRF model files.'
+  return da
+
+
+def derive(name, arrays):
+  '''Calculate a derived catalog variable from the variables already extracted'''
+  if name == 'air_density':
+    da = arrays['psfc'] / (R_DRY * arrays['t2'])
+  else:
+    raise ValueError('No derivation available for %s' % name)
+  da.attrs = dict(VARIABLES[name]['attrs'])
+  return da
+
+
+#------------------------------
+def read_nc_layer(ncdata, source):
+  '''Read a 2D layer from an open NetCDF dataset'''
+  var, level = source
+  if level is None:
+    return ncdata[var][0].values
+  return ncdata[var][0][level].values
+
+
+def read_grib_layer(grbfile, source, cache=None):
+  '''Read a 2D layer from an open pygrib file, reusing selected messages from cache'''
+  name, index = source
+  if cache is None:
+    cache = {}
+  if name not in cache:
+    cache[name] = grbfile.select(name=name)
+  return cache[name][index].values
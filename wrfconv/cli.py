@@ -0,0 +1,448 @@
+# wrfconv - Command line interface for the RU-WRF extraction tools
+# Only the standard library is imported here.  Each subcommand imports its own module (and numpy, xarray,
+# pygrib, PyNIO, etc.) when it runs, so cron and job-array invocations only pay for what they use.
+
+import argparse
+from wrfconv import common
+from wrfconv.catalog import VARIABLES
+from wrfconv.memory import parse_size
+from wrfconv.sources import DOMAINS, SOURCES
+
+#------------------------------
+def add_date_arguments(parser, days=True, forecast_offset=True):
+  '''Add the date range arguments shared by the extractors'''
+  parser.add_argument('date',
+    help='Specify a date to process in yyyymmdd format')
+  if days:
+    parser.add_argument('-d','--days', type=int,
+      default=1,
+      help='Number of days to process')
+    parser.add_argument('--shard', type=shard_spec,
+      help='Only process shard i of N (i/N, from 1/N to N/N) of the days, for job arrays.  '
+        'Each shard gets a contiguous block of whole days, and the outputs can be combined with wrfconv merge')
+    parser.add_argument('--plan', action='store_true',
+      help='Only list the model files the run would read, without opening them, and estimate its runtime and peak memory')
+  if forecast_offset:
+    parser.add_argument('-f','--forecast_offset', type=int,
+      default=6,
+      help='Forecast hour to begin model run with (from 0 to 23)')
+
+
+def shard_spec(value):
+  '''Parse an i/N shard number'''
+  try:
+    shard, nshards = [int(v) for v in value.split('/')]
+  except ValueError:
+    raise argparse.ArgumentTypeError('Please specify the shard as i/N, e.g. 3/12')
+  if not 1 <= shard <= nshards:
+    raise argparse.ArgumentTypeError('The shard number must be from 1 to %d' % nshards)
+  return shard, nshards
+
+
+def heights_list(value):
+  '''Parse a comma separated list of heights'''
+  return [int(h) for h in value.split(',')]
+
+
+def factors_list(value):
+  '''Parse a comma separated list of coarsening factors'''
+  factors = [int(f) for f in value.split(',')]
+  if min(factors) < 2:
+    raise argparse.ArgumentTypeError('Coarsening factors must be 2 or more')
+  return factors
+
+
+def bbox_list(value):
+  '''Parse a lat_min,lat_max,lon_min,lon_max box'''
+  bbox = [float(v) for v in value.split(',')]
+  if len(bbox) != 4:
+    raise argparse.ArgumentTypeError('Please specify the box as lat_min,lat_max,lon_min,lon_max')
+  return bbox
+
+
+def add_reader_argument(parser):
+  '''Add the model file reader option'''
+  parser.add_argument('--reader', type=str,
+    default='auto',
+    help='Library used to read the model files (xarray, netcdf4, h5netcdf, pygrib, eccodes or pynio), '
+      'by default the fastest installed reader is chosen by timing each on the first file')
+
+
+def add_memory_argument(parser):
+  '''Add the memory budget option'''
+  parser.add_argument('--max-memory', type=parse_size,
+    help='Memory budget for the run, e.g. 4G.  Buffers are sized (and grids written in batches) to fit it, '
+      'and the peak memory of each stage is saved in the memory_report attribute')
+
+
+def add_encoding_arguments(parser):
+  '''Add the output packing and chunking options'''
+  parser.add_argument('--pack', action='store_true',
+    help='Pack the variables as int16 within their declared precision (0.01 m/s for winds, see wrfconv/packing.py), '
+      'or float32 for variables without one')
+  parser.add_argument('--chunks', choices=['map','series'],
+    help='Chunk the output for map reads (one time step per chunk) or time series reads (long, narrow chunks)')
+
+
+def add_stats_argument(parser):
+  '''Add the statistics output option'''
+  parser.add_argument('--stats', nargs='?', const='with', choices=['with','only'],
+    help='Also write a statistics file (means, standard deviations, percentiles, diurnal cycles, wind speed '
+      'histograms and wind roses) calculated during the extraction, or with "--stats only" write it instead of the time series')
+
+
+def add_aggregate_argument(parser):
+  '''Add the aggregated output option'''
+  parser.add_argument('--aggregate', nargs='?', const='with', choices=['with','only'],
+    help='Also write a file of daily means, monthly means and monthly mean diurnal cycles (including wind speed and '
+      'power) calculated during the extraction, or with "--aggregate only" write it instead of the time series')
+
+
+def add_diagnostics_argument(parser):
+  '''Add the wind resource diagnostics option'''
+  parser.add_argument('--diagnostics', action='store_true',
+    help='Also output wind resource diagnostics: shear exponents and veer between 10, 100 and 140m, rotor equivalent '
+      'wind speed, and (for points with psfc and t2) air density corrected power')
+
+
+def point_spec(value):
+  '''Parse a lat,lon location'''
+  point = [float(v) for v in value.split(',')]
+  if len(point) != 2:
+    raise argparse.ArgumentTypeError('Please specify the location as lat,lon')
+  return point
+
+
+def regrid_spec(value):
+  '''Parse a lat_min,lat_max,lon_min,lon_max,resolution regular grid'''
+  spec = [float(v) for v in value.split(',')]
+  if len(spec) != 5 or spec[4] <= 0:
+    raise argparse.ArgumentTypeError('Please specify the grid as lat_min,lat_max,lon_min,lon_max,resolution')
+  return spec
+
+
+def make_parser():
+  '''Create the wrfconv argument parser'''
+  parser = argparse.ArgumentParser(prog='wrfconv', description='RU-WRF Extraction Tools')
+  subparsers = parser.add_subparsers(dest='command', metavar='command')
+  subparsers.required = True
+
+  # Point time series
+  p = subparsers.add_parser('points', help='Extract time series at a set of points (wrfptextract_nc/grib)')
+  add_date_arguments(p)
+  p.add_argument('-s','--source', choices=SOURCES,
+    default='nc',
+    help='Model files to read, nc for the v3.9 runs starting 12/1/2017, grib for the older v3.6 runs')
+  p.add_argument('-c','--coordinates', type=str,
+    default='wrf_vmt_points.csv',
+    help='A file with coordinate points to extract')
+  p.add_argument('-p','--prefix', type=str,
+    default='wrf_data',
+    help='Prefix for the output filename')
+  p.add_argument('-v','--variables', type=str,
+    help='Comma separated list of variables to extract, from: ' + ', '.join(VARIABLES))
+  p.add_argument('-z','--heights', type=heights_list,
+    default=[10,100,120,140],
+    help='Comma separated list of heights to extract')
+  p.add_argument('-l','--leads', action='store_true',
+    help='Extract every forecast hour (H000-H048) of each model run into a run_time x lead_time cube')
+  p.add_argument('--parquet', choices=['long','wide'],
+    help='Also write a Parquet dataset partitioned by year/month/station, as a long or wide table')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from, instead of the default for the source')
+  p.add_argument('--domains', type=str,
+    help='Comma separated list of model domains to combine, in priority order, from: ' + ', '.join(DOMAINS) +
+      '.  Each station is read from the finest domain that covers it, falling back to the next where a file is '
+      'missing.  Use name=directory to read a domain from another directory')
+  add_reader_argument(p)
+  add_stats_argument(p)
+  add_aggregate_argument(p)
+  add_diagnostics_argument(p)
+  add_memory_argument(p)
+  add_encoding_arguments(p)
+  p.add_argument('--index', action='store_true',
+    help='Also write a zone map index of the output file, and add it to the wrf_index.csv catalog in the same directory')
+  p.add_argument('--per-station', choices=['nc','csv','parquet'],
+    help='Also write a file per station in <prefix>_stations/, in parallel, for serving single station downloads')
+  p.add_argument('--workers', type=int,
+    default=4,
+    help='Number of processes (NetCDF) or threads (CSV and Parquet) writing the station files')
+  p.add_argument('--cache', type=str, nargs='?', const='~/.cache/wrfconv',
+    help='Keep the values extracted from each model file in a local cache (by default in ~/.cache/wrfconv), '
+      'so reruns only read the files and stations that have not been extracted before')
+  p.add_argument('--cache-size', type=parse_size,
+    default='2G',
+    help='Size limit of the cache, e.g. 2G, the least recently used files are removed to fit it')
+
+  # Vertical profiles at points
+  p = subparsers.add_parser('profile', help='Extract the wind at every model level at a set of points')
+  add_date_arguments(p)
+  p.add_argument('-s','--source', choices=SOURCES,
+    default='nc',
+    help='Model files to read')
+  p.add_argument('-c','--coordinates', type=str,
+    default='wrf_vmt_points.csv',
+    help='A file with coordinate points to extract')
+  p.add_argument('-p','--prefix', type=str,
+    default='wrf_profile',
+    help='Prefix for the output filename')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from, instead of the default for the source')
+  add_reader_argument(p)
+
+  # Polygon area series
+  p = subparsers.add_parser('areas', help='Extract time series averaged or summed over polygon areas')
+  add_date_arguments(p)
+  p.add_argument('-a','--areas', type=str,
+    required=True,
+    help='A GeoJSON file of polygons, or a csv file with name and wkt columns')
+  p.add_argument('-s','--source', choices=SOURCES,
+    default='nc',
+    help='Model files to read')
+  p.add_argument('-p','--prefix', type=str,
+    default='wrf_areas',
+    help='Prefix for the output filename')
+  p.add_argument('-v','--variables', type=str,
+    help='Comma separated list of variables to extract, from: ' + ', '.join(VARIABLES))
+  p.add_argument('-z','--heights', type=heights_list,
+    default=[10,100,120,140],
+    help='Comma separated list of heights to extract')
+  p.add_argument('-r','--reduce', choices=['mean','sum'],
+    default='mean',
+    help='Combine the model cells in each area with a mean or sum, weighted by the fraction of each cell inside it')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from, instead of the default for the source')
+  add_reader_argument(p)
+  p.add_argument('--weights-dir', type=str,
+    default='.',
+    help='Directory for the saved area masks, which are reused by every run on the same grid and areas')
+
+  # Full grids
+  for name, helptext, source, prefix in [
+      ('grid', 'Extract the wind layers of the full model grid (wrfgrid2nc)', 'grib', 'wrf_data'),
+      ('subgrid', 'Extract the wind layers for the full grid or a lat/lon box (wrfsubgrid2nc)', 'nc', 'wrfsubgrid2')]:
+    p = subparsers.add_parser(name, help=helptext)
+    add_date_arguments(p)
+    p.add_argument('-s','--source', choices=SOURCES,
+      default=source,
+      help='Model files to read')
+    p.add_argument('-p','--prefix', type=str,
+      default=prefix,
+      help='Prefix for the output filename')
+    p.add_argument('--directory', type=str,
+      help='Model directory to read from, instead of the default for the source')
+    add_reader_argument(p)
+    add_stats_argument(p)
+    add_aggregate_argument(p)
+    add_diagnostics_argument(p)
+    add_memory_argument(p)
+    add_encoding_arguments(p)
+    p.add_argument('--pyramid', type=factors_list, nargs='?', const=[2,4,8],
+      help='Also save block means of wind speed and power coarsened by each factor (default 2,4,8) '
+        'as level_<factor> groups in the output file')
+    p.add_argument('--regrid', type=regrid_spec,
+      help='Interpolate the wind layers to a regular lat_min,lat_max,lon_min,lon_max,resolution grid (requires scipy)')
+    p.add_argument('--weights-dir', type=str,
+      default='.',
+      help='Directory for the saved regridding weights, which are reused by every run on the same grids')
+    p.add_argument('--index', type=int, nargs='?', const=0,
+      help='Also write a zone map index of the output file, optionally for tiles of this many points, '
+        'and add it to the wrf_index.csv catalog in the same directory')
+    if name == 'subgrid':
+      p.add_argument('-b','--bbox', type=bbox_list,
+        help='Only extract the model points inside lat_min,lat_max,lon_min,lon_max')
+
+  # 120m wind speed and power grids
+  p = subparsers.add_parser('extract', help='Extract 120m wind speed and power grids from GRIB files (wrf_extract)')
+  add_date_arguments(p)
+  p.add_argument('-p','--prefix', type=str,
+    default='wrf_data',
+    help='Prefix for the output filename')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from')
+
+  # Update an existing point file
+  p = subparsers.add_parser('update', help='Extend an existing point extraction file with the latest days')
+  p.add_argument('file',
+    help='Point extraction file to update')
+  p.add_argument('-u','--until', type=str,
+    help='Last date to extract in yyyymmdd format, defaults to yesterday')
+  p.add_argument('-o','--output', type=str,
+    help='Write the updated file here instead of replacing the original')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from, instead of the one recorded in the file')
+
+  # Fill missing hours of an existing point file
+  p = subparsers.add_parser('backfill', help='Fill the missing hours of a point file from alternate model runs')
+  p.add_argument('file',
+    help='Point extraction file to fill')
+  p.add_argument('-o','--output', type=str,
+    help='Write the filled file here instead of replacing the original')
+  p.add_argument('--directory', type=str,
+    help='Model directory to read from, instead of the one recorded in the file')
+  add_reader_argument(p)
+
+  # Combine sharded outputs
+  p = subparsers.add_parser('merge', help='Combine the outputs of sharded runs into one file in time order')
+  p.add_argument('output',
+    help='Merged file to write')
+  p.add_argument('files', nargs='+',
+    help='Shard output files, in any order')
+  p.add_argument('--chunk', type=int,
+    default=744,
+    help='Number of time steps copied at once, to limit memory use')
+  p.add_argument('--allow-gaps', action='store_true',
+    help='Write the merged file even if hours are missing between or within the shards')
+
+  # Derived variables of existing outputs
+  p = subparsers.add_parser('rederive', help='Recalculate wind speed, direction and power from the wind components of existing output files')
+  p.add_argument('files', nargs='+',
+    help='Point, profile, grid or subgrid output files')
+  p.add_argument('-o','--output', type=str,
+    help='Directory to write the updated files to, instead of updating them in place')
+  p.add_argument('--power-curve', type=str,
+    help='Turbine power curve csv with Wind Speed and Power columns, instead of the 8 MW reference turbine')
+  p.add_argument('--chunk', type=int,
+    default=744,
+    help='Number of time steps recalculated at once, to limit memory use')
+
+  # Per-station files
+  p = subparsers.add_parser('split', help='Write a file per station from an existing point file, for the data portal')
+  p.add_argument('file',
+    help='Point extraction file to split')
+  p.add_argument('-o','--output', type=str,
+    default='.',
+    help='Directory for the station files')
+  p.add_argument('-f','--format', choices=['nc','csv','parquet'],
+    default='nc',
+    help='Format of the station files')
+  p.add_argument('-p','--prefix', type=str,
+    help='Prefix for the station filenames, by default the prefix of the point file')
+  p.add_argument('--workers', type=int,
+    default=4,
+    help='Number of processes (NetCDF) or threads (CSV and Parquet) writing the station files')
+  p.add_argument('--pack', action='store_true',
+    help='Pack the variables of NetCDF station files as int16 within their declared precision')
+
+  # Output encodings
+  p = subparsers.add_parser('encode', help='Compare packing and compression options for an output file, and optionally re-encode it')
+  p.add_argument('file',
+    help='Point or grid output file')
+  p.add_argument('--pattern', choices=['map','series'],
+    default='map',
+    help='Read pattern to chunk for and time')
+  p.add_argument('-l','--level', type=int,
+    default=5,
+    help='Compression level for the re-encoded file')
+  p.add_argument('-o','--output', type=str,
+    help='Write the root group of the file here, packed as int16 and chunked for the read pattern')
+
+  # Pixel-major store of a grid archive
+  p = subparsers.add_parser('rechunk', help='Rechunk daily grid files into a pixel-major store for fast point history reads')
+  p.add_argument('store',
+    help='Directory for the store')
+  p.add_argument('files', nargs='+',
+    help='Grid or subgrid output files to include')
+  p.add_argument('-v','--variables', type=str,
+    help='Comma separated list of variables to include, all (time, z) grid variables by default')
+  add_memory_argument(p)
+
+  # Point queries of a grid archive
+  p = subparsers.add_parser('serve', help='Serve point time series from an archive of grid files over HTTP, or answer one query')
+  p.add_argument('files', nargs='+',
+    help='Grid or subgrid output files in the archive, or a store directory written by wrfconv rechunk')
+  p.add_argument('--host', type=str,
+    default='127.0.0.1',
+    help='Address to serve on')
+  p.add_argument('--port', type=int,
+    default=8080,
+    help='Port to serve on')
+  p.add_argument('--point', type=point_spec,
+    help='Answer a query for this lat,lon and exit instead of serving')
+  p.add_argument('--start', type=str,
+    help='First date of the query in yyyymmdd format')
+  p.add_argument('--end', type=str,
+    help='Last date of the query in yyyymmdd format')
+  p.add_argument('-z','--heights', type=str,
+    help='Heights of the query, as a list (100,120) or range (100-140)')
+  p.add_argument('-v','--variables', type=str,
+    help='Comma separated list of variables for the query, all by default')
+  p.add_argument('-o','--output', type=str,
+    help='Write the query result to this csv file instead of printing it')
+
+  # Zone map indexes of the output archives
+  p = subparsers.add_parser('index', help='Write zone map indexes for existing output files and add them to a catalog')
+  p.add_argument('files', nargs='+',
+    help='Point or grid files to index')
+  p.add_argument('-t','--tile', type=int,
+    help='Index grid files in tiles of this many points, instead of the whole grid')
+  p.add_argument('--catalog', type=str,
+    help='Catalog file to update, instead of wrf_index.csv next to each file')
+
+  p = subparsers.add_parser('query', help='List the files and days in a zone map catalog that could match a condition')
+  p.add_argument('catalog',
+    help='Catalog (or single file index) to search')
+  p.add_argument('-v','--variable', type=str,
+    default='wind_speed',
+    help='Variable to check')
+  p.add_argument('-z','--height', type=int,
+    help='Only check this height')
+  p.add_argument('--above', type=float,
+    help='Find values above this threshold')
+  p.add_argument('--below', type=float,
+    help='Find values below this threshold')
+  p.add_argument('-b','--bbox', type=bbox_list,
+    help='Only check stations or tiles overlapping lat_min,lat_max,lon_min,lon_max')
+  p.add_argument('--start', type=str,
+    help='First date to check in yyyymmdd format')
+  p.add_argument('--end', type=str,
+    help='Last date to check in yyyymmdd format')
+  return parser
+
+
+#------------------------------
+def main(argv=None):
+  """Main function for command line execution"""
+  args = make_parser().parse_args(argv)
+  if getattr(args, 'shard', None):
+    start_date, days = common.shard_dates(common.parse_date(args.date), args.days, *args.shard)
+    if days == 0:
+      print('Shard %d/%d has no days to process' % args.shard)
+      return
+    args.date, args.days = start_date.strftime('%Y%m%d'), days
+    print('Shard %d/%d: %d days starting %s' % (args.shard + (days, args.date)))
+  if getattr(args, 'plan', False):
+    from wrfconv import plan as command
+  elif args.command == 'points':
+    from wrfconv import points as command
+  elif args.command == 'profile':
+    from wrfconv import profiles as command
+  elif args.command == 'areas':
+    from wrfconv import areas as command
+  elif args.command in ('grid','subgrid'):
+    from wrfconv import grid as command
+  elif args.command == 'extract':
+    from wrfconv import extract as command
+  elif args.command == 'update':
+    from wrfconv import update as command
+  elif args.command == 'backfill':
+    from wrfconv import backfill as command
+  elif args.command == 'encode':
+    from wrfconv import packing as command
+  elif args.command == 'rechunk':
+    from wrfconv import rechunk as command
+  elif args.command == 'serve':
+    from wrfconv import serve as command
+  elif args.command == 'rederive':
+    from wrfconv import rederive as command
+  elif args.command == 'split':
+    from wrfconv import split as command
+  elif args.command == 'merge':
+    from wrfconv import merge as command
+  elif args.command in ('index','query'):
+    from wrfconv import zonemap as command
+  command.main(args)
+
+
+if __name__ == '__main__':
+  main()
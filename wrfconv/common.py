@@ -0,0 +1,91 @@
+# Date handling and output helpers shared by the RU-WRF extractors
+
+import os
+import warnings
+from datetime import datetime,timedelta
+
+#------------------------------
+def parse_date(adate):
+  '''Convert a yyyymmdd string into a datetime'''
+  if len(adate)!=8 or not adate.isdigit():
+    raise ValueError('Please enter a date in the format yyyymmdd')
+  year  = int(adate[0:4])
+  month = int(adate[4:6])
+  day   = int(adate[6:8])
+  return datetime(year,month,day)
+
+
+def end_date(start_date,days):
+  '''Return the last hour of a range of days'''
+  return start_date + timedelta(days) - timedelta(0,60*60)
+
+
+def shard_dates(start_date, days, shard, nshards):
+  '''Split a range of days into nshards contiguous, balanced shards of whole days
+
+  Returns the (start_date, days) of shard number shard (1 to nshards), with 0 days if there are more shards than days.'''
+  size, extra = divmod(days, nshards)
+  first = (shard-1)*size + min(shard-1, extra)
+  return start_date + timedelta(first), size + (1 if shard <= extra else 0)
+
+
+def output_filename(prefix,start_date,end_date=None,ext='nc'):
+  '''Create an output filename from a prefix and date range'''
+  if end_date is None:
+    return '%s_%d%02d%02d.%s' % (prefix, start_date.year, start_date.month, start_date.day, ext)
+  return '%s_%d%02d%02d_%d%02d%02d.%s' % (
+    prefix,
+    start_date.year, start_date.month, start_date.day,
+    end_date.year, end_date.month, end_date.day, ext)
+
+
+def default_file(filename):
+  '''Resolve a data file shipped in the repository root, preferring a copy in the current directory'''
+  if os.path.exists(filename):
+    return filename
+  return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), filename)
+
+
+def replace_netcdf(ds, filename, encoding=None):
+  '''Save a dataset to a temporary file first, then move it into place so the original is never left half written'''
+  tmp_file = filename + '.tmp'
+  ds.to_netcdf(tmp_file, encoding=encoding)
+  os.replace(tmp_file, filename)
+
+
+def append_netcdf(filename, datasets, dim='time'):
+  '''Append datasets along the unlimited time dimension of a netcdf file written from an earlier batch
+
+  datasets maps each group name (None for the root group) to the dataset to append to it.'''
+  import netCDF4
+  import numpy as np
+  import pandas as pd
+  from xarray.coding.times import encode_cf_datetime
+  with netCDF4.Dataset(filename, 'a') as nc:
+    n = len(nc.dimensions[dim]) # Groups share the root time dimension
+    for group, ds in datasets.items():
+      g = nc.groups[group] if group else nc
+      k = ds.sizes[dim]
+      times = pd.DatetimeIndex(ds[dim].values).to_pydatetime()
+      g[dim][n:n+k] = netCDF4.date2num(times, g[dim].units, g[dim].calendar)
+      for name in list(ds.data_vars) + [c for c in ds.coords if c != dim]:
+        if dim in ds[name].dims:
+          index = [slice(None)] * ds[name].ndim
+          index[ds[name].dims.index(dim)] = slice(n, n+k)
+          values = ds[name].values
+          if values.dtype.kind == 'M': # Other datetime variables, e.g. the valid times of a lead cube
+            with warnings.catch_warnings():
+              warnings.simplefilter('ignore') # Hourly times are saved as floating point days
+              values = encode_cf_datetime(values, g[name].units, g[name].calendar)[0]
+          elif 'scale_factor' in g[name].ncattrs():
+            missing = ~np.isfinite(values) # Packed variables need missing values masked to get the _FillValue
+            values = np.ma.masked_array(np.where(missing, 0, values), mask=missing)
+          g[name][tuple(index)] = values
+
+
+def set_netcdf_attrs(filename, attrs):
+  '''Update global attributes of a netcdf file in place'''
+  import netCDF4
+  with netCDF4.Dataset(filename, 'a') as nc:
+    for k,v in attrs.items():
+      nc.setncattr(k, v)
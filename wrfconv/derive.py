@@ -0,0 +1,149 @@
+# Derived wind variables shared by the point and grid extractors
+
+import numpy as np
+import pandas as pd
+from wrfconv import common
+
+#------------------------------
+# 8 MW reference turbine power curve from Desmond (2016)
+POWER_CURVE = 'wrf_lw8mw_power.csv'
+
+
+#------------------------------
+def wind_speed(u,v):
+  '''Calculate wind speed from the zonal and meridional wind components'''
+  ws = np.sqrt(u**2+v**2)
+  ws.attrs['units'] = 'm s-1'
+  ws.attrs['comment'] = 'Wind Speed is calculated from the Zonal and Meridional wind speeds.'
+  ws.attrs['long_name'] = 'Wind Speed'
+  ws.attrs['standard_name'] = 'wind_speed'
+  return ws
+
+
+def wind_dir(u,v):
+  '''Calculate the direction winds are coming from, in degrees clockwise from true N'''
+  wd = 270 - np.arctan2(v,u)*180/np.pi
+  wd = wd % 360  #Use modulo to keep degrees between 0-360
+  wd.attrs['units'] = 'degree'
+  wd.attrs['comment'] = 'The direction from which winds are coming from, in degrees clockwise from true N.'
+  wd.attrs['long_name'] = 'Wind Direction'
+  wd.attrs['standard_name'] = 'wind_from_direction'
+  return wd
+
+
+def load_power_curve(filename=POWER_CURVE):
+  '''Load a turbine power curve with Wind Speed and Power columns'''
+  return pd.read_csv(common.default_file(filename))
+
+
+def wind_power(ws,power_curve=None):
+  '''Estimate wind power from wind speed using a turbine power curve'''
+  if power_curve is None:
+    power_curve = load_power_curve()
+  wp = ws.copy(data=np.interp(ws.values,power_curve['Wind Speed'],power_curve['Power']))
+  wp.attrs = {}
+  wp.attrs['units'] = 'kW'
+  wp.attrs['comment'] = 'Estimated Wind Power is interpolated from wind speed, using an 8 MW reference turbine power curve from Desmond (2016).'
+  wp.attrs['long_name'] = 'Estimated 8MW Wind Power'
+  wp.attrs['standard_name'] = 'wind_power'
+  return wp
+
+
+#------------------------------
+# Wind resource diagnostics, calculated from the heights already extracted
+SHEAR_HEIGHTS = [10,100,140] # Shear and veer are calculated between each pair of these heights that was extracted
+HUB_HEIGHT = 120             # Hub height (m) and rotor diameter (m) for the rotor equivalent wind speed,
+ROTOR_DIAMETER = 164         # approximately the 8 MW reference turbine of the power curve
+RHO_STANDARD = 1.225         # Air density (kg m-3) the power curve is given for
+
+
+def height_pairs(heights, pairs_from=SHEAR_HEIGHTS):
+  '''List the consecutive pairs of the shear heights that were extracted'''
+  found = [h for h in pairs_from if h in list(heights)]
+  return list(zip(found[:-1], found[1:]))
+
+
+def shear_exponent(ws, low, high, dim='height'):
+  '''Calculate the power law shear exponent between two heights'''
+  ws_low = ws.sel({dim:low}, drop=True)
+  ws_high = ws.sel({dim:high}, drop=True)
+  alpha = np.log(ws_high.where(ws_high > 0) / ws_low.where(ws_low > 0)) / np.log(float(high) / low)
+  alpha.attrs = {'units':'1', 'long_name':'Wind Shear Exponent %d-%dm' % (low, high),
+    'comment':'Power law exponent alpha of the wind speed profile between %dm and %dm, ws(%d) = ws(%d) * (%d/%d)**alpha.'
+      % (low, high, high, low, high, low)}
+  return alpha
+
+
+def wind_veer(wd, low, high, dim='height'):
+  '''Calculate the change in wind direction between two heights, positive when the wind turns clockwise with height'''
+  veer = (wd.sel({dim:high}, drop=True) - wd.sel({dim:low}, drop=True) + 180) % 360 - 180
+  veer.attrs = {'units':'degree', 'long_name':'Wind Veer %d-%dm' % (low, high),
+    'comment':'Change in the direction the wind is coming from between %dm and %dm, positive for clockwise turning (veering) with height.' % (low, high)}
+  return veer
+
+
+def rotor_weights(heights, hub_height=HUB_HEIGHT, diameter=ROTOR_DIAMETER):
+  '''Calculate the fraction of the rotor disk represented by each height inside it
+
+  The disk is split halfway between the heights, and the top and bottom segments extend to the rotor edge.
+  Returns the heights used and their weights, which sum to 1.'''
+  radius = diameter / 2.0
+  inside = np.array(sorted([h for h in heights if hub_height - radius <= h <= hub_height + radius]), dtype='float64')
+  if len(inside) < 2:
+    return inside, None
+  edges = np.concatenate([[-radius], (inside[:-1] + inside[1:]) / 2 - hub_height, [radius]])
+  below = radius**2 * np.arccos(-edges / radius) + edges * np.sqrt(radius**2 - edges**2) # Disk area below each edge
+  return inside, np.diff(below) / (np.pi * radius**2)
+
+
+def rotor_equivalent_speed(u, v, dim='height', hub_height=HUB_HEIGHT, diameter=ROTOR_DIAMETER):
+  '''Calculate the rotor equivalent wind speed (IEC 61400-12-1), including the effect of veer
+
+  The speed at each height is projected onto the hub height wind direction, cubed, and weighted by the
+  area of the rotor disk it represents.  Returns None if fewer than two extracted heights are inside the rotor.'''
+  heights, weights = rotor_weights(u[dim].values, hub_height, diameter)
+  if weights is None:
+    return None
+  hub = heights[np.argmin(abs(heights - hub_height))]
+  uh, vh = u.sel({dim:hub}, drop=True), v.sel({dim:hub}, drop=True)
+  along = (u.sel({dim:heights}) * uh + v.sel({dim:heights}) * vh) / np.sqrt(uh**2 + vh**2)
+  w = u[dim].sel({dim:heights}).copy(data=weights)
+  rews = np.cbrt((along**3 * w).sum(dim, skipna=False))
+  rews.attrs = {'units':'m s-1', 'long_name':'Rotor Equivalent Wind Speed',
+    'comment':'Rotor equivalent wind speed for a %dm rotor at %dm, from the winds at %s m weighted by the rotor area each represents and projected onto the hub height wind direction.'
+      % (diameter, hub_height, ', '.join(['%d' % h for h in heights]))}
+  return rews
+
+
+def density_corrected_power(ws, rho, power_curve=None):
+  '''Estimate wind power using wind speeds corrected to the standard air density of the power curve (IEC 61400-12-1)'''
+  if power_curve is None:
+    power_curve = load_power_curve()
+  corrected = ws * (rho / RHO_STANDARD)**(1/3.0)
+  wp = corrected.copy(data=np.interp(corrected.values, power_curve['Wind Speed'], power_curve['Power']))
+  wp.attrs = {'units':'kW', 'long_name':'Estimated 8MW Wind Power, Density Corrected',
+    'comment':'Estimated Wind Power interpolated from wind speed scaled by (air_density/%.3f)**(1/3), using the 8 MW reference turbine power curve from Desmond (2016).' % RHO_STANDARD}
+  return wp
+
+
+def diagnostic_names(names):
+  '''Pick the wind resource diagnostics of wind_diagnostics out of a list of variable names'''
+  return [k for k in names if k.startswith(('wind_shear_','wind_veer_'))
+          or k in ('wind_speed_rotor_equivalent','wind_power_density_corrected')]
+
+
+def wind_diagnostics(u, v, dim='height', rho=None, power_curve=None):
+  '''Calculate the shear, veer and rotor equivalent wind speed diagnostics, and density corrected power if an air
+  density is given, from the wind components at the extracted heights'''
+  ws = wind_speed(u, v)
+  wd = wind_dir(u, v)
+  out = {}
+  for low, high in height_pairs(u[dim].values):
+    out['wind_shear_%d_%dm' % (low, high)] = shear_exponent(ws, low, high, dim)
+    out['wind_veer_%d_%dm' % (low, high)] = wind_veer(wd, low, high, dim)
+  rews = rotor_equivalent_speed(u, v, dim)
+  if rews is not None:
+    out['wind_speed_rotor_equivalent'] = rews
+  if rho is not None:
+    out['wind_power_density_corrected'] = density_corrected_power(ws, rho, power_curve)
+  return out
@@ -0,0 +1,79 @@
+# Extract RU-WRF 120m Wind Speed and Power Grids from old GRIB files
+# Moved from wrf_extract.py, originally written by Sage, 6/13/18
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import common, derive, plan, readers, sources
+
+
+#------------------------------
+def extract_wind_grid(start_date, days, forecast_offset=6, directory=None):
+  '''Extract 120m wind speed and power layers from the GRIB model files'''
+  import pygrib
+  if directory is None:
+    directory = sources.DIRECTORIES['grib']
+  times = pd.date_range(start_date, common.end_date(start_date,days), freq="h")
+  power_curve = derive.load_power_curve()
+  hours = []
+
+  #------------------------------
+  # Step 1 - Loop over each hour
+  for t in times:
+
+    # Step 2 - Open WRF file
+    wrf_file = sources.make_wrf_file('grib', t, forecast_offset)
+    try:
+      grbfile = pygrib.open(directory + wrf_file)
+      print('Processing: ' + str(t) + ' File: ' + wrf_file)
+      data_u120,lats,lons = grbfile.select(name="U component of wind")[10].data() # 120m
+      data_v120,lats,lons = grbfile.select(name="V component of wind")[10].data()
+      grbfile.close()
+    except readers.READ_ERRORS:
+      print('Could not open ' + wrf_file)
+      continue
+
+    uVel = np.ma.expand_dims(data_u120,axis=2).filled(np.nan)
+    vVel = np.ma.expand_dims(data_v120,axis=2).filled(np.nan)
+    wind_speed = np.sqrt(uVel**2+vVel**2)
+    wind_power = np.interp(wind_speed,power_curve['Wind Speed'],power_curve['Power']) #right=np.nan
+
+    hours.append(xr.Dataset({
+      'wind_speed': (['x', 'y', 'time'],  wind_speed),
+      'wind_power': (['x', 'y', 'time'], wind_power)},
+      coords={'lon': (['x', 'y'], lons), 'lat': (['x', 'y'], lats), 'time': [t] }))
+
+  if not hours:
+    return None
+  final_dataset = xr.concat(hours, dim='time')
+  final_dataset.attrs['forecast_offset'] = forecast_offset
+  final_dataset.attrs['source_directory'] = directory
+  final_dataset.attrs['date_created'] = str(datetime.today())
+  return final_dataset
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  # Specify Date Range to Process
+  start_date = common.parse_date(args.date)
+  end_date = common.end_date(start_date,args.days)
+
+  final_dataset = extract_wind_grid(start_date, args.days, args.forecast_offset, args.directory)
+  if final_dataset is None:
+    print('No data found, skipping.')
+    return
+  final_dataset.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+  plan.record_run(args, (datetime.now() - script_start_time).total_seconds())
+
+  # Setup xarray output encoding
+  encoding={}
+  encoding['time'] = dict(units='days since 2010-01-01 00:00:00', calendar='gregorian', dtype=np.double)
+
+  # Output final datafile
+  output_datafile = common.output_filename(args.prefix, start_date, end_date)
+  final_dataset.to_netcdf(output_datafile, encoding=encoding)
+  print('Outputted ' + output_datafile)
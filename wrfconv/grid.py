@@ -0,0 +1,319 @@
+# Extract entire RU-WRF Model Data layers from old GRIB files and new NetCDF files
+# Combines wrfgrid2nc.py (Sage, 10/25/18) and wrfsubgrid2nc.py (Sage, 11/13/19)
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import common, derive, memory, packing, plan, readers, sources
+
+#------------------------------
+HEIGHTS = [10,100,120,140]
+PYRAMID_FACTORS = [2,4,8]
+GRID_COPIES = 8 # Copies of each hourly u/v layer held while a batch is built and written
+
+
+#------------------------------
+def bbox_slices(lat, lon, bbox):
+  '''Find the y/x index ranges covering a lat/lon box (lat_min,lat_max,lon_min,lon_max)'''
+  inside = (lat>=bbox[0]) & (lat<=bbox[1]) & (lon>=bbox[2]) & (lon<=bbox[3])
+  if not inside.any():
+    raise ValueError('No model points found inside %s' % (bbox,))
+  yy,xx = np.nonzero(inside)
+  return slice(yy.min(),yy.max()+1), slice(xx.min(),xx.max()+1)
+
+
+WIND_ATTRS = {
+  'eastward_wind': {'units':'m s-1', 'long_name':'Wind Speed, Zonal'},
+  'northward_wind': {'units':'m s-1', 'long_name':'Wind Speed, Meridional'},
+}
+
+
+def grid_coords(heights, lat, lon):
+  '''Create the height and lat/lon coordinates of a grid dataset'''
+  return {
+    'z':('z', np.array(heights, dtype='int32'), {'units':'m', 'standard_name':'height', 'long_name':'Height'}),
+    'lat':(['y','x'], lat, {'units':'degrees_north', 'standard_name':'latitude', 'long_name':'Latitude'}),
+    'lon':(['y','x'], lon, {'units':'degrees_east', 'standard_name':'longitude', 'long_name':'Longitude'})}
+
+
+def make_grid_dataset(times, heights, u, v, lat, lon):
+  '''Create a grid dataset from (time, z, y, x) wind component arrays'''
+  coords = grid_coords(heights, lat, lon)
+  coords['time'] = times
+  return xr.Dataset({
+    'eastward_wind': (['time','z','y','x'], u, dict(WIND_ATTRS['eastward_wind'])),
+    'northward_wind': (['time','z','y','x'], v, dict(WIND_ATTRS['northward_wind']))},
+    coords=coords)
+
+
+#------------------------------
+def add_wind_variables(dsout, power=False, diagnostics=False):
+  '''Add attributes and the derived wind variables to a grid dataset, optionally with the wind resource diagnostics'''
+  dsout['eastward_wind'].attrs['standard_name'] = 'eastward_wind'
+  dsout['eastward_wind'].attrs['comment'] = 'The zonal wind speed (m/s) indicates the u (positive eastward) component of where the wind is going.'
+  dsout['northward_wind'].attrs['standard_name'] = 'northward_wind'
+  dsout['northward_wind'].attrs['comment'] = 'The meridional wind speed (m/s) indicates the v (positive northward) component of where the wind is going.'
+  dsout['wind_speed'] = derive.wind_speed(dsout['eastward_wind'], dsout['northward_wind'])
+  dsout['wind_from_direction'] = derive.wind_dir(dsout['eastward_wind'], dsout['northward_wind'])
+  if power:
+    dsout['wind_power'] = derive.wind_power(dsout['wind_speed'])
+  if diagnostics:
+    dsout.update(derive.wind_diagnostics(dsout['eastward_wind'], dsout['northward_wind'], 'z'))
+  return dsout
+
+
+def make_pyramid(dsout, factors=PYRAMID_FACTORS):
+  '''Create coarsened copies of the wind speed and power layers, using block means of factor x factor points
+
+  Edge blocks that only partly cover the grid are averaged over the points they contain.'''
+  layers = xr.Dataset({'wind_speed':dsout['wind_speed']})
+  if 'wind_power' in dsout:
+    layers['wind_power'] = dsout['wind_power']
+  else:
+    layers['wind_power'] = derive.wind_power(dsout['wind_speed'])
+  dims = ('y','x') if 'y' in layers.dims else ('lat','lon') # Model or regridded layers
+  levels = {}
+  for factor in factors:
+    level = layers.coarsen({dims[0]:factor, dims[1]:factor}, boundary='pad').mean(keep_attrs=True)
+    for k in level.data_vars:
+      level[k] = level[k].astype('float32')
+      level[k].attrs['cell_methods'] = '%s: %s: mean (%d x %d blocks)' % (dims[0], dims[1], factor, factor)
+    level.attrs['pyramid_factor'] = factor
+    level.attrs['comment'] = 'Block means of %d x %d model points from the full resolution grid in the root group.' % (factor, factor)
+    levels[factor] = level
+  return levels
+
+
+def regrid_batch(dsout, weights, diagnostics=False):
+  '''Regrid the wind components of a batch to the regular lat/lon grid, and recalculate the wind variables
+  (and the wind resource diagnostics) from them'''
+  from wrfconv import regrid
+  regridded = regrid.regrid_dataset(dsout[['eastward_wind','northward_wind']], weights)
+  return add_wind_variables(regridded, 'wind_power' in dsout, diagnostics)
+
+
+def write_batch(dsout, filename, append=False, pyramid=None, unlimited=False, pack=False, chunks=None):
+  '''Write the first batch of a grid run (and its pyramid levels) to netcdf, or append a later batch along time'''
+  levels = make_pyramid(dsout, pyramid) if pyramid else {}
+  if append:
+    datasets = dict([('level_%d' % factor, level) for factor, level in levels.items()])
+    datasets[None] = dsout
+    common.append_netcdf(filename, datasets)
+    return
+  unlimited_dims = ['time'] if unlimited else None
+  dsout.to_netcdf(filename, encoding=make_encoding(dsout, pack=pack, pattern=chunks), unlimited_dims=unlimited_dims)
+  for factor, level in sorted(levels.items()):
+    level.to_netcdf(filename, mode='a', group='level_%d' % factor, encoding=make_encoding(level, pack=pack, pattern=chunks),
+      unlimited_dims=unlimited_dims)
+
+
+def make_encoding(ds, time_start='days since 2010-01-01 00:00:00', comp_level=5, fillvalue=-999.00, pack=False, pattern=None):
+  '''Create variable encodings for saving to netcdf, optionally packed and chunked by packing.plan_encoding'''
+  encoding = packing.plan_encoding(ds, pack=pack, pattern=pattern, comp_level=comp_level) #'_FillValue': np.float32(fillvalue)
+  encoding['time'] = dict(units=time_start, calendar='gregorian', zlib=False, _FillValue=False, dtype=np.double)
+  return encoding
+
+
+def add_metadata(dsout, source, forecast_offset, directory, reader_desc, bbox=None):
+  '''Add the global attributes of a grid dataset'''
+  dsout.attrs['title'] = "Rutgers WRF 3km model output"
+  dsout.attrs['forecast_offset'] = forecast_offset
+  dsout.attrs['source'] = source
+  dsout.attrs['source_directory'] = directory
+  dsout.attrs['reader'] = reader_desc
+  if bbox is not None:
+    dsout.attrs['bounding_box'] = 'lat %s to %s, lon %s to %s' % tuple(bbox)
+  dsout.attrs['date_created'] = str(datetime.today())
+  dsout.attrs['creator_name'] = "Sage Lichtenwalner"
+  dsout.attrs['creator_email'] = "sage@marine.rutgers.edu"
+  dsout.attrs['creator_url'] = "https://rucool.marine.rutgers.edu"
+  dsout.attrs['institution'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  dsout.attrs['summary'] = "Wind data extracted from the RU-WRF model.  The model is run daily at 00Z with forecast files saved every hour.  Times in this file are UTC based on the forecast time.  The forecast_offset specifies how many hours of model spin up are allowed before the data is included in this virtual time-series archive for a given day.  For example, a value of 6 means the first 6 hours of data for a day are actually extracted from the previous day's model run."
+  dsout.attrs['project'] = "RU COOL BPU Wind Energy Project"
+  dsout.attrs['Conventions'] = 'CF-1.6'
+  return dsout
+
+
+def hour_bytes(heights, shape, power=False):
+  '''Estimate the memory needed per hour of a grid batch
+
+  Each hour is held as the u/v layers read, their stacked copies, wind speed and direction (and power),
+  plus a copy while it is compressed and written.'''
+  copies = GRID_COPIES + (1 if power else 0)
+  return copies * len(heights) * int(np.prod(shape)) * 4
+
+
+def grid_batches(start_date, days, source='grib', forecast_offset=6, directory=None, heights=HEIGHTS, bbox=None,
+                 power=False, reader='auto', stats=None, raw=True, max_memory=None, tracker=None, diagnostics=False):
+  '''Extract the wind layers of the full model grid (or a lat/lon box), yielding datasets of consecutive hours
+
+  Without max_memory, all of the hours are returned in a single batch.  With a max_memory budget (bytes), the
+  hours per batch are chosen to fit it, and halved whenever the process goes over it.  If a
+  stats.StatsAccumulator is given, it is updated with each hour as it is read.  With raw=False the hourly
+  layers are not kept, and only the grid coordinates and metadata are returned.'''
+  if directory is None:
+    directory = sources.DIRECTORIES[source]
+  if tracker is None:
+    tracker = memory.MemoryTracker(max_memory, trace=False)
+  times = pd.date_range(start_date, common.end_date(start_date,days), freq="h")
+  files = [sources.make_wrf_file(source, t, forecast_offset) for t in times]
+
+  # Pick the reader using the first available file
+  reader_cls, probe_times = readers.select_for_files([directory + f for f in files], source, 'grid',
+    ['u_velocity','v_velocity'], heights, reader)
+  if reader_cls is None: # None of the files exist
+    return
+  reader_desc = readers.describe(reader_cls, probe_times)
+
+  # Loop over each hour
+  subset = (slice(None), slice(None))
+  batch = None # Hours per batch, set from the size of the first grid
+  lat = None
+  found, uVel, vVel = [], [], []
+  for t, wrf_file in zip(times, files):
+    print('Processing: ' + directory + wrf_file)
+    try:
+      handle = reader_cls(directory + wrf_file, source)
+    except readers.READ_ERRORS:
+      print('Could not open ' + wrf_file)
+      continue
+    try:
+      with tracker.stage('read'):
+        if lat is None:
+          lat, lon = handle.latlon()
+          if bbox is not None:
+            subset = bbox_slices(lat, lon, bbox)
+          lat, lon = lat[subset], lon[subset]
+        u = np.stack([handle.read('u_velocity', h)[subset] for h in heights])
+        v = np.stack([handle.read('v_velocity', h)[subset] for h in heights])
+        if stats is not None:
+          stats.update(t, {'eastward_wind':(('z','y','x'),u), 'northward_wind':(('z','y','x'),v)})
+        if raw:
+          uVel.append(u)
+          vVel.append(v)
+        found.append(t)
+    except readers.READ_ERRORS as e:
+      print('Could not read %s: %s' % (wrf_file, e))
+      continue
+    finally:
+      handle.close()
+    if batch is None:
+      batch = len(times)
+      if max_memory is not None and raw:
+        batch = memory.batch_hours(max_memory, hour_bytes(heights, lat.shape, power), memory.rss(), len(times))
+        print('Memory budget %s: processing %d hours per batch' % (memory.format_size(max_memory), batch))
+
+    # Hand off a full batch
+    if raw and len(found) >= batch:
+      with tracker.stage('build'):
+        dsout = make_grid_dataset(found, heights, np.stack(uVel), np.stack(vVel), lat, lon)
+        uVel, vVel, found = [], [], []
+        dsout = add_metadata(add_wind_variables(dsout, power, diagnostics), source, forecast_offset, directory, reader_desc, bbox)
+      yield dsout
+      del dsout
+      if tracker.over_budget() and batch > 1:
+        batch = max(1, batch // 2)
+        print('Memory above the %s budget, reducing to %d hours per batch' % (memory.format_size(max_memory), batch))
+
+  if lat is None:
+    return
+  if raw and found:
+    with tracker.stage('build'):
+      dsout = make_grid_dataset(found, heights, np.stack(uVel), np.stack(vVel), lat, lon)
+      del uVel, vVel
+      dsout = add_metadata(add_wind_variables(dsout, power, diagnostics), source, forecast_offset, directory, reader_desc, bbox)
+    yield dsout
+  elif not raw:
+    yield add_metadata(xr.Dataset(coords=grid_coords(heights, lat, lon)), source, forecast_offset, directory, reader_desc, bbox)
+
+
+def extract_grid(start_date, days, source='grib', forecast_offset=6, directory=None, heights=HEIGHTS, bbox=None,
+                 power=False, reader='auto', stats=None, raw=True, diagnostics=False):
+  '''Extract the wind layers of the full model grid (or a lat/lon box) for a range of days
+
+  If a stats.StatsAccumulator is given, it is updated with each hour as it is read.  With raw=False the
+  hourly layers are not kept, and only the grid coordinates and metadata are returned.'''
+  batches = list(grid_batches(start_date, days, source, forecast_offset, directory, heights, bbox, power, reader,
+    stats, raw, diagnostics=diagnostics))
+  if not batches:
+    return None
+  return batches[0]
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  # Specify Date Range to Process
+  start_date = common.parse_date(args.date)
+  end_date = common.end_date(start_date,args.days)
+
+  acc, agg, accumulators = None, None, None
+  if args.stats or args.aggregate:
+    from wrfconv import stats
+    acc = stats.StatsAccumulator(wind=('eastward_wind','northward_wind')) if args.stats else None
+    agg = stats.PeriodAccumulator(wind=('eastward_wind','northward_wind')) if args.aggregate else None
+    accumulators = stats.Accumulators([a for a in (acc, agg) if a is not None])
+  hourly = 'only' not in (args.stats, args.aggregate)
+  tracker = memory.MemoryTracker(args.max_memory, trace=args.max_memory is not None)
+
+  # Output final datafile, single days keep the original wrfgrid2nc naming
+  if args.days == 1 and args.command == 'grid':
+    output_datafile = common.output_filename(args.prefix, start_date)
+  else:
+    output_datafile = common.output_filename(args.prefix, start_date, end_date)
+
+  # Write each batch as it is extracted
+  dsout = None
+  nbatches = 0
+  index_rows = []
+  weights = None
+  for dsout in grid_batches(start_date, args.days, source=args.source, forecast_offset=args.forecast_offset,
+      directory=args.directory, bbox=getattr(args,'bbox',None), reader=args.reader, stats=accumulators, raw=hourly,
+      max_memory=args.max_memory, tracker=tracker, diagnostics=args.diagnostics):
+    dsout.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+    if not hourly:
+      continue
+    if args.regrid is not None:
+      with tracker.stage('regrid'):
+        if weights is None:
+          from wrfconv import regrid
+          weights = regrid.load_weights(dsout['lat'].values, dsout['lon'].values, args.regrid, args.weights_dir)
+        dsout = regrid_batch(dsout, weights, args.diagnostics)
+    with tracker.stage('write'):
+      write_batch(dsout, output_datafile, append=nbatches > 0, pyramid=args.pyramid, unlimited=args.max_memory is not None,
+        pack=args.pack, chunks=args.chunks)
+      if args.index is not None:
+        from wrfconv import zonemap
+        index_rows.append(zonemap.zone_rows(dsout, output_datafile, args.index))
+    nbatches += 1
+
+  if dsout is None:
+    print('No data found, skipping.')
+    return
+  full_grid = args.regrid is None and getattr(args,'bbox',None) is None
+  plan.record_run(args, (datetime.now() - script_start_time).total_seconds(), dsout['lat'].shape if full_grid else None)
+  if nbatches:
+    if args.max_memory is not None:
+      common.set_netcdf_attrs(output_datafile, {'elapsed_time':str(datetime.now() - script_start_time),
+        'memory_report':tracker.report()})
+      print('Memory: ' + tracker.report())
+    print('Outputted ' + output_datafile)
+    if index_rows:
+      zonemap.write_rows(zonemap.combine_rows(pd.concat(index_rows, ignore_index=True)), output_datafile)
+      print('Outputted ' + zonemap.index_filename(output_datafile))
+
+  # Output statistics
+  if acc is not None:
+    output_datafile = output_datafile.replace(args.prefix, args.prefix + '_stats', 1)
+    stats.write_stats(acc, dsout, output_datafile, attrs=WIND_ATTRS)
+    print('Outputted ' + output_datafile)
+
+  # Output daily and monthly means
+  if agg is not None:
+    output_datafile = common.output_filename(args.prefix + '_means', start_date,
+      None if args.days == 1 and args.command == 'grid' else end_date)
+    stats.write_stats(agg, dsout, output_datafile, attrs=WIND_ATTRS)
+    print('Outputted ' + output_datafile)
@@ -0,0 +1,48 @@
+# Forecast lead-time cubes for the RU-WRF point extractors
+# Every forecast hour of every model run is stored along (run_time, lead_time), so each model file
+# is read exactly once and any forecast_offset time series can be sliced out afterwards.
+
+import numpy as np
+import pandas as pd
+from wrfconv import catalog
+
+#------------------------------
+# Forecast hours saved by each daily 00Z model run
+LEAD_TIMES = np.arange(0,49, dtype='int32')
+
+
+#------------------------------
+def make_cube(name, runs, leads, stations, heights, dtype='float64'):
+  '''Create an empty (run_time, lead_time, station[, height]) DataArray for a catalog variable'''
+  da = catalog.make_array(name, runs, stations, heights, dtype)
+  da = da.rename({'time':'run_time'}).expand_dims({'lead_time':leads}, axis=1).copy()
+  da['run_time'].attrs['long_name'] = 'Model Run Time'
+  da['run_time'].attrs['comment'] = 'The initialization time of the model run.'
+  da['lead_time'].attrs['units'] = 'hours'
+  da['lead_time'].attrs['long_name'] = 'Forecast Lead Time'
+  da['lead_time'].attrs['comment'] = 'Hours since the model run was initialized.'
+  da.coords['time'] = (('run_time','lead_time'), valid_times(runs, leads))
+  da['time'].attrs['standard_name'] = 'time'
+  da['time'].attrs['long_name'] = 'Time'
+  return da
+
+
+def valid_times(runs, leads):
+  '''Return the 2D array of forecast valid times for each run and lead time'''
+  runs = pd.DatetimeIndex(runs).values
+  return runs[:,None] + pd.to_timedelta(leads, unit='h').values[None,:]
+
+
+def virtual_time_series(ds, forecast_offset=6):
+  '''Slice the hourly time series for a forecast_offset out of a lead-time cube
+
+  For each run, lead times forecast_offset to forecast_offset+23 are used, which matches the
+  files the standard extractors would have read for the same offset.'''
+  if not 0 <= forecast_offset <= len(ds['lead_time']) - 24:
+    raise ValueError('forecast_offset must be between 0 and %d' % (len(ds['lead_time']) - 24))
+  sub = ds.isel(lead_time=slice(forecast_offset, forecast_offset+24))
+  sub = sub.stack(obs=('run_time','lead_time'))
+  sub = sub.drop_vars(['obs','run_time','lead_time']).swap_dims({'obs':'time'})
+  sub = sub.transpose('time', ...)
+  sub.attrs['forecast_offset'] = forecast_offset
+  return sub
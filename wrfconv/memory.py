@@ -0,0 +1,103 @@
+# Memory budgets for the RU-WRF extractors
+# Estimates the size of the extraction buffers so long runs can be split into batches that fit in a --max-memory
+# budget, and records the peak memory of each stage of a run.  Only the standard library is used here.
+
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+#------------------------------
+UNITS = {'K':1024, 'M':1024**2, 'G':1024**3, 'T':1024**4}
+
+
+def parse_size(value):
+  '''Convert a memory size like 512M or 4G (or a plain number of bytes) to bytes'''
+  value = str(value).strip().upper().rstrip('B')
+  if value and value[-1] in UNITS:
+    return int(float(value[:-1]) * UNITS[value[-1]])
+  return int(float(value))
+
+
+def format_size(nbytes):
+  '''Format a number of bytes for printing'''
+  for unit in ['T','G','M','K']:
+    if abs(nbytes) >= UNITS[unit]:
+      return '%.1f %sB' % (nbytes / float(UNITS[unit]), unit)
+  return '%d B' % nbytes
+
+
+def rss():
+  '''Return the current resident memory of this process in bytes'''
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError):
+    # Peak rather than current memory, in KB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname()[0] == 'Darwin' else maxrss * 1024
+
+
+def batch_hours(budget, hour_bytes, fixed_bytes=0, hours=None):
+  '''Pick how many hours of buffers fit in a memory budget
+
+  Batches of a day or more are rounded down to whole days, so daily files and indexes line up.'''
+  fit = int((budget - fixed_bytes) // max(hour_bytes,1))
+  if fit < 1:
+    raise MemoryError('A single hour needs %s, which is more than the %s memory budget'
+      % (format_size(hour_bytes + fixed_bytes), format_size(budget)))
+  if fit >= 24:
+    fit = fit // 24 * 24
+  if hours is not None:
+    fit = min(fit, hours)
+  return fit
+
+
+#------------------------------
+class MemoryTracker(object):
+  '''Track the peak Python allocations (tracemalloc) and resident memory of each stage of a run'''
+
+  def __init__(self, budget=None, trace=True):
+    self.budget = budget
+    self.trace = trace
+    self.stages = {}
+    self.peak_rss = rss()
+    if trace and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  @contextmanager
+  def stage(self, name):
+    '''Record the peak memory while the enclosed code runs'''
+    if self.trace and hasattr(tracemalloc, 'reset_peak'): # Python 3.9+
+      tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      peak = tracemalloc.get_traced_memory()[1] if self.trace else 0
+      current = rss()
+      self.peak_rss = max(self.peak_rss, current)
+      old = self.stages.get(name, (0, 0, 0.0))
+      self.stages[name] = (max(old[0], peak), max(old[1], current), old[2] + time.perf_counter() - start)
+
+  def over_budget(self):
+    '''Check whether the resident memory is above the budget'''
+    return self.budget is not None and rss() > self.budget
+
+  def report(self):
+    '''Summarize the peak memory of each stage'''
+    parts = []
+    for name, (peak, current, elapsed) in self.stages.items():
+      if self.trace:
+        parts.append('%s: peak %s allocated, %s resident, %.1f s' % (name, format_size(peak), format_size(current), elapsed))
+      else:
+        parts.append('%s: %s resident, %.1f s' % (name, format_size(current), elapsed))
+    text = '; '.join(parts) + '; peak resident %s' % format_size(self.peak_rss)
+    if self.budget is not None:
+      text += ' (budget %s)' % format_size(self.budget)
+    return text
+
+  def stop(self):
+    if self.trace and tracemalloc.is_tracing():
+      tracemalloc.stop()
@@ -0,0 +1,110 @@
+# Combine the outputs of sharded runs into one file
+# The shards are sorted by their first time and checked for overlapping and missing hours using only their time
+# coordinates.  The data is then copied a chunk of time steps at a time, so the shards are never all in memory.
+
+import os
+from datetime import datetime
+import pandas as pd
+import xarray as xr
+from wrfconv import common, packing
+
+#------------------------------
+KEEP_ENCODING = ['dtype','zlib','complevel','shuffle','chunksizes','_FillValue','scale_factor','add_offset','units','calendar']
+
+
+#------------------------------
+def merge_dim(ds):
+  '''Return the dimension the outputs are merged along, time or run_time for lead time cubes'''
+  return 'time' if 'time' in ds.dims else 'run_time'
+
+
+def file_groups(filename):
+  '''List the groups of a netcdf file, None for the root group, e.g. the pyramid levels of a grid file'''
+  import netCDF4
+  with netCDF4.Dataset(filename) as nc:
+    return [None] + sorted(nc.groups)
+
+
+def check_times(files):
+  '''Sort the shard files in time order and check them for overlapping and missing steps
+
+  Returns the sorted (filename, times) list, and the missing times.  Raises a ValueError if shards overlap.'''
+  shards = []
+  for filename in files:
+    with xr.open_dataset(filename) as ds:
+      shards.append((filename, pd.DatetimeIndex(ds[merge_dim(ds)].values)))
+  shards.sort(key=lambda x: x[1].min())
+  for (file1, times1), (file2, times2) in zip(shards[:-1], shards[1:]):
+    if times2.min() <= times1.max():
+      overlap = times1.intersection(times2)
+      raise ValueError('%s and %s overlap (%d steps from %s to %s)' % (file1, file2, len(overlap), times2.min(), times1.max()))
+  for filename, times in shards:
+    if times.has_duplicates:
+      raise ValueError('%s has duplicate times' % filename)
+  times = shards[0][1].append([t for f,t in shards[1:]])
+  freq = 'D' if len(times) > 1 and (times[1:] - times[:-1]).min() >= pd.Timedelta('1D') else 'h'
+  missing = pd.date_range(times[0], times[-1], freq=freq).difference(times)
+  return shards, missing
+
+
+def file_encoding(ds, dim='time'):
+  '''Reuse the encodings a shard was written with
+
+  Variables along the merge dimension need chunks, as it is unlimited in the merged file, so those the shard
+  stored contiguously are chunked for time series reads rather than left to the one step netCDF default.  With
+  dim=None the encodings are kept exactly as they are.'''
+  encoding = {}
+  for name, var in ds.variables.items():
+    encoding[name] = dict([(k, var.encoding[k]) for k in KEEP_ENCODING if k in var.encoding])
+    if dim in var.dims and encoding[name].get('chunksizes') is None:
+      encoding[name]['chunksizes'] = packing.chunk_shape(var, 'series')
+  return encoding
+
+
+def merge_files(files, output, chunk=744, allow_gaps=False):
+  '''Merge shard files into one output file in time order, copying chunk time steps at a time'''
+  shards, missing = check_times(files)
+  if len(missing):
+    print('%d missing steps, from %s to %s' % (len(missing), missing[0], missing[-1]))
+    if not allow_gaps:
+      raise ValueError('There are %d missing steps between or within the shards' % len(missing))
+
+  tmp_file = output + '.tmp'
+  groups = file_groups(shards[0][0])
+  n = 0
+  for filename, times in shards:
+    for group in groups:
+      if group is not None and group not in file_groups(filename):
+        raise ValueError('%s does not have the %s group' % (filename, group))
+    datasets = dict([(group, xr.open_dataset(filename, group=group)) for group in groups])
+    try:
+      dim = merge_dim(datasets[None])
+      for start in range(0, len(times), chunk):
+        part = dict([(group, ds.isel({dim:slice(start, start+chunk)}).load()) for group, ds in datasets.items()])
+        if n == 0:
+          for group in groups:
+            part[group].to_netcdf(tmp_file, mode='w' if group is None else 'a', group=group,
+              encoding=file_encoding(datasets[group], dim), unlimited_dims=[dim])
+        else:
+          common.append_netcdf(tmp_file, part, dim)
+        n += part[None].sizes[dim]
+    finally:
+      for ds in datasets.values():
+        ds.close()
+    print('Merged ' + filename)
+
+  history = '%s: merged %d shards with wrfconv merge' % (datetime.today().strftime('%Y-%m-%d %H:%M:%S'), len(shards))
+  with xr.open_dataset(shards[0][0]) as ds:
+    if 'history' in ds.attrs:
+      history = ds.attrs['history'] + '\n' + history
+  common.set_netcdf_attrs(tmp_file, {'history':history,
+    'merged_from':', '.join([os.path.basename(f) for f,t in shards])})
+  os.replace(tmp_file, output)
+  return n, missing
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  n, missing = merge_files(args.files, args.output, chunk=args.chunk, allow_gaps=args.allow_gaps)
+  print('Outputted %s (%d steps)' % (args.output, n))
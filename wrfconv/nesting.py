@@ -0,0 +1,92 @@
+# Combine several RU-WRF model domains in one point extraction
+# The domains are given in priority order, e.g. the 3km real-time runs, then the 3km and 9km backdating runs.  Each
+# station is assigned once to the domains whose grid covers it, finest resolution first, and each hour reads one file
+# per domain for only the stations assigned to it, falling back to the next domain where a file is missing.
+
+import os
+import numpy as np
+from wrfconv import points, readers, sources
+
+
+#------------------------------
+def parse_domains(value):
+  '''Parse a comma separated list of domains from sources.DOMAINS, in priority order
+
+  A domain can be read from another directory with name=directory.  Returns a list of (name, source, directory,
+  resolution) tuples.'''
+  domains = []
+  for item in value.split(','):
+    name, _, directory = item.strip().partition('=')
+    if name not in sources.DOMAINS:
+      raise ValueError('Unknown domain %s, please choose from: %s' % (name, ', '.join(sources.DOMAINS)))
+    source, default_directory, resolution = sources.DOMAINS[name]
+    domains.append((name, source, os.path.join(directory or default_directory, ''), resolution))
+  if len(set([d[1] for d in domains])) > 1:
+    raise ValueError('The domains must all have the same source (nc or grib)')
+  return domains
+
+
+def domain_grid(paths, reader, source):
+  '''Read the grid of a domain from the first of its files that exists, or None if there are none'''
+  for path in paths:
+    if os.path.exists(path):
+      handle = reader(path, source)
+      try:
+        return handle.latlon()
+      finally:
+        handle.close()
+  return None
+
+
+def covered(lats, lons, sites):
+  '''Check which stations are inside a domain grid, i.e. their nearest model point is not on the edge of it'''
+  ii,jj = points.nearest_points(lats, lons, sites)
+  ii,jj = np.array(ii), np.array(jj)
+  return (ii > 0) & (ii < lats.shape[0]-1) & (jj > 0) & (jj < lats.shape[1]-1)
+
+
+def assign_stations(domains, grids, sites):
+  '''List the domains that cover each station, finest resolution first and then in priority order'''
+  order = sorted(range(len(domains)), key=lambda d: (domains[d][3], d))
+  inside = dict([(d, covered(grids[d][0], grids[d][1], sites)) for d in order if grids[d] is not None])
+  candidates = [[d for d in order if d in inside and inside[d][k]] for k in range(len(sites))]
+  for k, name in enumerate(sites.name):
+    if candidates[k]:
+      print('Station %s: %s' % (name, ', '.join([domains[d][0] for d in candidates[k]])))
+    else:
+      print('Station %s is not covered by any of the domains' % name)
+  return candidates
+
+
+#------------------------------
+def extract_hour(paths, candidates, extract, reader, source, sites, read_vars, heights):
+  '''Extract one hour for every station, reading each domain file at most once
+
+  The stations are grouped by their first choice domain, and stations whose domain file can not be read move on
+  to their next choice.  extract is points.extract_file or cache.ExtractionCache.extract_file.  Returns the
+  {(variable, height): station array} values and the index of the domain used for each station (-1 for none).'''
+  nstations = len(sites)
+  used = np.full(nstations, -1, dtype='int8')
+  values = {}
+  failed = set()
+  pending = [k for k in range(nstations) if candidates[k]]
+  while pending:
+    groups = {}
+    for k in pending:
+      remaining = [d for d in candidates[k] if d not in failed]
+      if remaining:
+        groups.setdefault(remaining[0], []).append(k)
+    pending = []
+    for d, group in groups.items():
+      try:
+        part = extract(paths[d], reader, source, sites.iloc[group], read_vars, heights)
+      except readers.READ_ERRORS:
+        failed.add(d)
+        pending.extend(group)
+        continue
+      for key, v in part.items():
+        values.setdefault(key, np.full(nstations, np.nan))[group] = v
+      used[group] = d
+  if not (used >= 0).any():
+    raise IOError('None of the domain files could be read')
+  return values, used
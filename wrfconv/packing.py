@@ -0,0 +1,159 @@
+# Plan the netcdf encodings of the extraction outputs
+# Variables are packed as scale/offset int16 within a declared precision (or float32), and chunked for either
+# map reads (one time, all points) or time series reads (all times, a few points).  The packing is CF standard
+# (scale_factor, add_offset and _FillValue), so the files decode to the same variables as before.
+
+import os
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import xarray as xr
+from wrfconv import memory
+
+#------------------------------
+# Declared precision and valid range of each variable, as (precision, valid_min, valid_max).
+# int16 packing stores the valid range in steps of the precision, so it needs fewer than 65535 steps.
+PRECISION = {
+  'u_velocity': (0.01, -100, 100),
+  'v_velocity': (0.01, -100, 100),
+  'eastward_wind': (0.01, -100, 100),
+  'northward_wind': (0.01, -100, 100),
+  'wind_speed': (0.01, 0, 150),
+  'wind_dir': (0.01, 0, 360),
+  'wind_from_direction': (0.01, 0, 360),
+  'wind_power': (1, 0, 20000),
+  't2': (0.01, 180, 340),
+  'sst': (0.01, 260, 320),
+  'psfc': (1, 50000, 110000),
+  'swdown': (0.1, 0, 2000),
+  'air_density': (0.0001, 0.5, 2.5),
+}
+INT16_FILL = -32768
+PATTERNS = ['map','series']
+SERIES_HOURS = 24*31 # Time steps per chunk for time series reads
+SERIES_TILE = 16     # Grid points per side of a chunk for time series reads
+TIME_DIMS = ['time','run_time','lead_time']
+TRIALS = [(False,1), (True,1), (True,4), (True,9)] # (shuffle, compression level)
+
+
+#------------------------------
+def pack_encoding(name, da):
+  '''Choose the int16 packing of a variable within its declared precision, or float32 if it has none
+
+  Variables with values outside their valid range are saved as float32 rather than clipped.'''
+  if not np.issubdtype(da.dtype, np.floating):
+    return {}
+  if name not in PRECISION:
+    return {'dtype':'float32'}
+  precision, vmin, vmax = PRECISION[name]
+  values = da.values
+  if np.isfinite(values).any() and (np.nanmin(values) < vmin or np.nanmax(values) > vmax):
+    print('%s has values outside %s to %s, saving it as float32' % (name, vmin, vmax))
+    return {'dtype':'float32'}
+  return {'dtype':'int16', 'scale_factor':precision, 'add_offset':(vmin + vmax) / 2.0, '_FillValue':INT16_FILL}
+
+
+def chunk_shape(da, pattern):
+  '''Pick the chunk shape of a variable for map reads (one time step per chunk) or time series reads'''
+  chunks = []
+  for dim, size in zip(da.dims, da.shape):
+    if dim in TIME_DIMS:
+      chunks.append(1 if pattern == 'map' else min(size, SERIES_HOURS))
+    elif dim in ('y','x','lat','lon') and pattern == 'series':
+      chunks.append(min(size, SERIES_TILE))
+    elif dim == 'station' and pattern == 'series':
+      chunks.append(1)
+    else:
+      chunks.append(size)
+  return tuple(max(c,1) for c in chunks)
+
+
+def plan_encoding(ds, pack=False, pattern=None, comp_level=5, shuffle=True):
+  '''Plan the encodings of the data variables of a dataset
+
+  With pack, variables are packed as int16 (or float32) using PRECISION.  With a pattern of map or series,
+  the chunk shapes are chosen for that read pattern, otherwise they are left to the netcdf library.'''
+  encoding = {}
+  for name in ds.data_vars:
+    da = ds[name]
+    if not np.issubdtype(da.dtype, np.number):
+      continue
+    enc = {'zlib':True, 'complevel':comp_level, 'shuffle':shuffle}
+    if pack:
+      enc.update(pack_encoding(name, da))
+    if pattern is not None and da.ndim > 0:
+      enc['chunksizes'] = chunk_shape(da, pattern)
+    encoding[name] = enc
+  return encoding
+
+
+#------------------------------
+def time_reads(filename, pattern, repeat=5):
+  '''Time the typical reads of a pattern from a file, returning the best time in seconds'''
+  import netCDF4
+  best = None
+  with netCDF4.Dataset(filename) as nc:
+    names = [k for k,v in nc.variables.items() if v.dimensions and v.dimensions[0] in TIME_DIMS and len(v.dimensions) > 1]
+    for k in range(repeat):
+      start = time.perf_counter()
+      for name in names:
+        var = nc.variables[name]
+        if pattern == 'map':
+          var[var.shape[0] // 2]
+        else:
+          index = [slice(None)] + [s // 2 for s in var.shape[1:]]
+          if len(var.shape) > 3:
+            index[1] = slice(None) # All heights of a grid cell
+          var[tuple(index)]
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def trial_encodings(ds, pattern='map', trials=TRIALS, pack=True, time_encoding=None, directory=None):
+  '''Write a dataset with each (shuffle, compression level), reporting the size, write time and read time'''
+  rows = []
+  tmpdir = tempfile.mkdtemp(dir=directory)
+  try:
+    for shuffle, level in trials:
+      filename = os.path.join(tmpdir, 'trial_%d_%d.nc' % (shuffle, level))
+      encoding = plan_encoding(ds, pack=pack, pattern=pattern, comp_level=level, shuffle=shuffle)
+      encoding.update(time_encoding or {})
+      start = time.perf_counter()
+      ds.to_netcdf(filename, encoding=encoding)
+      write_time = time.perf_counter() - start
+      rows.append((shuffle, level, os.path.getsize(filename), write_time, time_reads(filename, pattern)))
+      os.remove(filename)
+  finally:
+    os.rmdir(tmpdir)
+  return rows
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  ds = xr.open_dataset(args.file)
+  ds.load()
+  ds.close()
+  for var in ds.variables.values():
+    var.encoding = {} # Plan from scratch rather than reusing the original encodings
+  time_encoding = {}
+  for name in [k for k in ds.variables if ds[k].dtype.kind == 'M']:
+    time_encoding[name] = dict(units='days since 2010-01-01 00:00:00', calendar='gregorian', dtype=np.double)
+
+  print('%s: %s as written' % (args.file, memory.format_size(os.path.getsize(args.file))))
+  print('%-8s %-8s %6s %10s %9s %9s' % ('packing', 'shuffle', 'level', 'size', 'write s', 'read ms'))
+  for pack in [False, True]:
+    for shuffle, level, size, write_time, read_time in trial_encodings(ds, args.pattern, pack=pack,
+        time_encoding=time_encoding, directory=os.path.dirname(os.path.abspath(args.file))):
+      print('%-8s %-8s %6d %10s %9.2f %9.2f' % ('int16' if pack else 'none', shuffle, level,
+        memory.format_size(size), write_time, 1000*read_time))
+
+  if args.output:
+    encoding = plan_encoding(ds, pack=True, pattern=args.pattern, comp_level=args.level)
+    encoding.update(time_encoding)
+    history = '%s: re-encoded with wrfconv encode (int16 packing, %s chunks)' % (datetime.today().strftime('%Y-%m-%d %H:%M:%S'), args.pattern)
+    ds.attrs['history'] = (ds.attrs['history'] + '\n' + history) if 'history' in ds.attrs else history
+    ds.to_netcdf(args.output, encoding=encoding)
+    print('Outputted %s (%s)' % (args.output, memory.format_size(os.path.getsize(args.output))))
@@ -0,0 +1,75 @@
+# Columnar Parquet output for the RU-WRF point extractors
+# Writes station time series as a partitioned Parquet dataset (year/month/station) so pandas, pyarrow
+# and duckdb queries only need to read the columns and partitions they ask for.
+
+import pandas as pd
+import xarray as xr
+
+#------------------------------
+LAYOUTS = ['long','wide']
+PARTITION_COLS = ['year','month','station']
+
+
+#------------------------------
+def to_long(ds):
+  '''Convert a point dataset into a long table with one row per time, station, height and variable'''
+  frames = []
+  for name, da in ds.data_vars.items():
+    if da.dims == ('station',):
+      continue # Station metadata, e.g. latitude/longitude
+    df = da.to_dataframe(name='value').reset_index()
+    df.insert(0, 'variable', name)
+    frames.append(df)
+  df = pd.concat(frames, ignore_index=True, sort=False)
+  if 'height' in df:
+    df['height'] = df['height'].astype('Int32') # Surface variables have no height
+  return _finish(df)
+
+
+def to_wide(ds):
+  '''Convert a point dataset into a wide table with one row per time and station, and a column per variable and height'''
+  columns = {}
+  for name, da in ds.data_vars.items():
+    if 'height' in da.dims:
+      for h in da['height'].values:
+        columns['%s_%dm' % (name,h)] = da.sel(height=h, drop=True)
+    else:
+      columns[name] = da
+  df = xr.Dataset(columns).to_dataframe().reset_index()
+  return _finish(df)
+
+
+def _finish(df):
+  '''Decode station names and add the partition columns'''
+  df['station'] = [s.decode() if isinstance(s, bytes) else str(s) for s in df['station']]
+  times = pd.DatetimeIndex(df['run_time'] if 'run_time' in df else df['time'])
+  df['year'] = times.year.astype('int16')
+  df['month'] = times.month.astype('int8')
+  return df
+
+
+#------------------------------
+def write_parquet(ds, root, layout='long', partition_cols=PARTITION_COLS, compression='zstd'):
+  '''Write a point dataset to a Parquet dataset directory partitioned by year, month and station
+
+  Files are named after the time span of the dataset, so re-running a date range replaces its
+  files while other ranges written to the same root are left alone.'''
+  try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+  except ImportError:
+    raise ImportError('Parquet output requires pyarrow, please install it (e.g. conda install pyarrow)')
+
+  if layout == 'long':
+    df = to_long(ds)
+  elif layout == 'wide':
+    df = to_wide(ds)
+  else:
+    raise ValueError('Unknown Parquet layout %s, please choose from: %s' % (layout, ', '.join(LAYOUTS)))
+
+  times = pd.DatetimeIndex(df['run_time'] if 'run_time' in df else df['time'])
+  span = '%s_%s' % (times.min().strftime('%Y%m%d%H'), times.max().strftime('%Y%m%d%H'))
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  pq.write_to_dataset(table, root, partition_cols=list(partition_cols), compression=compression,
+    basename_template='wrf_' + span + '_{i}.parquet', existing_data_behavior='overwrite_or_ignore')
+  return root
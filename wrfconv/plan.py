@@ -0,0 +1,274 @@
+# Dry run planner for the RU-WRF extractors
+# Resolves the model files a command would read from a listing of each run directory (the files are never opened),
+# and summarizes the missing files by gap and model epoch.  The runtime is estimated from the total file size and
+# the throughput recorded by earlier runs, and the peak memory from the same buffer sizes the extractors use.
+
+import json
+import math
+import os
+from datetime import datetime,timedelta
+import pandas as pd
+from wrfconv import common, leads, memory, readers, sources
+
+#------------------------------
+# Model epochs of each archive, from the Model Data Availabilty notes in the Readme, with the
+# (levels, y, x) shape of the model files where it is known
+EPOCHS = [
+  ('grib', datetime(2013,8,1), 'v3.6 GRIB, 11 levels, 376x390 grid', (11,376,390)),
+  ('grib', datetime(2013,10,1), 'v3.6 GRIB, 11 levels, 324x324 grid', (11,324,324)),
+  ('grib', datetime(2014,11,28), 'v3.6 GRIB, 15 levels, 324x324 grid', (15,324,324)),
+  ('grib', datetime(2015,6,1), 'v3.6 GRIB, 20 levels, 324x324 grid', (20,324,324)),
+  ('grib', datetime(2017,12,1), 'after the v3.6 GRIB runs', None),
+  ('nc', datetime(2017,12,1), 'v3.9 NetCDF', None),
+]
+THROUGHPUT_FILE = '~/.cache/wrfconv/throughput.json'
+RECORDED_RUNS = 10 # Runs kept for each command and source
+DEFAULT_THROUGHPUT = {'points':100*1024**2, 'grid':40*1024**2} # Model file bytes per second, before any runs are recorded
+JOB_TIME = 4*3600  # Runtime of each job when suggesting shards (s)
+MAX_GAPS = 10      # Gaps listed in the summary
+
+
+#------------------------------
+def run_files(args, resolution=3):
+  '''List the (time, model run, file) of each model file a command would read, in the order it reads them'''
+  source = getattr(args, 'source', 'grib') # extract only reads the GRIB files
+  start_date = common.parse_date(args.date)
+  if getattr(args, 'leads', False):
+    runs = pd.date_range(start_date, start_date + timedelta(args.days-1), freq="D")
+    return [(run + timedelta(hours=int(lead)), run, sources.make_run_file(source, run, lead, resolution))
+            for run in runs for lead in leads.LEAD_TIMES]
+  steps = []
+  for t in pd.date_range(start_date, common.end_date(start_date,args.days), freq="h"):
+    run = t - timedelta(1) if t.hour < args.forecast_offset else t
+    steps.append((t, datetime(run.year, run.month, run.day), sources.make_wrf_file(source, t, args.forecast_offset, resolution)))
+  return steps
+
+
+def file_sizes(directory, files):
+  '''Look up the size of each file from one listing of each directory, with None for missing files'''
+  listings = {}
+  sizes = []
+  for f in files:
+    folder, name = os.path.split(os.path.join(directory, f))
+    if folder not in listings:
+      try:
+        listings[folder] = dict([(e.name, e.stat().st_size) for e in os.scandir(folder) if e.is_file()])
+      except OSError:
+        listings[folder] = {}
+    sizes.append(listings[folder].get(name))
+  return sizes
+
+
+def model_epoch(source, run):
+  '''Find the model epoch of a run, as (description, shape)'''
+  found = ('before the %s archive' % source, None)
+  for s, start, description, shape in EPOCHS:
+    if s == source and run >= start:
+      found = (description, shape)
+  return found
+
+
+def find_gaps(steps, sizes):
+  '''Group the missing files into runs of consecutive steps, as (first time, last time, count)'''
+  gaps = []
+  previous = None # Size of the previous file
+  for (t, run, f), size in zip(steps, sizes):
+    if size is None:
+      if gaps and previous is None:
+        gaps[-1] = (gaps[-1][0], t, gaps[-1][2] + 1)
+      else:
+        gaps.append((t, t, 1))
+    previous = size
+  return gaps
+
+
+#------------------------------
+def throughput_key(args):
+  '''Name the recorded throughput of a command and model source'''
+  command = 'grid' if args.command in ('grid','subgrid') else args.command
+  return '%s/%s' % (command, getattr(args, 'source', 'grib'))
+
+
+def load_throughput(filename=THROUGHPUT_FILE):
+  '''Load the recorded runs, {key: {'runs': [[bytes, seconds], ...], 'shape': [y, x]}}'''
+  try:
+    with open(os.path.expanduser(filename)) as f:
+      return json.load(f)
+  except (IOError, OSError, ValueError):
+    return {}
+
+
+def record_run(args, seconds, shape=None, filename=THROUGHPUT_FILE):
+  '''Record the model file bytes read per second by a finished run, for later plans
+
+  Runs reading from the extraction cache or several domains are skipped, since they do not read one set of model files.'''
+  if getattr(args, 'cache', None) or getattr(args, 'domains', None) or seconds <= 0:
+    return
+  directory = args.directory or sources.DIRECTORIES[getattr(args, 'source', 'grib')]
+  nbytes = sum([s for s in file_sizes(directory, [f for t,run,f in run_files(args)]) if s is not None])
+  if nbytes == 0:
+    return
+  filename = os.path.expanduser(filename)
+  records = load_throughput(filename)
+  entry = records.setdefault(throughput_key(args), {'runs':[]})
+  entry['runs'] = (entry['runs'] + [[nbytes, seconds]])[-RECORDED_RUNS:]
+  if shape is not None:
+    entry['shape'] = [int(n) for n in shape]
+  try:
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+      json.dump(records, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+  except OSError as e:
+    print('Could not record the run throughput: %s' % e)
+
+
+def throughput(args, records):
+  '''Return the model file bytes read per second for a command, and where it came from'''
+  entry = records.get(throughput_key(args))
+  if entry and entry['runs']:
+    nbytes = sum([r[0] for r in entry['runs']])
+    seconds = sum([r[1] for r in entry['runs']])
+    return nbytes / seconds, 'recorded from %d runs' % len(entry['runs'])
+  command = 'grid' if args.command in ('grid','subgrid','extract') else 'points'
+  return DEFAULT_THROUGHPUT[command], 'default guess, no runs recorded yet'
+
+
+#------------------------------
+def peak_memory(args, nsteps, shape):
+  '''Estimate the peak memory of a command, from the sizes of the buffers it holds
+
+  Returns the estimate in bytes (None if the grid shape is unknown) and a note on how it was made.'''
+  readers.import_readers(getattr(args, 'source', 'grib'), getattr(args, 'reader', 'auto'))
+  base = memory.rss()
+  if args.command == 'points':
+    from wrfconv import catalog, points
+    sites = pd.read_csv(args.coordinates, skipinitialspace=True)
+    variables = catalog.parse_variables(args.variables or points.DEFAULT_VARIABLES[args.source])
+    values = points.station_values(nsteps, len(sites), args.heights, variables,
+      catalog.source_variables(variables, args.source))
+    base += points.READER_MEMORY
+    if args.max_memory is not None and values * 4 + base > args.max_memory:
+      day_bytes = points.station_values(len(leads.LEAD_TIMES) if getattr(args, 'leads', False) else 24, len(sites),
+        args.heights, variables, catalog.source_variables(variables, args.source)) * 4
+      days = int((args.max_memory - base) // day_bytes)
+      if days < 1:
+        return day_bytes + base, '%d stations, more than --max-memory for a single day' % len(sites)
+      return days * day_bytes + base, '%d stations, float32 arrays in batches of %d days to fit --max-memory' % (len(sites), days)
+    if args.max_memory is not None and values * 8 + base > args.max_memory:
+      return values * 4 + base, '%d stations, float32 arrays to fit --max-memory' % len(sites)
+    return values * 8 + base, '%d stations' % len(sites)
+  if args.command == 'areas':
+    from wrfconv import areas
+    nareas = len(areas.read_areas(args.areas))
+    layers = len(args.heights) * 6 # Wind components, speed, direction, power and a spare copy
+    note = '%d areas' % nareas
+    estimate = nsteps * nareas * layers * 8 * 2 + base
+    if shape is not None:
+      estimate += nareas * shape[-2] * shape[-1] * 8 # Dense cell weights at worst
+    return estimate, note
+  if args.command == 'profile':
+    nstations = len(pd.read_csv(args.coordinates, skipinitialspace=True))
+    levels = (shape[0] if shape is not None and len(shape) == 3 else 20) + 1 # With the 10m winds
+    return nsteps * nstations * levels * 4 * 8 * 2 + base, '%d stations, up to %d levels' % (nstations, levels)
+  if shape is None:
+    return None, 'the model grid size is not known until a run is recorded'
+  ny, nx = shape[-2:]
+  if args.command == 'extract':
+    return nsteps * ny * nx * 8 * 6 + base, '%dx%d grid' % (ny, nx) # Speed and power layers, concatenated
+  from wrfconv import grid
+  per_hour = grid.hour_bytes(grid.HEIGHTS, (ny, nx))
+  note = '%dx%d grid' % (ny, nx)
+  if getattr(args, 'bbox', None):
+    note += ', the full grid as an upper bound for --bbox'
+  if 'only' in (args.stats, args.aggregate):
+    return base + per_hour, note + ', statistics or means only'
+  if args.max_memory is not None:
+    hours = memory.batch_hours(args.max_memory, per_hour, base, nsteps)
+    return hours * per_hour + base, note + ', %d hours per batch' % hours
+  return nsteps * per_hour + base, note
+
+
+def format_time(seconds):
+  '''Format a duration for printing'''
+  return str(timedelta(seconds=int(round(seconds))))
+
+
+def make_plan(args):
+  '''Plan a run, returning the lines of the summary'''
+  if getattr(args, 'domains', None):
+    from wrfconv import nesting
+    domains = nesting.parse_domains(args.domains)
+    args.source = domains[0][1]
+  else:
+    domains = [(None, getattr(args, 'source', 'grib'), args.directory or sources.DIRECTORIES[getattr(args, 'source', 'grib')], 3)]
+  source = domains[0][1]
+
+  # Look for each step in the domains in order, as the extractors fall back to them
+  steps = run_files(args)
+  sizes = [None] * len(steps)
+  domain_found = []
+  for name, dsource, directory, resolution in domains:
+    domain_sizes = file_sizes(directory, [f for t,run,f in run_files(args, resolution)])
+    sizes = [a if a is not None else b for a, b in zip(sizes, domain_sizes)]
+    domain_found.append(len([s for s in domain_sizes if s is not None]))
+  found = [s for s in sizes if s is not None]
+  nbytes = sum(found)
+  lines = ['Plan for wrfconv %s %s -d %d from %s' % (args.command, args.date, args.days,
+             ', '.join([d[2] for d in domains])),
+           'Files: %d needed, %d found (%s), %d missing' % (len(steps), len(found), memory.format_size(nbytes),
+             len(steps) - len(found))]
+  if len(domains) > 1:
+    for (name, dsource, directory, resolution), count in zip(domains, domain_found):
+      lines.append('  %s: %d found' % (name, count))
+
+  # Missing files
+  gaps = find_gaps(steps, sizes)
+  if gaps:
+    lines.append('Gaps: %d' % len(gaps))
+    for first, last, count in gaps[:MAX_GAPS]:
+      lines.append('  %s to %s (%d files)' % (first, last, count))
+    if len(gaps) > MAX_GAPS:
+      lines.append('  ... and %d more' % (len(gaps) - MAX_GAPS))
+
+  # Model epochs
+  epochs = {}
+  for (t, run, f), size in zip(steps, sizes):
+    description, shape = model_epoch(source, run)
+    row = epochs.setdefault(description, [run, run, 0, 0, 0, shape])
+    row[1] = run
+    row[2] += 1
+    if size is not None:
+      row[3] += 1
+      row[4] += size
+  lines.append('Epochs:')
+  for description, (first, last, needed, nfound, size, shape) in epochs.items():
+    lines.append('  %s: runs %s to %s, %d/%d files (%s)' % (description, first.strftime('%Y-%m-%d'),
+      last.strftime('%Y-%m-%d'), nfound, needed, memory.format_size(size)))
+
+  # Runtime and memory
+  records = load_throughput()
+  rate, rate_note = throughput(args, records)
+  seconds = nbytes / rate
+  lines.append('Runtime: about %s at %s/s (%s)' % (format_time(seconds), memory.format_size(rate), rate_note))
+  recorded = records.get(throughput_key(args), {}).get('shape')
+  shapes = [shape for description, (a, b, c, d, e, shape) in epochs.items() if shape is not None]
+  shape = max(shapes, key=lambda s: s[1]*s[2]) if shapes else recorded
+  peak, memory_note = peak_memory(args, len(steps), shape)
+  if peak is None:
+    lines.append('Peak memory: not estimated, %s' % memory_note)
+  else:
+    lines.append('Peak memory: about %s (%s)' % (memory.format_size(peak), memory_note))
+
+  # Job sizing
+  if seconds > JOB_TIME and args.days > 1:
+    nshards = min(args.days, int(math.ceil(seconds / JOB_TIME)))
+    lines.append('Suggested: --shard i/%d, %d jobs of about %d days and %s each' % (nshards, nshards,
+      int(math.ceil(args.days / float(nshards))), format_time(seconds / nshards)))
+  return lines
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  print('\n'.join(make_plan(args)))
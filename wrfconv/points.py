@@ -0,0 +1,423 @@
+# Extract RU-WRF Model Data at specified points from the NetCDF or GRIB model files
+# Combines wrfptextract_nc.py and wrfptextract_grib.py, originally written by Sage, 4/4/19
+
+from datetime import datetime,timedelta
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import catalog, common, derive, leads, memory, packing, plan, readers, sources
+
+#------------------------------
+HEIGHTS = [10,100,120,140]
+POINT_COPIES = 2 # Copies of the station arrays held while the output is built and written
+READER_MEMORY = 16 * 1024**2 # Taken by probing and reading the model files (about 10 MB with netCDF4)
+DEFAULT_VARIABLES = {
+  'nc': 'u_velocity,v_velocity,swdown',
+  'grib': 'u_velocity,v_velocity',
+}
+
+
+#------------------------------
+def nearest_points(lats, lons, sites):
+  '''Find the closest model point to each station'''
+  ii,jj = [],[]
+  for index, site in sites.iterrows():
+    a = abs(lats-site.latitude)+abs(lons-site.longitude)
+    i,j = np.unravel_index(a.argmin(),a.shape)
+    ii.append(i)
+    jj.append(j)
+  return ii,jj
+
+
+def extract_file(path, reader, source, sites, read_vars, heights):
+  '''Extract the selected variables at each station from one WRF file'''
+  handle = reader(path, source)
+  try:
+    lats, lons = handle.latlon()
+    ii,jj = nearest_points(lats, lons, sites)
+
+    # Read each selected layer once
+    values = {}
+    for name in read_vars:
+      for h,source_var in catalog.layers(name, source, heights):
+        values[(name,h)] = handle.read_points(name, h, ii, jj)
+  finally:
+    handle.close()
+  return values
+
+
+#------------------------------
+def station_coords(sites, stations):
+  '''Create the station latitude and longitude variables'''
+  latitude = xr.DataArray(sites['latitude'].values, coords=[stations], dims=['station'], attrs={
+    'units':'degrees_north',
+    'comment':'The latitude of the station.',
+    'long_name':'Latitude',
+    'standard_name':'latitude'
+  })
+  longitude = xr.DataArray(sites['longitude'].values, coords=[stations], dims=['station'], attrs={
+    'units':'degrees_east',
+    'comment':'The longitude of the station.',
+    'long_name':'Longitude',
+    'standard_name':'longitude'
+  })
+  return latitude, longitude
+
+
+def hour_fields(values, names, heights):
+  '''Arrange the values extracted from one file as (dims, array) for each variable'''
+  fields = {}
+  for name in names:
+    if catalog.VARIABLES[name]['heights']:
+      fields[name] = (('station','height'), np.stack([values[(name,h)] for h in heights], axis=1))
+    else:
+      fields[name] = (('station',), values[(name,None)])
+  return fields
+
+
+def output_variables(arrays, variables, diagnostics=False):
+  '''Build the output variables (including derived and wind variables) from the extracted arrays
+
+  With diagnostics, the wind shear, veer and rotor equivalent wind speed are added, and density corrected power
+  if the surface pressure and temperature were extracted.'''
+  out = {}
+  for name in variables:
+    if 'derive' in catalog.VARIABLES[name]:
+      out[name] = catalog.derive(name, arrays)
+    else:
+      out[name] = arrays[name]
+
+  if 'u_velocity' in variables and 'v_velocity' in variables:
+    out['wind_speed'] = derive.wind_speed(arrays['u_velocity'], arrays['v_velocity'])
+    out['wind_dir'] = derive.wind_dir(arrays['u_velocity'], arrays['v_velocity'])
+    out['wind_power'] = derive.wind_power(out['wind_speed'])
+    if diagnostics:
+      rho = catalog.derive('air_density', arrays) if 'psfc' in arrays and 't2' in arrays else None
+      out.update(derive.wind_diagnostics(arrays['u_velocity'], arrays['v_velocity'], 'height', rho))
+  return out
+
+
+def station_domains(domain_used, template, domains):
+  '''Create the variable recording which domain each station was read from at each step'''
+  if 'height' in template.dims:
+    template = template.isel(height=0, drop=True)
+  da = xr.DataArray(domain_used.reshape(template.shape), coords=template.coords, dims=template.dims)
+  da.attrs = {'long_name':'Model Domain', 'flag_values':np.arange(len(domains), dtype='int8'),
+    'flag_meanings':' '.join([d[0] for d in domains]), 'comment':'Model domain each station was read from, -1 where none could be read.'}
+  return da
+
+
+def station_values(nsteps, nstations, heights, variables, read_vars):
+  '''Count the values held in the station arrays, including the copies made while the output is built'''
+  layers = sum([len(heights) if catalog.VARIABLES[name]['heights'] else 1 for name in set(variables) | set(read_vars)])
+  if 'u_velocity' in variables and 'v_velocity' in variables:
+    layers += 3 * len(heights) # Wind speed, direction and power
+  return nsteps * nstations * layers * POINT_COPIES
+
+
+def array_dtype(nsteps, nstations, heights, variables, read_vars, max_memory):
+  '''Pick the float type for the station arrays so they fit in what is left of a memory budget'''
+  values = station_values(nsteps, nstations, heights, variables, read_vars)
+  available = max_memory - memory.rss()
+  for dtype in ['float64','float32']:
+    if values * np.dtype(dtype).itemsize <= available:
+      if dtype != 'float64':
+        print('Memory budget %s: storing the station arrays as %s' % (memory.format_size(max_memory), dtype))
+      return dtype
+  raise MemoryError('The station arrays need at least %s, which is more than the %s memory budget, please set --max-memory to at least %s'
+    % (memory.format_size(values*4 + memory.rss()), memory.format_size(max_memory),
+    memory.format_size(values*4 + memory.rss() + READER_MEMORY)))
+
+
+def batch_days(days, nstations, heights, variables, read_vars, max_memory, lead_cube=False):
+  '''Pick how many days of station arrays fit in a memory budget, stored as float32 if need be
+
+  A day is 24 hours, or one model run of a lead time cube.  The memory in use is measured with the reader
+  libraries imported, and READER_MEMORY is kept for reading the files.  Raises a MemoryError with the budget
+  needed if a single day does not fit.'''
+  steps = len(leads.LEAD_TIMES) if lead_cube else 24
+  day_bytes = station_values(steps, nstations, heights, variables, read_vars) * 4
+  used = memory.rss() + READER_MEMORY
+  fit = int((max_memory - used) // day_bytes)
+  if fit < 1:
+    raise MemoryError('A single day of station arrays needs %s on top of the %s used to read the files, more than the %s memory budget allows, '
+      'please set --max-memory to at least %s' % (memory.format_size(day_bytes), memory.format_size(used),
+      memory.format_size(max_memory), memory.format_size(day_bytes + used)))
+  return min(days, fit)
+
+
+def extract_points(start_date, days, sites, source='nc', variables=None, heights=HEIGHTS,
+                   forecast_offset=6, directory=None, lead_cube=False, reader='auto', stats=None, max_memory=None, cache=None,
+                   domains=None, diagnostics=False, dtype=None):
+  '''Extract a dataset of the selected variables at each station
+
+  With lead_cube, every forecast hour of each model run is extracted along (run_time, lead_time)
+  instead of a single forecast_offset time series.  The reader is chosen with readers.select_reader.
+  If a stats.StatsAccumulator (or PeriodAccumulator) is given, it is updated with each hour as it is extracted.  With a max_memory
+  budget (bytes), the arrays are stored as float32 if float64 would not fit, unless their dtype is given (as it is
+  for the later batches of a run, whose memory was already used by the first).  With a cache.ExtractionCache,
+  only the files and stations missing from the cache are read.  With a list of domains (from
+  nesting.parse_domains), each station is read from the finest domain covering it, in place of directory.  With
+  diagnostics, the wind resource diagnostics of derive.wind_diagnostics are added.'''
+  if lead_cube and stats is not None:
+    raise ValueError('Statistics are only kept for time series, not lead time cubes')
+  if domains is not None:
+    source, directory = domains[0][1], domains[0][2]
+  if directory is None:
+    directory = sources.DIRECTORIES[source]
+  if variables is None:
+    variables = DEFAULT_VARIABLES[source]
+  variables = catalog.parse_variables(variables)
+  read_vars = catalog.source_variables(variables, source)
+  heights = np.array(heights, dtype='int32')
+
+  #------------------------------
+  # Setup default arrays
+  stations = sites.name.astype('S')
+  times = pd.date_range(start_date, common.end_date(start_date,days), freq="h")
+  runs = pd.date_range(start_date, start_date + timedelta(days-1), freq="D")
+  if lead_cube:
+    # Every forecast hour of each model run in the date range
+    steps = [({'run_time':r, 'lead_time':l}, sources.make_run_file(source,r,l)) for r in runs for l in leads.LEAD_TIMES]
+  else:
+    steps = [({'time':t}, sources.make_wrf_file(source,t,forecast_offset)) for t in times]
+
+  # Pick the reader using the first available file
+  if domains is None:
+    reader_cls, probe_times = readers.select_for_files([directory + f for i,f in steps], source, 'points',
+      read_vars, heights, reader)
+  else:
+    # The model files of each domain for every step, and the domains that cover each station
+    from wrfconv import nesting
+    if lead_cube:
+      domain_paths = [[d[2] + sources.make_run_file(source,r,l,d[3]) for r in runs for l in leads.LEAD_TIMES] for d in domains]
+    else:
+      domain_paths = [[d[2] + sources.make_wrf_file(source,t,forecast_offset,d[3]) for t in times] for d in domains]
+    reader_cls, probe_times = readers.select_for_files([p for paths in zip(*domain_paths) for p in paths], source,
+      'points', read_vars, heights, reader)
+    candidates = []
+    if reader_cls is not None:
+      grids = [nesting.domain_grid(paths, reader_cls, source) for paths in domain_paths]
+      candidates = nesting.assign_stations(domains, grids, sites)
+    domain_used = np.full((len(steps), len(stations)), -1, dtype='int8')
+
+  # Size the arrays once the reader and its libraries are loaded
+  if dtype is None:
+    dtype = 'float64' if max_memory is None else array_dtype(len(steps), len(stations), heights, variables, read_vars,
+      max_memory)
+  arrays = {}
+  for name in read_vars:
+    if lead_cube:
+      arrays[name] = leads.make_cube(name, runs, leads.LEAD_TIMES, stations, heights, dtype)
+    else:
+      arrays[name] = catalog.make_array(name, times, stations, heights, dtype)
+
+  #------------------------------
+  # Step 1 - Loop over each hour
+  for n, (index, wrf_file) in enumerate(steps):
+
+    # Step 2 - Open WRF file and extract the selected variables at each station
+    if reader_cls is None: # None of the files exist
+      print('Could not open ' + wrf_file)
+      continue
+    try:
+      if domains is not None:
+        values, domain_used[n] = nesting.extract_hour([paths[n] for paths in domain_paths], candidates,
+          extract_file if cache is None else cache.extract_file, reader_cls, source, sites, read_vars, heights)
+        wrf_file = ', '.join(['%s (%s)' % (domain_paths[d][n][len(domains[d][2]):], domains[d][0])
+          for d in np.unique(domain_used[n]) if d >= 0])
+      elif cache is not None:
+        values = cache.extract_file(directory + wrf_file, reader_cls, source, sites, read_vars, heights)
+      else:
+        values = extract_file(directory + wrf_file, reader_cls, source, sites, read_vars, heights)
+      print('Processing: ' + ' '.join([str(v) for v in index.values()]) + ' File: ' + wrf_file)
+
+      # Step 3 - Save data for each variable
+      for (name,h),v in values.items():
+        loc = dict(index)
+        if h is not None:
+          loc['height'] = h
+        arrays[name].loc[loc] = v
+      if stats is not None:
+        stats.update(index['time'], hour_fields(values, read_vars, heights))
+
+    except readers.READ_ERRORS:
+      print('Could not open ' + wrf_file)
+
+  # Step 4 - Calculated additional variables
+  latitude, longitude = station_coords(sites, stations)
+  final_dataset = xr.Dataset({'latitude':latitude, 'longitude':longitude})
+  final_dataset.update(output_variables(arrays, variables, diagnostics))
+  if domains is not None:
+    final_dataset['domain'] = station_domains(domain_used, arrays[read_vars[0]], domains)
+
+  # Add global metadata
+  ftype = {'nc':'NetCDF', 'grib':'GRIB'}[source]
+  if not lead_cube:
+    final_dataset.attrs['forecast_offset'] = forecast_offset
+  final_dataset.attrs['source'] = source
+  final_dataset.attrs['source_directory'] = directory
+  if domains is not None:
+    final_dataset.attrs['domains'] = ', '.join(['%s (%s)' % (d[0], d[2]) for d in domains])
+  if reader_cls is not None:
+    final_dataset.attrs['reader'] = readers.describe(reader_cls, probe_times)
+  final_dataset.attrs['date_created'] = str(datetime.today())
+
+  final_dataset.attrs['acknowledgement'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_name'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_url'] = "https://rucool.marine.rutgers.edu"
+  final_dataset.attrs['creator_email'] = "sage@marine.rutgers.edu"
+  if lead_cube:
+    final_dataset.attrs['summary'] = "Wind data extracted from %s files produced by Rutgers University's 3km WRF model run.  The model is run daily at 00Z and forecast files are saved every hour.  This file contains every forecast hour (lead_time) of each model run (run_time), with the valid UTC time of each forecast in the time variable.  A virtual time series for any forecast offset can be sliced out using wrfconv.leads.virtual_time_series." % ftype
+  else:
+    final_dataset.attrs['summary'] = "Wind data extracted from %s files produced by Rutgers University's 3km WRF model run.  The model is run daily at 00Z and forecast files are saved every hour.  Times in this file are UTC based on the forecast run times.  The forecast_offset specifies how many hours of model spin up are allowed before the data is used.  For example, a value of 6 means the first 6 hours of data for any day are actually extracted from the previous day's model run." % ftype
+  final_dataset.attrs['project'] = "RU COOL BPU Wind Energy Project"
+  final_dataset.attrs['title'] = "Rutgers WRF 3km Model output at selected stations"
+  final_dataset.attrs['Conventions'] = 'CF-1.6'
+  return final_dataset
+
+
+def make_encoding(ds, pack=False, pattern=None):
+  '''Create variable encodings for saving point datasets to netcdf, compressed and optionally packed and chunked'''
+  encoding = packing.plan_encoding(ds, pack=pack, pattern=pattern)
+  encoding['time'] = dict(units='days since 2010-01-01 00:00:00', calendar='gregorian', dtype=np.double)
+  if 'run_time' in ds.coords:
+    encoding['run_time'] = dict(units='days since 2010-01-01 00:00:00', calendar='gregorian', dtype=np.double)
+  if 'backfill_run' in ds:
+    encoding['backfill_run'] = dict(units='days since 2010-01-01 00:00:00', calendar='gregorian', dtype=np.double)
+  return encoding
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  # Specify Date Range to Process
+  start_date = common.parse_date(args.date)
+  end_date = common.end_date(start_date,args.days)
+
+  # Load Selected Station Locations
+  sites = pd.read_csv(args.coordinates, skipinitialspace=True)
+
+  acc, agg, accumulators = None, None, None
+  if args.stats or args.aggregate:
+    from wrfconv import stats
+    acc = stats.StatsAccumulator() if args.stats else None
+    agg = stats.PeriodAccumulator() if args.aggregate else None
+    accumulators = stats.Accumulators([a for a in (acc, agg) if a is not None])
+  tracker = memory.MemoryTracker(args.max_memory, trace=args.max_memory is not None)
+  extraction_cache = None
+  if args.cache:
+    from wrfconv import cache
+    extraction_cache = cache.ExtractionCache(args.cache, args.cache_size)
+
+  domains = None
+  if args.domains:
+    from wrfconv import nesting
+    domains = nesting.parse_domains(args.domains)
+    args.source = domains[0][1]
+
+  # Split the days into batches that fit the memory budget, written to the same output file
+  prefix = args.prefix
+  if args.leads:
+    prefix = prefix + '_leads'
+  hourly = 'only' not in (args.stats, args.aggregate)
+  output_datafile = common.output_filename(prefix, start_date, end_date)
+  ndays = args.days
+  if args.max_memory is not None:
+    readers.import_readers(args.source, args.reader) # Counted in the memory in use
+    variables = catalog.parse_variables(args.variables or DEFAULT_VARIABLES[args.source])
+    read_vars = catalog.source_variables(variables, args.source)
+    ndays = batch_days(args.days, len(sites), args.heights, variables, read_vars, args.max_memory, args.leads)
+    if ndays < args.days and (args.parquet or args.per_station):
+      needed = station_values(len(leads.LEAD_TIMES) if args.leads else 24, len(sites), args.heights, variables, read_vars) * 4 * args.days
+      raise MemoryError('--parquet and --per-station need all %d days in memory at once, please set --max-memory to at least %s'
+        % (args.days, memory.format_size(needed + memory.rss())))
+    if ndays < args.days:
+      print('Memory budget %s: extracting %d days per batch' % (memory.format_size(args.max_memory), ndays))
+  dim = 'run_time' if args.leads else 'time'
+  index_rows = []
+  reader = args.reader
+  dtype = None
+  day = 0
+  while day < args.days:
+    batch_ndays = min(ndays, args.days - day)
+    try:
+      with tracker.stage('extract'):
+        final_dataset = extract_points(start_date + timedelta(day), batch_ndays, sites, source=args.source,
+          variables=args.variables, heights=args.heights, forecast_offset=args.forecast_offset, directory=args.directory,
+          lead_cube=args.leads, reader=reader, stats=accumulators, max_memory=args.max_memory, cache=extraction_cache,
+          domains=domains, diagnostics=args.diagnostics, dtype=dtype)
+    except MemoryError:
+      # The arrays are sized before any file is read, so the batch can be retried with fewer days
+      if batch_ndays == 1 or args.parquet or args.per_station:
+        raise
+      ndays = batch_ndays // 2
+      print('Memory above the %s budget, reducing to %d days per batch' % (memory.format_size(args.max_memory), ndays))
+      continue
+    final_dataset.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+    if 'reader' in final_dataset.attrs:
+      reader = final_dataset.attrs['reader'].split()[0] # Later batches use the reader probed on the first
+    if args.max_memory is not None:
+      # Later batches reuse the memory freed by the first, which is still counted as resident, so they keep its
+      # dtype and are only checked against the budget between batches
+      dtype = final_dataset[[k for k in read_vars if k in final_dataset][0]].dtype
+
+    # Output final datafile
+    if hourly:
+      with tracker.stage('write'):
+        if day == 0:
+          final_dataset.to_netcdf(output_datafile, encoding=make_encoding(final_dataset, args.pack, args.chunks),
+            unlimited_dims=[dim] if ndays < args.days else None)
+        else:
+          common.append_netcdf(output_datafile, {None:final_dataset}, dim)
+      if args.index:
+        from wrfconv import zonemap
+        index_rows.append(zonemap.zone_rows(final_dataset, output_datafile))
+    day += batch_ndays
+    if day < args.days:
+      del final_dataset # Free the batch before the next one is extracted
+      if tracker.over_budget() and ndays > 1:
+        ndays = max(1, ndays // 2)
+        print('Memory above the %s budget, reducing to %d days per batch' % (memory.format_size(args.max_memory), ndays))
+
+  if extraction_cache is not None:
+    extraction_cache.evict() # Runs that only read from the cache still keep it within its size limit
+    print('Cache: ' + extraction_cache.report())
+  plan.record_run(args, (datetime.now() - script_start_time).total_seconds())
+  if hourly:
+    if ndays < args.days:
+      common.set_netcdf_attrs(output_datafile, {'elapsed_time':str(datetime.now() - script_start_time)})
+    if args.max_memory is not None:
+      common.set_netcdf_attrs(output_datafile, {'memory_report':tracker.report()})
+      print('Memory: ' + tracker.report())
+    print('Outputted ' + output_datafile)
+    if args.index:
+      zonemap.write_rows(zonemap.combine_rows(pd.concat(index_rows, ignore_index=True)), output_datafile)
+      print('Outputted ' + zonemap.index_filename(output_datafile))
+
+  # Output statistics
+  if acc is not None:
+    output_datafile = common.output_filename(prefix + '_stats', start_date, end_date)
+    stats.write_stats(acc, final_dataset, output_datafile)
+    print('Outputted ' + output_datafile)
+
+  # Output daily and monthly means
+  if agg is not None:
+    output_datafile = common.output_filename(prefix + '_means', start_date, end_date)
+    stats.write_stats(agg, final_dataset, output_datafile)
+    print('Outputted ' + output_datafile)
+
+  # Output Parquet dataset
+  if args.parquet:
+    from wrfconv import parquet
+    output_dir = parquet.write_parquet(final_dataset, prefix + '_parquet', layout=args.parquet)
+    print('Outputted ' + output_dir)
+
+  # Output a file per station
+  if args.per_station:
+    from wrfconv import split
+    files = split.write_stations(final_dataset, prefix + '_stations', prefix, fmt=args.per_station, workers=args.workers,
+      pack=args.pack)
+    print('Outputted %d station files to %s' % (len(files), prefix + '_stations'))
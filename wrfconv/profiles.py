@@ -0,0 +1,130 @@
+# Extract full RU-WRF vertical wind profiles at specified points
+# Every model level of the wind components is read for all of the stations with one slab read per file,
+# instead of one read per level, and saved with the 10m winds on a (time, station, z) grid.
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import catalog, common, derive, points, plan, readers, sources
+
+#------------------------------
+PROFILE_VARIABLES = ['u_velocity','v_velocity']
+
+
+#------------------------------
+def extract_file(path, reader, source, sites):
+  '''Extract the wind profile at each station from one WRF file
+
+  Returns the heights and a {variable: (z, station) array} dict, with the 10m winds added below the model levels.'''
+  handle = reader(path, source)
+  try:
+    lats, lons = handle.latlon()
+    ii,jj = points.nearest_points(lats, lons, sites)
+    values = {}
+    for name in PROFILE_VARIABLES:
+      heights, column = handle.read_column(name, ii, jj)
+      if 10 not in heights:
+        heights = np.concatenate([[10], heights])
+        column = np.concatenate([handle.read_points(name, 10, ii, jj)[None,:], column])
+      values[name] = column
+  finally:
+    handle.close()
+  return np.asarray(heights, dtype='int32'), values
+
+
+def profile_array(name, times, stations, z):
+  '''Create an empty (time, station, z) DataArray for a catalog variable'''
+  da = xr.DataArray(np.full((len(times),len(stations),len(z)), np.nan), coords=[times, stations, z],
+    dims=['time','station','z'], attrs=dict(catalog.VARIABLES[name]['attrs']))
+  da['z'].attrs = {'units':'m', 'standard_name':'height', 'long_name':'Height', 'positive':'up',
+    'comment':'Height above the model surface of each model level, with the 10m diagnostic winds as the lowest level.'}
+  da['time'].attrs = {'standard_name':'time', 'long_name':'Time'}
+  da['station'].attrs = {'standard_name':'station_id', 'long_name':'Station ID'}
+  return da
+
+
+def extract_profiles(start_date, days, sites, source='nc', forecast_offset=6, directory=None, reader='auto'):
+  '''Extract a dataset of the wind profiles at each station
+
+  The heights are the union of the levels found in the files, so runs that span a change in the
+  number of model levels keep every level, with missing values where a file does not have one.'''
+  if directory is None:
+    directory = sources.DIRECTORIES[source]
+  stations = sites.name.astype('S')
+  times = pd.date_range(start_date, common.end_date(start_date,days), freq="h")
+  steps = [(t, sources.make_wrf_file(source,t,forecast_offset)) for t in times]
+  reader_cls, probe_times = readers.select_for_files([directory + f for t,f in steps], source, 'points',
+    PROFILE_VARIABLES, [10], reader)
+  if reader_cls is None: # None of the files exist
+    return None
+
+  # Loop over each hour, reading the columns at every station
+  hours = []
+  for t, wrf_file in steps:
+    try:
+      heights, values = extract_file(directory + wrf_file, reader_cls, source, sites)
+      print('Processing: ' + str(t) + ' File: ' + wrf_file)
+      hours.append((t, heights, values))
+    except readers.READ_ERRORS:
+      print('Could not open ' + wrf_file)
+  if not hours:
+    return None
+
+  # Arrange the profiles on the heights found in all of the files
+  z = np.unique(np.concatenate([heights for t, heights, values in hours])).astype('int32')
+  arrays = dict([(name, profile_array(name, times, stations, z)) for name in PROFILE_VARIABLES])
+  for t, heights, values in hours:
+    for name in PROFILE_VARIABLES:
+      arrays[name].loc[{'time':t, 'z':heights}] = values[name].T
+
+  latitude, longitude = points.station_coords(sites, stations)
+  final_dataset = xr.Dataset({'latitude':latitude, 'longitude':longitude})
+  final_dataset.update(arrays)
+  final_dataset['wind_speed'] = derive.wind_speed(arrays['u_velocity'], arrays['v_velocity'])
+  final_dataset['wind_dir'] = derive.wind_dir(arrays['u_velocity'], arrays['v_velocity'])
+
+  # Add global metadata
+  ftype = {'nc':'NetCDF', 'grib':'GRIB'}[source]
+  final_dataset.attrs['forecast_offset'] = forecast_offset
+  final_dataset.attrs['source'] = source
+  final_dataset.attrs['source_directory'] = directory
+  if reader_cls is not None:
+    final_dataset.attrs['reader'] = readers.describe(reader_cls, probe_times)
+  final_dataset.attrs['date_created'] = str(datetime.today())
+
+  final_dataset.attrs['acknowledgement'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_name'] = "Rutgers University Center for Ocean Observing Leadership (RU COOL)"
+  final_dataset.attrs['creator_url'] = "https://rucool.marine.rutgers.edu"
+  final_dataset.attrs['creator_email'] = "sage@marine.rutgers.edu"
+  final_dataset.attrs['summary'] = "Wind profiles extracted from %s files produced by Rutgers University's 3km WRF model run, at every model level.  The model is run daily at 00Z and forecast files are saved every hour.  Times in this file are UTC based on the forecast run times.  The forecast_offset specifies how many hours of model spin up are allowed before the data is used." % ftype
+  final_dataset.attrs['project'] = "RU COOL BPU Wind Energy Project"
+  final_dataset.attrs['title'] = "Rutgers WRF 3km Model wind profiles at selected stations"
+  final_dataset.attrs['Conventions'] = 'CF-1.6'
+  return final_dataset
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+
+  # Specify Date Range to Process
+  start_date = common.parse_date(args.date)
+  end_date = common.end_date(start_date,args.days)
+
+  # Load Selected Station Locations
+  sites = pd.read_csv(args.coordinates, skipinitialspace=True)
+
+  final_dataset = extract_profiles(start_date, args.days, sites, source=args.source,
+    forecast_offset=args.forecast_offset, directory=args.directory, reader=args.reader)
+  if final_dataset is None:
+    print('No data found, skipping.')
+    return
+  final_dataset.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+  plan.record_run(args, (datetime.now() - script_start_time).total_seconds())
+
+  # Output final datafile
+  output_datafile = common.output_filename(args.prefix, start_date, end_date)
+  final_dataset.to_netcdf(output_datafile, encoding=points.make_encoding(final_dataset))
+  print('Outputted ' + output_datafile)
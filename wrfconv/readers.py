@@ -0,0 +1,358 @@
+# Model file readers for the RU-WRF extractors
+# Each reader opens one model file and returns 2D layers for catalog variables, so the extractors can use
+# whichever library is installed and fastest.  select_reader() probes the candidates on the first file.
+
+import importlib.util
+import os
+import time
+import numpy as np
+from wrfconv import catalog
+
+#------------------------------
+class Reader(object):
+  '''Base class for reading catalog variables from one model file'''
+  name = None     # Reader name used on the command line
+  module = None   # Library that must be installed
+  formats = []    # Model file types the reader can open
+
+  def __init__(self, path, source):
+    self.path = path
+    self.source = source
+
+  @classmethod
+  def available(cls):
+    '''Check whether the library for this reader is installed'''
+    return importlib.util.find_spec(cls.module) is not None
+
+  def layer_source(self, name, height):
+    '''Look up where a variable is stored in this file type'''
+    return catalog.layer_source(name, self.source, height)
+
+  def latlon(self):
+    '''Return the 2D latitude and longitude grids'''
+    raise NotImplementedError
+
+  def read(self, name, height=None):
+    '''Read the 2D layer of a catalog variable'''
+    raise NotImplementedError
+
+  def read_points(self, name, height, ii, jj):
+    '''Read a catalog variable at a set of grid points'''
+    return self.read(name, height)[ii,jj]
+
+  def read_slab(self, var, yslice, xslice):
+    '''Read every level of a 3D model variable in a y/x box, as a (level, y, x) array'''
+    raise NotImplementedError
+
+  def read_column(self, name, ii, jj):
+    '''Read every model level of a catalog variable at a set of grid points
+
+    The box around the points is read once for all levels.  Returns the level heights and a (level, point) array.'''
+    var, first, step = catalog.column_source(name, self.source)
+    ii,jj = np.asarray(ii),np.asarray(jj)
+    i0,j0 = ii.min(),jj.min()
+    slab = self.read_slab(var, slice(i0,ii.max()+1), slice(j0,jj.max()+1))
+    return first + step*np.arange(slab.shape[0]), slab[:,ii-i0,jj-j0]
+
+  def close(self):
+    pass
+
+
+#------------------------------
+# NetCDF readers
+class XarrayReader(Reader):
+  '''NetCDF files using xarray's default engine'''
+  name = 'xarray'
+  module = 'xarray'
+  formats = ['nc']
+  engine = None
+
+  def __init__(self, path, source):
+    Reader.__init__(self, path, source)
+    import xarray as xr
+    self.ds = xr.open_dataset(path, engine=self.engine)
+
+  def latlon(self):
+    return self.ds.XLAT.squeeze().values, self.ds.XLONG.squeeze().values
+
+  def read(self, name, height=None):
+    return catalog.read_nc_layer(self.ds, self.layer_source(name, height))
+
+  def read_slab(self, var, yslice, xslice):
+    return self.ds[var][0,:,yslice,xslice].values
+
+  def close(self):
+    self.ds.close()
+
+
+class NetCDF4Reader(Reader):
+  '''NetCDF files using the netCDF4 library, reading only the slab around the requested points'''
+  name = 'netcdf4'
+  module = 'netCDF4'
+  formats = ['nc']
+
+  def __init__(self, path, source):
+    Reader.__init__(self, path, source)
+    self.ds = self.open(path)
+
+  def open(self, path):
+    import netCDF4
+    return netCDF4.Dataset(path)
+
+  def values(self, var, index):
+    '''Read part of a variable, with the _FillValue and missing_value points as NaN like the xarray reader'''
+    values = self.ds.variables[var][index]
+    if np.ma.is_masked(values):
+      values = np.ma.filled(values.astype(np.result_type(values.dtype, np.float32)), np.nan)
+    return np.asarray(values)
+
+  def latlon(self):
+    return np.asarray(self.ds.variables['XLAT'][0]), np.asarray(self.ds.variables['XLONG'][0])
+
+  def read(self, name, height=None):
+    var, level = self.layer_source(name, height)
+    if level is None:
+      return self.values(var, 0)
+    return self.values(var, (0,level))
+
+  def read_points(self, name, height, ii, jj):
+    var, level = self.layer_source(name, height)
+    ii,jj = np.asarray(ii),np.asarray(jj)
+    i0,i1,j0,j1 = ii.min(),ii.max()+1,jj.min(),jj.max()+1
+    if level is None:
+      slab = self.values(var, (0,slice(i0,i1),slice(j0,j1)))
+    else:
+      slab = self.values(var, (0,level,slice(i0,i1),slice(j0,j1)))
+    return slab[ii-i0,jj-j0]
+
+  def read_slab(self, var, yslice, xslice):
+    return self.values(var, (0,slice(None),yslice,xslice))
+
+  def close(self):
+    self.ds.close()
+
+
+class H5NetCDFReader(NetCDF4Reader):
+  '''NetCDF4/HDF5 files using the h5netcdf library'''
+  name = 'h5netcdf'
+  module = 'h5netcdf'
+  formats = ['nc']
+
+  @classmethod
+  def available(cls):
+    return Reader.available.__func__(cls) and importlib.util.find_spec('h5py') is not None
+
+  def open(self, path):
+    import h5netcdf
+    return h5netcdf.File(path, 'r')
+
+  def values(self, var, index):
+    # h5netcdf returns the stored values, so the fill values and packing are applied here
+    v = self.ds.variables[var]
+    values = np.asarray(v[index])
+    fill = [v.attrs[k] for k in ('_FillValue','missing_value') if k in v.attrs]
+    if not fill and 'scale_factor' not in v.attrs and 'add_offset' not in v.attrs:
+      return values
+    missing = np.isin(values, fill)
+    values = values * v.attrs.get('scale_factor', 1) + v.attrs.get('add_offset', 0)
+    values = values.astype(np.result_type(values.dtype, np.float32))
+    values[missing] = np.nan
+    return values
+
+
+#------------------------------
+# GRIB readers
+class PygribReader(Reader):
+  '''GRIB files using pygrib'''
+  name = 'pygrib'
+  module = 'pygrib'
+  formats = ['grib']
+
+  def __init__(self, path, source):
+    Reader.__init__(self, path, source)
+    import pygrib
+    self.grbfile = pygrib.open(path)
+    self.messages = {}
+
+  def latlon(self):
+    return self.grbfile.message(1).latlons()
+
+  def read(self, name, height=None):
+    return catalog.read_grib_layer(self.grbfile, self.layer_source(name, height), self.messages)
+
+  def read_slab(self, var, yslice, xslice):
+    if var not in self.messages:
+      self.messages[var] = self.grbfile.select(name=var)
+    return np.stack([grb.values[yslice,xslice] for grb in self.messages[var]])
+
+  def close(self):
+    self.grbfile.close()
+
+
+class EccodesReader(Reader):
+  '''GRIB files using the ecCodes python bindings (as used by cfgrib)'''
+  name = 'eccodes'
+  module = 'eccodes'
+  formats = ['grib']
+
+  def __init__(self, path, source):
+    Reader.__init__(self, path, source)
+    import eccodes
+    self.eccodes = eccodes
+    self.file = open(path, 'rb')
+    self.messages = {} # Message handles by name, in file order
+    while True:
+      gid = eccodes.codes_grib_new_from_file(self.file)
+      if gid is None:
+        break
+      self.messages.setdefault(eccodes.codes_get(gid, 'name'), []).append(gid)
+
+  def values(self, gid):
+    '''Return the values of a message as a 2D array, with missing points set to NaN'''
+    ec = self.eccodes
+    data = ec.codes_get_values(gid).reshape(ec.codes_get(gid,'Nj'), ec.codes_get(gid,'Ni'))
+    if ec.codes_get(gid, 'bitmapPresent'):
+      data[data == ec.codes_get(gid, 'missingValue')] = np.nan
+    return data
+
+  def latlon(self):
+    ec = self.eccodes
+    gid = next(iter(self.messages.values()))[0]
+    shape = (ec.codes_get(gid,'Nj'), ec.codes_get(gid,'Ni'))
+    return ec.codes_get_array(gid,'latitudes').reshape(shape), ec.codes_get_array(gid,'longitudes').reshape(shape)
+
+  def read(self, name, height=None):
+    grib_name, index = self.layer_source(name, height)
+    return self.values(self.messages[grib_name][index])
+
+  def read_slab(self, var, yslice, xslice):
+    return np.stack([self.values(gid)[yslice,xslice] for gid in self.messages[var]])
+
+  def close(self):
+    for gids in self.messages.values():
+      for gid in gids:
+        self.eccodes.codes_release(gid)
+    self.file.close()
+
+
+class PynioReader(XarrayReader):
+  '''GRIB or NetCDF files using xarray's PyNIO engine'''
+  name = 'pynio'
+  module = 'Nio'
+  formats = ['nc','grib']
+  engine = 'pynio'
+
+  def layer_source(self, name, height):
+    # PyNIO names GRIB variables differently from pygrib and ecCodes
+    return catalog.layer_source(name, 'pynio' if self.source == 'grib' else self.source, height)
+
+  def latlon(self):
+    if self.source == 'grib':
+      return self.ds.gridlat_0.values, self.ds.gridlon_0.values
+    return XarrayReader.latlon(self)
+
+  def read(self, name, height=None):
+    if self.source != 'grib':
+      return XarrayReader.read(self, name, height)
+    var, level = self.layer_source(name, height)
+    if level is None:
+      return self.ds[var].values
+    return self.ds[var].sel(lv_HTGL1=level).values
+
+  def read_column(self, name, ii, jj):
+    if self.source != 'grib':
+      return XarrayReader.read_column(self, name, ii, jj)
+    var, first, step = catalog.column_source(name, 'pynio')
+    da = self.ds[var]
+    return da['lv_HTGL1'].values, da.values[:,np.asarray(ii),np.asarray(jj)]
+
+
+#------------------------------
+READERS = [XarrayReader, NetCDF4Reader, H5NetCDFReader, PygribReader, EccodesReader, PynioReader]
+WORKLOADS = ['points','grid']
+
+# Errors of a model file that is missing or unreadable, or that lacks a variable or level (e.g. the 140m layer of
+# the older 11 and 15 level epochs).  The extractors skip hours that raise these, and let anything else through.
+READ_ERRORS = (OSError, KeyError, IndexError, ValueError)
+
+
+def get_reader(name):
+  '''Look up a reader class by name'''
+  for cls in READERS:
+    if cls.name == name:
+      return cls
+  raise ValueError('Unknown reader %s, please choose from: %s' % (name, ', '.join([r.name for r in READERS])))
+
+
+def candidates(source):
+  '''List the installed readers for a model file type'''
+  return [cls for cls in READERS if source in cls.formats and cls.available()]
+
+
+def import_readers(source, reader='auto'):
+  '''Import the libraries of the readers a run may use, so the memory they take is counted when buffers are sized'''
+  for cls in candidates(source) if reader == 'auto' else [get_reader(reader)]:
+    importlib.import_module(cls.module)
+
+
+def probe(cls, path, source, workload, variables, heights, repeat=2):
+  '''Time a reader on a representative workload, returning the best time in seconds'''
+  best = None
+  for k in range(repeat):
+    start = time.perf_counter()
+    reader = cls(path, source)
+    lats,lons = reader.latlon()
+    for name in variables:
+      for h in (heights if catalog.VARIABLES[name]['heights'] else [None]):
+        if workload == 'points':
+          ii = np.linspace(0, lats.shape[0]-1, 8).astype(int)
+          jj = np.linspace(0, lats.shape[1]-1, 8).astype(int)
+          reader.read_points(name, h, ii, jj)
+        else:
+          reader.read(name, h)
+    reader.close()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def select_reader(path, source, workload='points', variables=('u_velocity','v_velocity'), heights=(10,100,120,140), reader='auto'):
+  '''Choose the reader to use for a run
+
+  With reader='auto', each installed reader for the file type is timed on the first file and the
+  fastest is returned.  Returns the reader class and a dict of probe times (seconds) by reader name.'''
+  if reader != 'auto':
+    return get_reader(reader), {}
+  times = {}
+  for cls in candidates(source):
+    try:
+      times[cls.name] = probe(cls, path, source, workload, variables, heights)
+    except Exception as e:
+      print('Reader %s could not read %s: %s' % (cls.name, path, e))
+  if not times:
+    raise RuntimeError('No installed reader could open ' + path)
+  fastest = min(times, key=times.get)
+  return get_reader(fastest), times
+
+
+def select_for_files(paths, source, workload='points', variables=('u_velocity','v_velocity'), heights=(10,100,120,140), reader='auto'):
+  '''Choose the reader for a run using the first of the model files that exists and can be read
+
+  Returns (None, {}) if none of the files exist.'''
+  for path in paths:
+    if os.path.exists(path):
+      try:
+        cls, times = select_reader(path, source, workload, variables, heights, reader)
+      except RuntimeError as e:
+        print(e)
+        continue
+      print('Using reader: ' + describe(cls, times))
+      return cls, times
+  return None, {}
+
+
+def describe(cls, times):
+  '''Summarize a reader choice for the output metadata'''
+  if not times:
+    return '%s (selected)' % cls.name
+  return '%s (probe: %s)' % (cls.name, ', '.join(['%s %.1f ms' % (k, 1000*v) for k,v in sorted(times.items(), key=lambda x: x[1])]))
@@ -0,0 +1,183 @@
+# Rechunk time-major grid archives into a pixel-major store
+# Each variable is saved as a float32 .npy memmap with shape (y, x, z, time), so the full history of one model
+# cell is a single contiguous read.  Each grid file is read once, a block of hours at a time, into a time-major
+# staging array, which is then transposed into the store a band of rows at a time, so each part of the store is
+# written once, in order, and the memory used is bounded by the block and band sizes.
+
+import json
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import memory
+
+#------------------------------
+STORE_FILE = 'store.json'
+STORE_MEMORY = 1024**3 # Default memory budget for the transpose
+TRANSPOSE_COPIES = 3   # Copies of each tile held while it is read, converted and transposed
+
+
+#------------------------------
+def scan_files(files):
+  '''Collect the times, heights, grid and variables of a set of grid files, checking that they match'''
+  shards = []
+  first = None
+  for filename in files:
+    with xr.open_dataset(filename) as ds:
+      variables = [v for v in ds.data_vars if ds[v].dims[:2] == ('time','z')]
+      info = {'z':ds['z'].values, 'lat':ds['lat'].values, 'lon':ds['lon'].values, 'variables':variables,
+              'shape':ds[variables[0]].shape[2:]}
+      shards.append((filename, pd.DatetimeIndex(ds['time'].values)))
+    if first is None:
+      first = info
+    elif info['shape'] != first['shape'] or not np.array_equal(info['z'], first['z']) or not np.allclose(info['lat'], first['lat']):
+      raise ValueError('%s is not on the same grid and heights as %s' % (filename, files[0]))
+    first['variables'] = [v for v in first['variables'] if v in variables]
+  shards.sort(key=lambda x: x[1][0])
+  return shards, first
+
+
+def rechunk(files, directory, variables=None, max_memory=STORE_MEMORY):
+  '''Write the grid files to a pixel-major store in a directory
+
+  The store holds a .npy file of shape (y, x, z, time) for each variable, on an hourly time axis from the
+  first to last hour of the files, and a mask of the hours that were present.'''
+  shards, grid = scan_files(files)
+  names = grid['variables'] if variables is None else variables
+  times = pd.date_range(shards[0][1][0], max([t[-1] for f,t in shards]), freq='h')
+  ny, nx = grid['shape']
+  nz = len(grid['z'])
+  block = max(1, int(max_memory // (TRANSPOSE_COPIES * len(names) * nz * ny * nx * 4)))
+  cells = max(1, int(max_memory // (TRANSPOSE_COPIES * len(names) * nz * len(times) * 4)))
+  rows, cols = (min(ny, cells // nx), nx) if cells >= nx else (1, cells)
+  print('Reading %d hours at a time, transposing tiles of %dx%d cells, %d heights and %d hours at a time'
+    % (block, rows, cols, nz, len(times)))
+
+  present = np.zeros(len(times), dtype=bool)
+  slots = []
+  for filename, ftimes in shards:
+    index = times.get_indexer(ftimes)
+    if present[index].any():
+      raise ValueError('%s overlaps the hours of another file' % filename)
+    present[index] = True
+    slots.append(index)
+
+  os.makedirs(directory, exist_ok=True)
+  np.save(os.path.join(directory, 'lat.npy'), grid['lat'])
+  np.save(os.path.join(directory, 'lon.npy'), grid['lon'])
+  staging = dict([(name, os.path.join(directory, name + '.staging.npy')) for name in names])
+  try:
+    # Read every file once, in blocks of hours, into (time, z, y, x) staging arrays on disk
+    buffers = dict([(name, np.lib.format.open_memmap(staging[name], mode='w+', dtype='float32',
+      shape=(len(times), nz, ny, nx))) for name in names])
+    for (filename, ftimes), index in zip(shards, slots):
+      with xr.open_dataset(filename) as ds:
+        for h0 in range(0, len(ftimes), block):
+          for name in names:
+            buffers[name][index[h0:h0+block]] = ds[name][h0:h0+block].values
+      print('Read ' + filename)
+    for buffer in buffers.values():
+      buffer.flush()
+    del buffers
+
+    # Write the full history of a band of rows at once
+    buffers = dict([(name, np.load(staging[name], mmap_mode='r')) for name in names])
+    stores = dict([(name, np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode='w+', dtype='float32',
+      shape=(ny, nx, nz, len(times)))) for name in names])
+    for y0 in range(0, ny, rows):
+      for x0 in range(0, nx, cols):
+        for name in names:
+          stores[name][y0:y0+rows, x0:x0+cols] = buffers[name][:, :, y0:y0+rows, x0:x0+cols].transpose(2, 3, 1, 0)
+      print('Rechunked rows %d-%d of %d' % (y0, min(y0+rows, ny)-1, ny))
+    for store in stores.values():
+      store.flush()
+    del stores, buffers
+  finally:
+    for filename in staging.values():
+      if os.path.exists(filename):
+        os.remove(filename)
+
+  np.save(os.path.join(directory, 'present.npy'), present)
+  meta = {'variables':names, 'z':[int(h) for h in grid['z']], 'shape':[ny, nx], 'start':str(times[0]),
+          'hours':len(times), 'files':[os.path.basename(f) for f,t in shards], 'date_created':str(datetime.today())}
+  with open(os.path.join(directory, STORE_FILE), 'w') as f:
+    json.dump(meta, f, indent=1)
+  return meta
+
+
+#------------------------------
+class PixelStore(object):
+  '''Read the history of model cells from a pixel-major store'''
+
+  def __init__(self, directory):
+    with open(os.path.join(directory, STORE_FILE)) as f:
+      self.meta = json.load(f)
+    self.lat = np.load(os.path.join(directory, 'lat.npy'))
+    self.lon = np.load(os.path.join(directory, 'lon.npy'))
+    self.present = np.load(os.path.join(directory, 'present.npy'))
+    self.times = pd.date_range(self.meta['start'], periods=self.meta['hours'], freq='h')
+    self.z = np.array(self.meta['z'])
+    self.arrays = dict([(name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')) for name in self.meta['variables']])
+    self.cells = {}
+
+  def info(self):
+    '''Describe the coverage of the store'''
+    return {'files':len(self.meta['files']), 'start':str(self.times[0]), 'end':str(self.times[-1]),
+            'heights':self.meta['z'], 'variables':self.meta['variables']}
+
+  def locate(self, lat, lon):
+    '''Find the nearest model cell to a location'''
+    key = (round(lat,5), round(lon,5))
+    if key not in self.cells:
+      if not (np.nanmin(self.lat) <= lat <= np.nanmax(self.lat) and np.nanmin(self.lon) <= lon <= np.nanmax(self.lon)):
+        raise ValueError('%s,%s is outside the store grid' % (lat, lon))
+      if self.lat.ndim == 1:
+        i, j = int(abs(self.lat-lat).argmin()), int(abs(self.lon-lon).argmin())
+        self.cells[key] = (i, j, float(self.lat[i]), float(self.lon[j]))
+      else:
+        i,j = np.unravel_index((abs(self.lat-lat)+abs(self.lon-lon)).argmin(), self.lat.shape)
+        self.cells[key] = (int(i), int(j), float(self.lat[i,j]), float(self.lon[i,j]))
+    return self.cells[key]
+
+  def series(self, name, i, j):
+    '''Read the full (z, time) history of a variable at one cell, with missing hours as NaN'''
+    data = np.array(self.arrays[name][i, j])
+    data[:, ~self.present] = np.nan
+    return xr.DataArray(data, coords=[self.z, self.times], dims=['z','time'], name=name)
+
+  def query(self, lat, lon, start=None, end=None, heights=None, variables=None):
+    '''Read the time series at the nearest model cell to a location, like serve.GridArchive.query'''
+    i, j, cell_lat, cell_lon = self.locate(lat, lon)
+    t0 = 0 if start is None else self.times.searchsorted(start)
+    t1 = len(self.times) if end is None else self.times.searchsorted(end, side='right')
+    if heights is None:
+      zsel = np.arange(len(self.z))
+    elif isinstance(heights, tuple):
+      zsel = np.flatnonzero((self.z >= heights[0]) & (self.z <= heights[1]))
+    else:
+      zsel = np.flatnonzero(np.isin(self.z, heights))
+    names = self.meta['variables'] if variables is None else [v for v in variables if v in self.arrays]
+    if t1 <= t0 or len(zsel) == 0 or not names:
+      raise ValueError('No data in the store for this time, height and variable selection')
+    keep = self.present[t0:t1]
+    data = {}
+    for name in names:
+      column = np.array(self.arrays[name][i, j, zsel, t0:t1], dtype='float64')
+      data[name] = column[:, keep].T.ravel()
+    index = pd.MultiIndex.from_product([self.times[t0:t1][keep], self.z[zsel]], names=['time','height'])
+    return pd.DataFrame(data, index=index).reset_index(), (cell_lat, cell_lon)
+
+  def close(self):
+    self.arrays = {}
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+  meta = rechunk(args.files, args.store, variables=args.variables and args.variables.split(','),
+    max_memory=args.max_memory or STORE_MEMORY)
+  print('Outputted %s (%d variables, %d hours, %s) in %s' % (args.store, len(meta['variables']), meta['hours'],
+    memory.format_size(sum([os.path.getsize(os.path.join(args.store, n + '.npy')) for n in meta['variables']])),
+    datetime.now() - script_start_time))
@@ -0,0 +1,151 @@
+# Recompute the derived wind variables of existing output files
+# Point, profile and grid outputs keep the wind components, so wind speed, direction and power can be recalculated
+# from them (e.g. with a new power curve or after a formula fix) without the model files, along with any wind
+# resource diagnostics.  Each file is updated a chunk of time steps at a time with netCDF4, in place or in a copy,
+# and any grid pyramid levels are rebuilt.
+
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+import xarray as xr
+from wrfconv import catalog, derive, grid, zonemap
+
+#------------------------------
+# Wind components and direction variable of each kind of output
+COMPONENTS = [
+  ('u_velocity', 'v_velocity', 'wind_dir'),                   # Points and profiles
+  ('eastward_wind', 'northward_wind', 'wind_from_direction'), # Grids and subgrids
+]
+
+
+#------------------------------
+def find_components(nc):
+  '''Find the wind component and direction variable names of an output file
+
+  Raises a ValueError for files without wind components, and for areas files, whose wind speed and power
+  are combined from each model cell and so can not be recalculated from the combined components.'''
+  if 'area' in nc.dimensions:
+    raise ValueError('%s is an areas file, its wind speed and power are combined from each model cell' % nc.filepath())
+  for names in COMPONENTS:
+    if names[0] in nc.variables and names[1] in nc.variables:
+      return names
+  raise ValueError('%s does not have the wind components' % nc.filepath())
+
+
+def read_values(var, index):
+  '''Read a slice of a netcdf variable as floats, with missing values as NaN'''
+  return np.ma.filled(np.ma.asarray(var[index], dtype='float64'), np.nan)
+
+
+def write_values(var, index, values):
+  '''Write a slice of a netcdf variable, masking missing values so packed variables get the _FillValue'''
+  if 'scale_factor' in var.ncattrs():
+    missing = ~np.isfinite(values)
+    values = np.ma.masked_array(np.where(missing, 0, values), mask=missing)
+  var[index] = values
+
+
+def read_density(nc, index):
+  '''Read the air density of a slice of an output file, or calculate it from psfc and t2, or None if neither is there'''
+  if 'air_density' in nc.variables:
+    return xr.DataArray(read_values(nc['air_density'], index), dims=nc['air_density'].dimensions)
+  if 'psfc' in nc.variables and 't2' in nc.variables:
+    return catalog.derive('air_density', dict([(k, xr.DataArray(read_values(nc[k], index), dims=nc[k].dimensions))
+                                               for k in ['psfc','t2']]))
+  return None
+
+
+def derived_layers(u, v, direction='wind_dir', power_curve=None, curve_file=None, dim=None, rho=None):
+  '''Calculate wind speed, direction and power from the wind component DataArrays, and with the height dimension
+  the wind resource diagnostics of derive.wind_diagnostics'''
+  layers = {'wind_speed': derive.wind_speed(u, v), direction: derive.wind_dir(u, v)}
+  layers['wind_power'] = derive.wind_power(layers['wind_speed'], power_curve)
+  if dim is not None:
+    layers.update(derive.wind_diagnostics(u, v, dim, rho, power_curve))
+  if curve_file:
+    for name in [k for k in ['wind_power','wind_power_density_corrected'] if k in layers]:
+      layers[name].attrs['long_name'] = layers[name].attrs['long_name'].replace(' 8MW', '')
+      layers[name].attrs['comment'] = layers[name].attrs['comment'].split(', using')[0] + ', using the power curve in %s.' % os.path.basename(curve_file)
+  return layers
+
+
+def rederive_file(filename, chunk=744, curve_file=None):
+  '''Recompute the derived wind variables of an output file in place, chunk time steps at a time
+
+  Only the variables already in the file are rewritten (including the wind resource diagnostics), along with the
+  wind speed and power of any pyramid levels.  The components are never changed, so an interrupted run can simply
+  be repeated.  Returns the names of the variables rewritten and the number of pyramid levels.'''
+  import netCDF4
+  if not os.path.exists(filename):
+    raise IOError('%s does not exist' % filename) # netCDF4 would create it
+  power_curve = derive.load_power_curve(curve_file) if curve_file else derive.load_power_curve()
+  with netCDF4.Dataset(filename, 'a') as nc:
+    uname, vname, direction = find_components(nc)
+    dims = nc[uname].dimensions
+    names = [k for k in ['wind_speed', direction, 'wind_power'] if k in nc.variables]
+    for name in names:
+      if nc[name].dimensions != dims:
+        raise ValueError('%s has %s with dimensions %s, not those of %s' % (filename, name, nc[name].dimensions, uname))
+    diagnostics = derive.diagnostic_names(nc.variables)
+    hdim = ([d for d in dims if d in ('height','z')] + [None])[0]
+    if 'wind_power_density_corrected' in diagnostics and read_density(nc, slice(0, 1)) is None:
+      print('%s has no air_density, psfc or t2 to recalculate wind_power_density_corrected from, leaving it as it is' % filename)
+      diagnostics.remove('wind_power_density_corrected')
+    if not names and not diagnostics:
+      raise ValueError('%s does not have any derived wind variables' % filename)
+    levels = dict([(nc.groups[g].getncattr('pyramid_factor'), nc.groups[g]) for g in nc.groups
+                   if 'pyramid_factor' in nc.groups[g].ncattrs()])
+
+    pyramid = {}
+    for start in range(0, len(nc.dimensions[dims[0]]), chunk):
+      index = slice(start, start+chunk)
+      coords = {hdim:nc[hdim][:]} if hdim in nc.variables else None
+      u = xr.DataArray(read_values(nc[uname], index), dims=dims, coords=coords)
+      v = xr.DataArray(read_values(nc[vname], index), dims=dims, coords=coords)
+      layers = derived_layers(u, v, direction, power_curve, curve_file, hdim if diagnostics else None,
+        read_density(nc, index) if 'wind_power_density_corrected' in diagnostics else None)
+      diagnostics = [k for k in diagnostics if k in layers]
+      for name in names + diagnostics:
+        write_values(nc[name], index, layers[name].transpose(*nc[name].dimensions).values)
+      if levels:
+        pyramid = grid.make_pyramid(xr.Dataset(layers), sorted(levels))
+        for factor, g in levels.items():
+          for name in [k for k in pyramid[factor].data_vars if k in g.variables]:
+            write_values(g[name], index, pyramid[factor][name].values)
+
+    names = names + diagnostics
+    for name in names:
+      nc[name].setncatts(layers[name].attrs)
+    for factor, g in levels.items():
+      for name in [k for k in pyramid.get(factor, {}) if k in g.variables]:
+        g[name].setncatts(pyramid[factor][name].attrs)
+    history = '%s: recalculated %s from %s and %s with wrfconv rederive' % (datetime.today().strftime('%Y-%m-%d %H:%M:%S'),
+      ', '.join(names), uname, vname)
+    nc.setncattr('history', (nc.getncattr('history') + '\n' + history) if 'history' in nc.ncattrs() else history)
+  return names, len(levels)
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  for filename in args.files:
+    script_start_time = datetime.now() #Script Timer
+    if args.output:
+      os.makedirs(args.output, exist_ok=True)
+      target = os.path.join(args.output, os.path.basename(filename))
+      tmp_file = target + '.tmp'
+      try:
+        shutil.copyfile(filename, tmp_file)
+        names, nlevels = rederive_file(tmp_file, args.chunk, args.power_curve)
+        os.replace(tmp_file, target)
+      finally:
+        if os.path.exists(tmp_file):
+          os.remove(tmp_file)
+    else:
+      target = filename
+      names, nlevels = rederive_file(filename, args.chunk, args.power_curve)
+    print('Rederived %s of %s%s in %s' % (', '.join(names), target, ' and %d pyramid levels' % nlevels if nlevels else '',
+      datetime.now() - script_start_time))
+    if os.path.exists(zonemap.index_filename(target)):
+      print('The zone map index of %s is out of date, rerun wrfconv index to update it' % target)
@@ -0,0 +1,100 @@
+# Regrid the RU-WRF Lambert conformal grids to a regular lat/lon grid
+# The interpolation weights only depend on the model grid and the target grid, so they are calculated once
+# (per model grid epoch), saved as a sparse matrix, and applied to each hour as a matrix product.
+
+import hashlib
+import os
+import numpy as np
+import xarray as xr
+
+#------------------------------
+WEIGHTS_DIRECTORY = '.'
+
+
+#------------------------------
+def target_grid(spec):
+  '''Create the 1D latitudes and longitudes of a lat_min,lat_max,lon_min,lon_max,resolution grid'''
+  lat_min, lat_max, lon_min, lon_max, res = spec
+  lat = np.round(np.arange(lat_min, lat_max + res/2.0, res), 6)
+  lon = np.round(np.arange(lon_min, lon_max + res/2.0, res), 6)
+  return lat, lon
+
+
+def weights_file(lat, lon, spec, directory=WEIGHTS_DIRECTORY):
+  '''Name the weights file for a model grid and target grid'''
+  key = hashlib.sha1()
+  key.update(np.ascontiguousarray(lat, dtype='float32').tobytes())
+  key.update(np.ascontiguousarray(lon, dtype='float32').tobytes())
+  key.update(repr([float(v) for v in spec]).encode())
+  return os.path.join(directory, 'wrf_regrid_%s.npz' % key.hexdigest()[:16])
+
+
+def compute_weights(lat, lon, tlat, tlon):
+  '''Calculate linear interpolation weights from the 2D model grid to a regular lat/lon grid
+
+  The model points are triangulated, and each target point gets the barycentric weights of the 3 corners of
+  the triangle it falls in.  Target points outside the model grid have no weights.'''
+  from scipy.sparse import csr_matrix
+  from scipy.spatial import Delaunay
+  scale = np.cos(np.deg2rad(np.mean(lat))) # Keep the triangles close to equilateral
+  points = np.column_stack([lon.ravel()*scale, lat.ravel()])
+  glon, glat = np.meshgrid(tlon, tlat)
+  targets = np.column_stack([glon.ravel()*scale, glat.ravel()])
+
+  tri = Delaunay(points)
+  simplex = tri.find_simplex(targets)
+  valid = simplex >= 0
+  transform = tri.transform[simplex[valid]]
+  b = np.einsum('ijk,ik->ij', transform[:,:2], targets[valid] - transform[:,2])
+  weights = np.column_stack([b, 1 - b.sum(axis=1)])
+
+  rows = np.repeat(np.flatnonzero(valid), 3)
+  cols = tri.simplices[simplex[valid]].ravel()
+  matrix = csr_matrix((weights.ravel(), (rows, cols)), shape=(targets.shape[0], points.shape[0]))
+  return matrix, valid
+
+
+def load_weights(lat, lon, spec, directory=WEIGHTS_DIRECTORY):
+  '''Load the weights for a model grid and target grid, calculating and saving them the first time'''
+  from scipy.sparse import csr_matrix
+  filename = weights_file(lat, lon, spec, directory)
+  tlat, tlon = target_grid(spec)
+  if os.path.exists(filename):
+    with np.load(filename) as f:
+      matrix = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+      valid = f['valid']
+    print('Using regrid weights ' + filename)
+  else:
+    matrix, valid = compute_weights(lat, lon, tlat, tlon)
+    tmp_file = filename + '.tmp.npz'
+    np.savez_compressed(tmp_file, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+      shape=np.array(matrix.shape), valid=valid, lat=tlat, lon=tlon, source_shape=np.array(lat.shape))
+    os.replace(tmp_file, filename)
+    print('Saved regrid weights ' + filename)
+  return {'matrix':matrix, 'valid':valid, 'lat':tlat, 'lon':tlon, 'source_shape':lat.shape, 'file':filename}
+
+
+def apply_weights(weights, data):
+  '''Regrid an array whose last two dimensions are the model y and x'''
+  data = np.asarray(data)
+  lead = data.shape[:-2]
+  flat = data.reshape((-1,) + (data.shape[-2]*data.shape[-1],)).T
+  out = weights['matrix'].dot(flat).T
+  out[:, ~weights['valid']] = np.nan
+  return out.reshape(lead + (len(weights['lat']), len(weights['lon']))).astype(data.dtype)
+
+
+def regrid_dataset(ds, weights):
+  '''Regrid each (..., y, x) variable of a grid dataset onto the regular lat/lon grid'''
+  coords = dict([(k, ds[k]) for k in ds.coords if 'y' not in ds[k].dims and 'x' not in ds[k].dims])
+  coords['lat'] = ('lat', weights['lat'], {'units':'degrees_north', 'standard_name':'latitude', 'long_name':'Latitude'})
+  coords['lon'] = ('lon', weights['lon'], {'units':'degrees_east', 'standard_name':'longitude', 'long_name':'Longitude'})
+  out = xr.Dataset(coords=coords, attrs=ds.attrs)
+  for name in ds.data_vars:
+    da = ds[name]
+    if da.dims[-2:] != ('y','x'):
+      continue
+    out[name] = (da.dims[:-2] + ('lat','lon'), apply_weights(weights, da.values), da.attrs)
+  out.attrs['regrid_weights'] = os.path.basename(weights['file'])
+  out.attrs['regrid_method'] = 'Linear interpolation within a triangulation of the model grid points'
+  return out
@@ -0,0 +1,220 @@
+# Serve point time series from an archive of grid output files
+# The time, height and lat/lon coordinates of every file are loaded once, the model cell for each requested
+# location is cached, and only the (time, height) column at that cell is read from each file, so answers come
+# from local disk in milliseconds instead of re-extracting the raw model files.
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import common
+
+#------------------------------
+LOCATOR_CACHE = 4096 # Locations kept in the cell locator cache
+HANDLE_CACHE = 64    # Files kept open, well under the usual limit of 1024 open files
+
+
+#------------------------------
+def parse_heights(value):
+  '''Parse a height (120), list of heights (100,120) or inclusive range (100-140)'''
+  if value is None or value == '':
+    return None
+  if '-' in value.strip('-'):
+    low, high = [float(v) for v in value.split('-', 1)]
+    return (low, high)
+  return [int(h) for h in value.split(',')]
+
+
+class GridArchive(object):
+  '''Time series reads at any location from a set of grid (or subgrid) output files'''
+
+  def __init__(self, files):
+    self.files = []
+    self.grids = {}
+    self.handles = OrderedDict() # Least recently used first
+    self.cells = {}
+    self.lock = threading.Lock() # netCDF4 handles are not thread safe
+    for filename in files:
+      with xr.open_dataset(filename) as ds:
+        lat, lon = ds['lat'].values, ds['lon'].values
+        grid = (lat.shape, lat.ravel()[[0,-1]].tobytes(), lon.ravel()[[0,-1]].tobytes())
+        self.grids.setdefault(grid, (lat, lon))
+        variables = [v for v in ds.data_vars if ds[v].dims[:2] == ('time','z')]
+        if not variables:
+          print('Skipping %s, which has no (time, z) grid variables' % filename)
+          continue
+        self.files.append({'file':filename, 'times':pd.DatetimeIndex(ds['time'].values), 'z':ds['z'].values,
+                           'grid':grid, 'variables':variables})
+    if not self.files:
+      raise ValueError('No grid files in the archive')
+    self.files.sort(key=lambda f: f['times'][0])
+
+  def info(self):
+    '''Describe the coverage of the archive'''
+    return {'files':len(self.files),
+            'start':str(self.files[0]['times'][0]), 'end':str(self.files[-1]['times'][-1]),
+            'heights':sorted(set([int(h) for f in self.files for h in f['z']])),
+            'variables':sorted(set([v for f in self.files for v in f['variables']]))}
+
+  def locate(self, grid, lat, lon):
+    '''Find the nearest model cell to a location, caching the result'''
+    key = (grid, round(lat,5), round(lon,5))
+    if key not in self.cells:
+      lats, lons = self.grids[grid]
+      if not (np.nanmin(lats) <= lat <= np.nanmax(lats) and np.nanmin(lons) <= lon <= np.nanmax(lons)):
+        raise ValueError('%s,%s is outside the archive grid' % (lat, lon))
+      if lats.ndim == 1: # Regridded files
+        i, j = int(abs(lats-lat).argmin()), int(abs(lons-lon).argmin())
+        cell = (i, j, float(lats[i]), float(lons[j]))
+      else:
+        a = abs(lats-lat)+abs(lons-lon)
+        i,j = np.unravel_index(a.argmin(),a.shape)
+        cell = (int(i), int(j), float(lats[i,j]), float(lons[i,j]))
+      if len(self.cells) >= LOCATOR_CACHE:
+        self.cells.pop(next(iter(self.cells)))
+      self.cells[key] = cell
+    return self.cells[key]
+
+  def handle(self, filename):
+    '''Return an open netCDF4 handle for a file, closing the least recently used one past HANDLE_CACHE'''
+    if filename in self.handles:
+      self.handles.move_to_end(filename)
+    else:
+      import netCDF4
+      if len(self.handles) >= HANDLE_CACHE:
+        self.handles.popitem(last=False)[1].close()
+      self.handles[filename] = netCDF4.Dataset(filename)
+    return self.handles[filename]
+
+  def query(self, lat, lon, start=None, end=None, heights=None, variables=None):
+    '''Read the time series at the nearest model cell to a location
+
+    Returns a DataFrame with a row for each time and height, and the model cell latitude and longitude.'''
+    frames = []
+    cell = None
+    for f in self.files:
+      times = f['times']
+      t0 = 0 if start is None else times.searchsorted(start)
+      t1 = len(times) if end is None else times.searchsorted(end, side='right')
+      if t1 <= t0:
+        continue
+      z = f['z']
+      if heights is None:
+        zsel = np.arange(len(z))
+      elif isinstance(heights, tuple):
+        zsel = np.flatnonzero((z >= heights[0]) & (z <= heights[1]))
+      else:
+        zsel = np.flatnonzero(np.isin(z, heights))
+      names = f['variables'] if variables is None else [v for v in variables if v in f['variables']]
+      if len(zsel) == 0 or not names:
+        continue
+      i, j, cell_lat, cell_lon = self.locate(f['grid'], lat, lon)
+      cell = (cell_lat, cell_lon)
+
+      # Read the (time, height) column of each variable, for the heights between the first and last selected
+      data = {}
+      with self.lock:
+        nc = self.handle(f['file'])
+        for name in names:
+          column = np.ma.filled(np.ma.asarray(nc.variables[name][t0:t1, zsel[0]:zsel[-1]+1, i, j], dtype='float64'), np.nan)
+          data[name] = column[:, zsel - zsel[0]].ravel()
+      index = pd.MultiIndex.from_product([times[t0:t1], z[zsel]], names=['time','height'])
+      frames.append(pd.DataFrame(data, index=index))
+    if not frames:
+      raise ValueError('No data in the archive for this time, height and variable selection')
+    return pd.concat(frames).reset_index(), cell
+
+  def close(self):
+    for nc in self.handles.values():
+      nc.close()
+    self.handles = OrderedDict()
+
+
+#------------------------------
+def query_args(archive, params):
+  '''Run a query from request parameters (lat, lon, start, end, heights and variables)'''
+  start = common.parse_date(params['start']) if params.get('start') else None
+  end = common.end_date(common.parse_date(params['end']),1) if params.get('end') else None
+  variables = params['variables'].split(',') if params.get('variables') else None
+  return archive.query(float(params['lat']), float(params['lon']), start, end, parse_heights(params.get('heights')), variables)
+
+
+def format_result(df, cell, lat, lon, fmt='csv'):
+  '''Format a query result as csv, or json with the requested and model cell locations'''
+  if fmt == 'json':
+    return json.dumps({'latitude':float(lat), 'longitude':float(lon), 'model_latitude':cell[0], 'model_longitude':cell[1],
+                       'series':json.loads(df.to_json(orient='records', date_format='iso'))})
+  return '# model cell %.4f,%.4f for %s,%s\n' % (cell[0], cell[1], lat, lon) + df.to_csv(index=False, float_format='%.3f')
+
+
+def make_handler(archive):
+  '''Create the HTTP request handler for an archive'''
+
+  class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      url = urlparse(self.path)
+      params = dict([(k, v[-1]) for k,v in parse_qs(url.query).items()])
+      try:
+        if url.path == '/info':
+          self.reply(200, json.dumps(archive.info()), 'application/json')
+        elif url.path == '/point':
+          df, cell = query_args(archive, params)
+          fmt = params.get('format', 'csv')
+          self.reply(200, format_result(df, cell, params['lat'], params['lon'], fmt),
+            'application/json' if fmt == 'json' else 'text/csv')
+        else:
+          self.reply(404, 'Use /point?lat=..&lon=..[&start=yyyymmdd&end=yyyymmdd&heights=..&variables=..&format=json] or /info\n')
+      except (KeyError, ValueError) as e:
+        self.reply(400, 'Bad request: %s\n' % e)
+
+    def reply(self, status, text, content_type='text/plain'):
+      body = text.encode()
+      self.send_response(status)
+      self.send_header('Content-Type', content_type)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  return QueryHandler
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+  if len(args.files) == 1 and os.path.isdir(args.files[0]):
+    from wrfconv import rechunk
+    archive = rechunk.PixelStore(args.files[0])
+  else:
+    archive = GridArchive(args.files)
+  print('Loaded %d files in %s' % (archive.info()['files'], datetime.now() - script_start_time))
+
+  # Answer a single query
+  if args.point:
+    lat, lon = args.point
+    df, cell = query_args(archive, {'lat':lat, 'lon':lon, 'start':args.start, 'end':args.end,
+      'heights':args.heights, 'variables':args.variables})
+    text = format_result(df, cell, lat, lon)
+    if args.output:
+      with open(args.output, 'w') as f:
+        f.write(text)
+      print('Outputted ' + args.output)
+    else:
+      print(text, end='')
+    return
+
+  server = HTTPServer((args.host, args.port), make_handler(archive))
+  print('Serving %s to %s on http://%s:%d/point' % (archive.info()['start'], archive.info()['end'], args.host, args.port))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    archive.close()
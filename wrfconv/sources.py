@@ -0,0 +1,52 @@
+# Model file locations and naming conventions for the RU-WRF output archives
+
+from datetime import datetime,timedelta
+
+#------------------------------
+# Specify WRF Model directories
+#   nc   - Newer v3.9 NetCDF model runs, starting 12/1/2017
+#   grib - Older v3.6 GRIB model runs, prior to 12/1/2017
+DIRECTORIES = {
+  'nc': '/home/coolgroup/ru-wrf/real-time/processed/3km/', #Server
+  'grib': '/home/bowers/output/grib/3km/', #Server
+}
+SOURCES = list(DIRECTORIES)
+
+# Model domains that can be combined in one point extraction, as (source, directory, resolution in km)
+#   3km            - Real-time 3km runs (the nc default)
+#   3km_backdating - 3km reruns of earlier periods
+#   9km_backdating - 9km reruns, covering a larger area than the 3km domain
+#   3km_grib       - Older v3.6 GRIB runs (the grib default)
+DOMAINS = {
+  '3km': ('nc', '/home/coolgroup/ru-wrf/real-time/processed/3km/', 3),
+  '3km_backdating': ('nc', '/home/coolgroup/ru-wrf/backdating/processed/3km/', 3),
+  '9km_backdating': ('nc', '/home/coolgroup/ru-wrf/backdating/processed/9km/', 9),
+  '3km_grib': ('grib', '/home/bowers/output/grib/3km/', 3),
+}
+
+
+#------------------------------
+def make_wrf_file(source,dtime,fo=0,resolution=3):
+  '''Create a WRF filename for a time, using the previous day's model run for hours before the forecast offset'''
+  t2 = dtime.replace() # Copy variable to mess with
+  if t2.hour < fo:
+    t2 = t2-timedelta(1) # Previous model run
+    hour = t2.hour + 24
+  else:
+    hour = t2.hour
+  return make_run_file(source,t2,hour,resolution)
+
+
+def make_run_file(source,run,hour,resolution=3):
+  '''Create a WRF filename for a model run date, forecast hour and domain resolution (km)'''
+  if source == 'nc':
+    datestr = '%d%02d%02d' % (run.year,run.month,run.day)
+    return '%s/wrfproc_%dkm_%s_00Z_H%03d.nc' % (datestr,resolution,datestr,hour)
+  elif source == 'grib':
+    if run.year == 2016 and run >= datetime(2016,6,7):
+      dir_name = '2016_new' # Hack to handle split 2016
+    else:
+      dir_name = str(run.year)
+    return '%s/RUWRF_%dkm_%d%02d%02d00_%02d:00.grb2' % (dir_name,resolution,run.year,run.month,run.day,hour)
+  else:
+    raise ValueError('Unknown source %s, please choose from: %s' % (source, ', '.join(SOURCES)))
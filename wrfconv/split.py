@@ -0,0 +1,85 @@
+# Per-station output files for the data portal
+# Writes a point dataset as one small file per station (NetCDF, CSV or Parquet), so single station downloads can be
+# served straight from disk without opening and slicing the combined file.  The stations are written in parallel,
+# NetCDF with a process pool (HDF5 serializes writes within a process) and CSV/Parquet with a thread pool, and each
+# file is written to a temporary name and renamed into place, so readers never see a partial file.
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import pandas as pd
+import xarray as xr
+from wrfconv import common, parquet, points
+
+#------------------------------
+FORMATS = ['nc','csv','parquet']
+WORKERS = 4
+
+
+#------------------------------
+def station_name(station):
+  '''Decode a station id and make it safe to use in a filename'''
+  name = station.decode() if isinstance(station, bytes) else str(station)
+  return re.sub(r'[^A-Za-z0-9_.-]+', '_', name.strip())
+
+
+def station_filename(directory, prefix, station, start_date, end_date, fmt='nc'):
+  '''Name the output file of a station'''
+  return common.output_filename(os.path.join(directory, '%s_%s' % (prefix, station_name(station))), start_date, end_date, fmt)
+
+
+def station_table(ds):
+  '''Convert a single station dataset to a wide table, with a column per variable and height'''
+  df = parquet.to_wide(ds).drop(columns=['year','month'])
+  return df.set_index(['run_time','lead_time'] if 'run_time' in df else ['time'])
+
+
+def write_station(ds, filename, fmt='nc', pack=False):
+  '''Write a single station dataset to a file, through a temporary file that is renamed into place'''
+  tmp_file = filename + '.tmp'
+  try:
+    if fmt == 'nc':
+      ds.to_netcdf(tmp_file, encoding=points.make_encoding(ds, pack))
+    elif fmt == 'csv':
+      station_table(ds).to_csv(tmp_file, float_format='%.4f')
+    elif fmt == 'parquet':
+      station_table(ds).to_parquet(tmp_file, compression='zstd')
+    else:
+      raise ValueError('Unknown format %s, please choose from: %s' % (fmt, ', '.join(FORMATS)))
+    os.replace(tmp_file, filename)
+  finally:
+    if os.path.exists(tmp_file):
+      os.remove(tmp_file)
+  return filename
+
+
+def write_stations(ds, directory, prefix, fmt='nc', workers=WORKERS, pack=False):
+  '''Write each station of a point dataset to its own file in a directory, in parallel
+
+  Returns the list of files written.'''
+  os.makedirs(directory, exist_ok=True)
+  times = pd.DatetimeIndex(ds['run_time'].values if 'run_time' in ds.dims else ds['time'].values)
+  start_date = datetime(times[0].year, times[0].month, times[0].day)
+  jobs = []
+  for k, station in enumerate(ds['station'].values):
+    filename = station_filename(directory, prefix, station, start_date, times[-1], fmt)
+    jobs.append((ds.isel(station=[k]).load(), filename))
+
+  pool = ProcessPoolExecutor if fmt == 'nc' else ThreadPoolExecutor
+  with pool(max_workers=max(1, min(workers, len(jobs)))) as executor:
+    futures = [executor.submit(write_station, one, filename, fmt, pack) for one, filename in jobs]
+    return [f.result() for f in futures]
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+  with xr.open_dataset(args.file) as ds:
+    ds.load()
+  for var in ds.variables.values():
+    var.encoding = {} # The chunks of the combined file do not fit a single station
+  prefix = args.prefix or re.sub(r'(_\d{8}){1,2}$', '', os.path.splitext(os.path.basename(args.file))[0])
+  files = write_stations(ds, args.output, prefix, fmt=args.format, workers=args.workers, pack=args.pack)
+  print('Outputted %d station files to %s in %s' % (len(files), args.output, datetime.now() - script_start_time))
@@ -0,0 +1,387 @@
+# Running statistics computed while the model files are extracted
+# Each hour updates the accumulators, so monthly means, percentiles, diurnal cycles, wind speed histograms and
+# wind roses are available without a second pass over the extracted time series or grids.
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+#------------------------------
+SPEED_EDGES = np.append(np.arange(0,36,1.0), np.inf) # 1 m/s bins, the last catches everything over 35 m/s
+ROSE_SECTORS = 16
+ROSE_SPEEDS = [0,4,8,12,16,20,np.inf]
+PERCENTILES = [5,10,25,50,75,90,95,99]
+
+
+#------------------------------
+class RunningStats(object):
+  '''Welford running mean and variance (plus minimum and maximum) of an array, ignoring NaNs'''
+
+  def __init__(self, shape):
+    self.count = np.zeros(shape, dtype='int32')
+    self.mean = np.zeros(shape)
+    self.m2 = np.zeros(shape)
+    self.min = np.full(shape, np.inf)
+    self.max = np.full(shape, -np.inf)
+
+  def update(self, x, index=Ellipsis):
+    '''Add one array of values, optionally to a single index of the first axis'''
+    x = np.asarray(x, dtype='float64')
+    ok = np.isfinite(x)
+    count, mean, m2 = self.count[index], self.mean[index], self.m2[index] # Views into the arrays
+    count += ok
+    delta = np.where(ok, x - mean, 0)
+    mean += np.where(ok, delta / np.maximum(count,1), 0)
+    m2 += np.where(ok, delta * (x - mean), 0)
+    self.min[index] = np.fmin(self.min[index], x)
+    self.max[index] = np.fmax(self.max[index], x)
+
+  def merge(self, other):
+    '''Combine with the statistics of another period (Chan et al.)'''
+    count = self.count + other.count
+    n = np.maximum(count,1)
+    delta = other.mean - self.mean
+    self.mean = self.mean + delta * other.count / n
+    self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / n
+    self.count = count
+    self.min = np.fmin(self.min, other.min)
+    self.max = np.fmax(self.max, other.max)
+
+  def variance(self):
+    return np.where(self.count > 1, self.m2 / np.maximum(self.count-1,1), np.nan)
+
+
+class Histogram(object):
+  '''Fixed bin counts of an array, with the bins along the first axis'''
+
+  def __init__(self, shape, nbins):
+    self.counts = np.zeros((nbins,) + tuple(shape), dtype='int32')
+
+  def update_index(self, index, ok):
+    '''Add one count at each valid bin index
+
+    Each cell falls in one bin, so the counts are incremented in place without a temporary of the full histogram.'''
+    nbins = self.counts.shape[0]
+    index = np.asarray(index).ravel()
+    ok = np.asarray(ok).ravel() & (index >= 0) & (index < nbins)
+    self.counts.reshape(nbins, -1)[index[ok], np.flatnonzero(ok)] += 1
+
+  def merge(self, other):
+    self.counts += other.counts
+
+
+def histogram_quantiles(counts, edges, quantiles):
+  '''Estimate quantiles from binned counts, interpolating linearly within each bin'''
+  nbins = counts.shape[0]
+  cum = np.cumsum(counts, axis=0)
+  total = cum[-1]
+  out = np.full((len(quantiles),) + total.shape, np.nan)
+  for k,q in enumerate(quantiles):
+    target = q * total
+    b = np.minimum((cum < target).sum(axis=0), nbins-1)
+    below = np.where(b > 0, np.take_along_axis(cum, np.maximum(b-1,0)[None], 0)[0], 0)
+    inbin = np.take_along_axis(counts, b[None], 0)[0]
+    frac = np.where(inbin > 0, (target - below) / np.maximum(inbin,1), 0)
+    lo = edges[b]
+    hi = np.where(np.isfinite(edges[b+1]), edges[b+1], lo)
+    out[k] = np.where(total > 0, lo + frac*(hi-lo), np.nan)
+  return out
+
+
+def stat_attrs(long_name, units=None, cell_methods=None):
+  '''Create the attributes of a statistics variable'''
+  attrs = {'long_name':long_name}
+  if units is not None:
+    attrs['units'] = units
+  if cell_methods is not None:
+    attrs['cell_methods'] = cell_methods
+  return attrs
+
+
+#------------------------------
+class StatsAccumulator(object):
+  '''Online statistics for the variables of a point or grid extraction
+
+  Call update() with the time and a dict of name: (dims, array) for each hour.  If the u and v wind names
+  are given, wind speed histograms, percentiles and wind roses are also kept.'''
+  title = 'Statistics'
+  summary = "Statistics of the RU-WRF model output for the time_coverage_start to time_coverage_end period, calculated as each model hour was extracted.  Missing hours are not included in the statistics."
+
+  def __init__(self, wind=('u_velocity','v_velocity'), speed_edges=SPEED_EDGES,
+               sectors=ROSE_SECTORS, rose_speeds=ROSE_SPEEDS, percentiles=PERCENTILES):
+    self.wind = wind
+    self.speed_edges = np.asarray(speed_edges, dtype='float64')
+    self.sectors = sectors
+    self.rose_speeds = np.asarray(rose_speeds, dtype='float64')
+    self.percentiles = percentiles
+    self.dims = {}
+    self.running = {}
+    self.diurnal = {}
+    self.histogram = None
+    self.rose = None
+    self.start = None
+    self.end = None
+    self.hours = 0
+
+  def add(self, name, dims, x, hour):
+    if name not in self.running:
+      self.dims[name] = tuple(dims)
+      self.running[name] = RunningStats(x.shape)
+      self.diurnal[name] = RunningStats((24,) + x.shape)
+    self.running[name].update(x)
+    self.diurnal[name].update(x, hour)
+
+  def update(self, t, data):
+    '''Add one hour of data'''
+    t = pd.Timestamp(t)
+    self.start = t if self.start is None else min(self.start, t)
+    self.end = t if self.end is None else max(self.end, t)
+    self.hours += 1
+    for name, (dims, x) in data.items():
+      self.add(name, dims, np.asarray(x, dtype='float64'), t.hour)
+
+    if self.wind is None or self.wind[0] not in data or self.wind[1] not in data:
+      return
+    dims, u = data[self.wind[0]]
+    v = np.asarray(data[self.wind[1]][1], dtype='float64')
+    u = np.asarray(u, dtype='float64')
+    ws = np.sqrt(u**2 + v**2)
+    wd = (270 - np.arctan2(v,u)*180/np.pi) % 360
+    self.add('wind_speed', dims, ws, t.hour)
+    ok = np.isfinite(ws)
+    if self.histogram is None:
+      self.histogram = Histogram(ws.shape, len(self.speed_edges)-1)
+      self.rose = Histogram(ws.shape, self.sectors * (len(self.rose_speeds)-1))
+    self.histogram.update_index(np.searchsorted(self.speed_edges, np.nan_to_num(ws), side='right') - 1, ok)
+    width = 360.0 / self.sectors
+    sector = (((np.nan_to_num(wd) + width/2) % 360) // width).astype(int)
+    speed_class = np.searchsorted(self.rose_speeds, np.nan_to_num(ws), side='right') - 1
+    self.rose.update_index(sector * (len(self.rose_speeds)-1) + speed_class, ok)
+
+  def merge(self, other):
+    '''Combine with the accumulator of another period or shard'''
+    for name in other.running:
+      if name in self.running:
+        self.running[name].merge(other.running[name])
+        self.diurnal[name].merge(other.diurnal[name])
+      else:
+        self.dims[name] = other.dims[name]
+        self.running[name] = other.running[name]
+        self.diurnal[name] = other.diurnal[name]
+    if other.histogram is not None:
+      if self.histogram is None:
+        self.histogram, self.rose = other.histogram, other.rose
+      else:
+        self.histogram.merge(other.histogram)
+        self.rose.merge(other.rose)
+    for t in [other.start, other.end]:
+      if t is not None:
+        self.start = t if self.start is None else min(self.start, t)
+        self.end = t if self.end is None else max(self.end, t)
+    self.hours += other.hours
+
+  def to_dataset(self, coords=None, attrs=None):
+    '''Create the statistics dataset, with the coordinates and variable attributes of the extraction'''
+    attrs = dict(attrs or {})
+    attrs.setdefault('wind_speed', {'units':'m s-1'})
+    ds = xr.Dataset(coords=coords)
+    ds.coords['hour'] = ('hour', np.arange(24, dtype='int32'), {'long_name':'Hour of Day (UTC)'})
+    for name, running in self.running.items():
+      dims = self.dims[name]
+      units = attrs.get(name, {}).get('units')
+      valid = running.count > 0
+      ds[name + '_mean'] = (dims, np.where(valid, running.mean, np.nan).astype('float32'),
+        stat_attrs('Mean of ' + name, units, 'time: mean'))
+      ds[name + '_std'] = (dims, np.sqrt(running.variance()).astype('float32'),
+        stat_attrs('Standard Deviation of ' + name, units, 'time: standard_deviation'))
+      ds[name + '_min'] = (dims, np.where(valid, running.min, np.nan).astype('float32'),
+        stat_attrs('Minimum of ' + name, units, 'time: minimum'))
+      ds[name + '_max'] = (dims, np.where(valid, running.max, np.nan).astype('float32'),
+        stat_attrs('Maximum of ' + name, units, 'time: maximum'))
+      ds[name + '_count'] = (dims, running.count, {'long_name':'Number of Hours of ' + name})
+      cycle = self.diurnal[name]
+      ds[name + '_diurnal_mean'] = (('hour',)+dims, np.where(cycle.count > 0, cycle.mean, np.nan).astype('float32'),
+        stat_attrs('Mean Diurnal Cycle of ' + name, units, 'time: mean within days'))
+
+    if self.histogram is not None:
+      dims = self.dims['wind_speed']
+      edges = self.speed_edges
+      ds.coords['speed_bin'] = ('speed_bin', edges[:-1], {'units':'m s-1', 'long_name':'Wind Speed Bin Lower Edge'})
+      ds['wind_speed_histogram'] = (('speed_bin',)+dims, self.histogram.counts, {'long_name':'Wind Speed Histogram',
+        'comment':'Number of hours in each wind speed bin, the last bin includes all higher speeds.'})
+      ds.coords['percentile'] = ('percentile', np.array(self.percentiles, dtype='float32'), {'units':'percent'})
+      ds['wind_speed_percentiles'] = (('percentile',)+dims,
+        histogram_quantiles(self.histogram.counts, edges, np.array(self.percentiles)/100.0).astype('float32'),
+        {'units':'m s-1', 'long_name':'Wind Speed Percentiles',
+         'comment':'Estimated from the wind speed histogram, interpolating linearly within each bin, so they are '
+           'only as precise as the bin width (%g m/s) allows, and above the last bin edge they are that edge.' % (edges[1] - edges[0])})
+      nspeeds = len(self.rose_speeds)-1
+      ds.coords['direction_sector'] = ('direction_sector', np.arange(self.sectors)*360.0/self.sectors,
+        {'units':'degree', 'long_name':'Wind Direction Sector Center', 'comment':'Direction the wind is coming from'})
+      ds.coords['speed_class'] = ('speed_class', self.rose_speeds[:-1], {'units':'m s-1', 'long_name':'Wind Speed Class Lower Edge'})
+      ds['wind_rose'] = (('direction_sector','speed_class')+dims,
+        self.rose.counts.reshape((self.sectors, nspeeds) + self.rose.counts.shape[1:]),
+        {'long_name':'Wind Rose', 'comment':'Number of hours in each wind direction sector and speed class.'})
+
+    ds.attrs['time_coverage_start'] = str(self.start)
+    ds.attrs['time_coverage_end'] = str(self.end)
+    ds.attrs['hours'] = self.hours
+    return ds
+
+
+#------------------------------
+class PeriodMeans(object):
+  '''Running sums and counts of an array for each key (e.g. each day), ignoring NaNs
+
+  Keys are expected in time order, so when a new key starts the previous one is stored as a float32 mean and
+  int16 count, which halves the memory of long runs.  A key that comes back out of order is reopened.'''
+
+  def __init__(self):
+    self.open = {}   # key: [sum, count] at full precision
+    self.closed = {} # key: (mean, count)
+    self.current = None
+
+  def update(self, key, x, index=Ellipsis, shape=None):
+    '''Add one array of values to a key, optionally to a single index of the first axis'''
+    if key != self.current:
+      if self.current in self.open:
+        total, count = self.open.pop(self.current)
+        self.closed[self.current] = ((total / np.maximum(count,1)).astype('float32'), count.astype('int16'))
+      if key in self.closed:
+        mean, count = self.closed.pop(key)
+        self.open[key] = [mean * count.astype('float64'), count.astype('int32')]
+      self.current = key
+    if key not in self.open:
+      shape = x.shape if shape is None else shape
+      self.open[key] = [np.zeros(shape), np.zeros(shape, dtype='int32')]
+    total, count = self.open[key][0][index], self.open[key][1][index] # Views into the arrays
+    ok = np.isfinite(x)
+    total += np.where(ok, x, 0)
+    count += ok
+
+  def keys(self):
+    return sorted(set(self.open) | set(self.closed))
+
+  def result(self, key):
+    '''Return the mean (NaN where there were no values) and count of a key'''
+    if key in self.open:
+      total, count = self.open[key]
+      mean = total / np.maximum(count,1)
+    else:
+      mean, count = self.closed[key]
+    return np.where(count > 0, mean, np.nan).astype('float32'), count
+
+
+class PeriodAccumulator(object):
+  '''Daily and monthly means, and monthly mean diurnal cycles, of the variables of a point or grid extraction
+
+  Call update() with the time and a dict of name: (dims, array) for each hour, like StatsAccumulator.  If the u
+  and v wind names are given, wind speed and power are also aggregated.  Each day is kept as a float32 mean
+  once the next day starts, so a year of daily grids needs about 1/24 of the memory of the hourly grids.'''
+  title = 'Daily and Monthly Means'
+  summary = "Daily means, monthly means and monthly mean diurnal cycles of the RU-WRF model output for the time_coverage_start to time_coverage_end period, calculated as each model hour was extracted.  Missing hours are not included in the means, and the count variables give the number of hours in each."
+
+  def __init__(self, wind=('u_velocity','v_velocity'), power=True):
+    self.wind = wind
+    self.power_curve = None
+    if power:
+      from wrfconv import derive
+      self.power_curve = derive.load_power_curve()
+    self.dims = {}
+    self.daily = {}
+    self.monthly = {}
+    self.diurnal = {}
+    self.start = None
+    self.end = None
+    self.hours = 0
+
+  def add(self, name, dims, x, t):
+    if name not in self.dims:
+      self.dims[name] = tuple(dims)
+      self.daily[name], self.monthly[name], self.diurnal[name] = PeriodMeans(), PeriodMeans(), PeriodMeans()
+    day = pd.Timestamp(t.year, t.month, t.day)
+    month = pd.Timestamp(t.year, t.month, 1)
+    self.daily[name].update(day, x)
+    self.monthly[name].update(month, x)
+    self.diurnal[name].update(month, x, t.hour, (24,) + x.shape)
+
+  def update(self, t, data):
+    '''Add one hour of data'''
+    t = pd.Timestamp(t)
+    self.start = t if self.start is None else min(self.start, t)
+    self.end = t if self.end is None else max(self.end, t)
+    self.hours += 1
+    for name, (dims, x) in data.items():
+      self.add(name, dims, np.asarray(x, dtype='float64'), t)
+    if self.wind is None or self.wind[0] not in data or self.wind[1] not in data:
+      return
+    dims, u = data[self.wind[0]]
+    ws = np.sqrt(np.asarray(u, dtype='float64')**2 + np.asarray(data[self.wind[1]][1], dtype='float64')**2)
+    self.add('wind_speed', dims, ws, t)
+    if self.power_curve is not None:
+      wp = np.where(np.isfinite(ws), np.interp(ws, self.power_curve['Wind Speed'], self.power_curve['Power']), np.nan)
+      self.add('wind_power', dims, wp, t)
+
+  def to_dataset(self, coords=None, attrs=None):
+    '''Create the aggregates dataset, with the coordinates and variable attributes of the extraction'''
+    attrs = dict(attrs or {})
+    attrs.setdefault('wind_speed', {'units':'m s-1'})
+    attrs.setdefault('wind_power', {'units':'kW'})
+    ds = xr.Dataset(coords=coords)
+    ds.coords['hour'] = ('hour', np.arange(24, dtype='int32'), {'long_name':'Hour of Day (UTC)'})
+    for name, dims in self.dims.items():
+      units = attrs.get(name, {}).get('units')
+      for period, suffix, means in [('day', 'daily', self.daily[name]), ('month', 'monthly', self.monthly[name])]:
+        keys = means.keys()
+        ds.coords[period] = (period, pd.DatetimeIndex(keys).values, {'long_name':'Start of the ' + period.title()})
+        results = [means.result(k) for k in keys]
+        ds['%s_%s_mean' % (name, suffix)] = ((period,)+dims, np.stack([m for m,c in results]),
+          stat_attrs('%s Mean of %s' % (suffix.title(), name), units, 'time: mean'))
+        ds['%s_%s_count' % (name, suffix)] = ((period,)+dims, np.stack([c for m,c in results]).astype('int16'),
+          {'long_name':'Number of Hours in the %s Mean of %s' % (suffix.title(), name)})
+      results = [self.diurnal[name].result(k) for k in self.diurnal[name].keys()]
+      ds['%s_diurnal_mean' % name] = (('month','hour')+dims, np.stack([m for m,c in results]),
+        stat_attrs('Monthly Mean Diurnal Cycle of ' + name, units, 'time: mean within days time: mean over days'))
+    ds.attrs['time_coverage_start'] = str(self.start)
+    ds.attrs['time_coverage_end'] = str(self.end)
+    ds.attrs['hours'] = self.hours
+    return ds
+
+
+class Accumulators(list):
+  '''Update several accumulators (e.g. a StatsAccumulator and a PeriodAccumulator) from the same hours'''
+
+  def update(self, t, data):
+    for acc in self:
+      acc.update(t, data)
+
+
+#------------------------------
+def stats_dataset(acc, ds, attrs=None):
+  '''Create the statistics dataset for an extraction, copying its coordinates and metadata
+
+  Variable attributes are taken from the extraction, or from attrs for variables it does not include.'''
+  dims = set([d for v in acc.dims.values() for d in v])
+  coords = {}
+  for k in ds.variables:
+    if ds[k].dims and set(ds[k].dims) <= dims:
+      coords[k] = ds[k]
+  attrs = dict(attrs or {})
+  attrs.update([(k, ds[k].attrs) for k in ds.variables])
+  statsout = acc.to_dataset(coords, attrs)
+  for k,v in ds.attrs.items():
+    if k not in ('elapsed_time','summary'):
+      statsout.attrs[k] = v
+  statsout.attrs['title'] = ds.attrs.get('title','Rutgers WRF 3km model output') + ' - ' + acc.title
+  statsout.attrs['summary'] = acc.summary
+  return statsout
+
+
+def write_stats(acc, ds, filename, attrs=None, comp_level=5):
+  '''Save the statistics for an extraction to netcdf'''
+  statsout = stats_dataset(acc, ds, attrs)
+  encoding = {}
+  for k in statsout.data_vars:
+    encoding[k] = {'zlib': True, 'complevel': comp_level}
+  statsout.to_netcdf(filename, encoding=encoding)
+  return statsout
@@ -0,0 +1,76 @@
+# Extend an existing point extraction file with the days since it was last updated
+# Stations, variables, heights and forecast offset are all taken from the existing file.
+
+from datetime import datetime,timedelta
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import catalog, common, derive, merge, points
+
+
+#------------------------------
+def file_sites(ds):
+  '''Recreate the station table from a point extraction file'''
+  names = [s.decode() if isinstance(s, bytes) else str(s) for s in ds['station'].values]
+  return pd.DataFrame({'latitude':ds['latitude'].values, 'longitude':ds['longitude'].values, 'name':names})
+
+
+def guess_source(ds):
+  '''Work out which model files a point extraction file came from'''
+  if 'source' in ds.attrs:
+    return ds.attrs['source']
+  return 'grib' if 'grib' in ds.attrs.get('source_directory','') else 'nc'
+
+
+def update_points(ds, until, directory=None):
+  '''Extract the hours after the end of a point dataset through the end of the until date
+
+  The wind resource diagnostics are calculated for the new hours if the dataset has them.'''
+  last = pd.Timestamp(ds['time'].values[-1])
+  start_date = datetime(last.year, last.month, last.day)
+  days = (until - start_date).days + 1
+  if days < 1 or last >= pd.Timestamp(common.end_date(start_date, days)):
+    return None
+
+  source = guess_source(ds)
+  variables = [v for v in ds.data_vars if v in catalog.VARIABLES]
+  heights = ds['height'].values if 'height' in ds.coords else points.HEIGHTS
+  new = points.extract_points(start_date, days, file_sites(ds), source=source, variables=variables,
+    heights=heights, forecast_offset=int(ds.attrs.get('forecast_offset',6)),
+    directory=directory or ds.attrs.get('source_directory'), diagnostics=bool(derive.diagnostic_names(ds.data_vars)))
+  new = new.sel(time=new['time'] > np.datetime64(last))
+  new['station'] = ds['station'].values
+  if 'backfill_run' in ds:
+    from wrfconv import backfill
+    new = backfill.add_provenance(new)
+  return new
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  script_start_time = datetime.now() #Script Timer
+  if args.until:
+    until = common.parse_date(args.until)
+  else:
+    until = datetime.combine(datetime.today().date(), datetime.min.time()) - timedelta(1) # Yesterday
+
+  ds = xr.open_dataset(args.file)
+  ds.load()
+  ds.close()
+  new = update_points(ds, until, args.directory)
+  if new is None or len(new['time']) == 0:
+    print('Nothing to update in ' + args.file)
+    return
+
+  dsout = xr.concat([ds, new.drop_vars(['latitude','longitude'])], dim='time', data_vars='minimal')
+  dsout.attrs = ds.attrs
+  dsout.attrs['date_modified'] = str(datetime.today())
+  dsout.attrs['elapsed_time'] = str(datetime.now() - script_start_time)
+
+  output_datafile = args.output or args.file
+  encoding = points.make_encoding(dsout)
+  for name, var_encoding in merge.file_encoding(ds, dim=None).items(): # Keep the packing and chunks the file was written with
+    encoding.setdefault(name, {}).update(var_encoding)
+  common.replace_netcdf(dsout, output_datafile, encoding)
+  print('Added %d hours to %s' % (len(new['time']), output_datafile))
@@ -0,0 +1,156 @@
+# Zone map indexes for the extraction archives
+# A small csv next to each output file records the range of every variable for each day (and station or grid
+# tile), and a catalog csv collects them across files, so archive queries only open files that could match.
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+from wrfconv import common
+
+#------------------------------
+CATALOG_FILE = 'wrf_index.csv'
+COLUMNS = ['file','time_start','time_end','variable','height','tile','lat_min','lat_max','lon_min','lon_max',
+           'min','max','mean','nan_count','count']
+
+
+#------------------------------
+def index_filename(filename):
+  '''Return the sidecar index filename for an output file'''
+  return os.path.splitext(filename)[0] + '_index.csv'
+
+
+def spatial_tiles(ds, tile=None):
+  '''List the (name, selection, lat/lon bounds) of each station, or each grid tile of tile x tile points'''
+  if 'station' in ds.dims:
+    tiles = []
+    for k,station in enumerate(ds['station'].values):
+      name = station.decode() if isinstance(station, bytes) else str(station)
+      lat, lon = float(ds['latitude'][k]), float(ds['longitude'][k])
+      tiles.append((name, {'station':k}, (lat, lat, lon, lon)))
+    return tiles
+  ydim, xdim = ('y','x') if 'y' in ds.dims else ('lat','lon') # Model or regridded grids
+  ny, nx = ds.sizes[ydim], ds.sizes[xdim]
+  step_y, step_x = (tile, tile) if tile else (ny, nx)
+  tiles = []
+  for y0 in range(0, ny, step_y):
+    for x0 in range(0, nx, step_x):
+      sel = {ydim:slice(y0,y0+step_y), xdim:slice(x0,x0+step_x)}
+      lat = ds['lat'].isel(sel, missing_dims='ignore').values
+      lon = ds['lon'].isel(sel, missing_dims='ignore').values
+      name = 'all' if not tile else 'y%d_x%d' % (y0, x0)
+      tiles.append((name, sel, (float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max()))))
+  return tiles
+
+
+def zone_rows(ds, filename, tile=None):
+  '''Calculate the zone map rows of a point or grid dataset, for each day, variable, height and tile'''
+  tdim = 'time' if 'time' in ds.dims else 'run_time'
+  days = pd.DatetimeIndex(ds[tdim].values).floor('D')
+  hdim = [d for d in ['height','z'] if d in ds.dims]
+  names = [k for k in ds.data_vars if tdim in ds[k].dims and np.issubdtype(ds[k].dtype, np.floating)]
+  rows = []
+  for day in days.unique():
+    dsd = ds.isel({tdim:np.flatnonzero(days == day)})
+    times = dsd['time'].values
+    span = (pd.Timestamp(np.nanmin(times)), pd.Timestamp(np.nanmax(times)))
+    for tile_name, sel, bounds in spatial_tiles(dsd, tile):
+      sub = dsd.isel(sel)
+      for name in names:
+        da = sub[name]
+        levels = [(h, da.sel({hdim[0]:h})) for h in da[hdim[0]].values] if hdim and hdim[0] in da.dims else [(None, da)]
+        for h, layer in levels:
+          values = layer.values
+          valid = np.isfinite(values)
+          count = int(valid.sum())
+          rows.append([os.path.basename(filename), span[0], span[1], name, h, tile_name] + list(bounds) + [
+            float(values[valid].min()) if count else np.nan,
+            float(values[valid].max()) if count else np.nan,
+            float(values[valid].mean()) if count else np.nan,
+            int(values.size - count), count])
+  rows = pd.DataFrame(rows, columns=COLUMNS)
+  rows['height'] = rows['height'].astype('Int32')
+  return rows
+
+
+def combine_rows(rows):
+  '''Combine the rows of the same day, variable, height and tile (e.g. from separate batches of a run)'''
+  rows = rows.copy()
+  rows['day'] = rows['time_start'].dt.floor('D')
+  rows['total'] = rows['mean'].fillna(0) * rows['count']
+  keys = ['file','day','variable','height','tile','lat_min','lat_max','lon_min','lon_max']
+  combined = rows.groupby(keys, sort=False, dropna=False).agg(time_start=('time_start','min'), time_end=('time_end','max'),
+    min=('min','min'), max=('max','max'), total=('total','sum'), nan_count=('nan_count','sum'), count=('count','sum')).reset_index()
+  combined['mean'] = combined['total'] / combined['count'].where(combined['count'] > 0)
+  return combined[COLUMNS]
+
+
+#------------------------------
+def write_index(ds, filename, tile=None, catalog=None):
+  '''Write the sidecar index for an output file, and add it to the catalog in the same directory'''
+  return write_rows(zone_rows(ds, filename, tile), filename, catalog)
+
+
+def write_rows(rows, filename, catalog=None):
+  '''Write zone map rows to the sidecar index for an output file, and add them to the catalog'''
+  rows.to_csv(index_filename(filename), index=False)
+  if catalog is None:
+    catalog = os.path.join(os.path.dirname(os.path.abspath(filename)), CATALOG_FILE)
+  update_catalog(rows, catalog)
+  return rows
+
+
+def read_catalog(catalog):
+  '''Load a zone map catalog or sidecar index'''
+  rows = pd.read_csv(catalog, parse_dates=['time_start','time_end'])
+  rows['height'] = rows['height'].astype('Int32')
+  return rows
+
+
+def update_catalog(rows, catalog):
+  '''Replace the rows for the indexed files in a catalog'''
+  if os.path.exists(catalog):
+    old = read_catalog(catalog)
+    rows = pd.concat([old[~old['file'].isin(rows['file'].unique())], rows], ignore_index=True)
+  tmp_file = catalog + '.tmp'
+  rows.to_csv(tmp_file, index=False)
+  os.replace(tmp_file, catalog)
+
+
+def query(rows, variable, above=None, below=None, height=None, bbox=None, start=None, end=None):
+  '''Find the catalog rows that could contain values of a variable above and/or below a threshold
+
+  The bbox (lat_min,lat_max,lon_min,lon_max) and start/end times limit the rows to the tiles and days that
+  overlap them.  Only files with matching rows need to be opened.'''
+  match = rows['variable'] == variable
+  if above is not None:
+    match &= rows['max'] > above
+  if below is not None:
+    match &= rows['min'] < below
+  if height is not None:
+    match &= rows['height'] == height
+  if bbox is not None:
+    match &= (rows['lat_max'] >= bbox[0]) & (rows['lat_min'] <= bbox[1]) & (rows['lon_max'] >= bbox[2]) & (rows['lon_min'] <= bbox[3])
+  if start is not None:
+    match &= rows['time_end'] >= pd.Timestamp(start)
+  if end is not None:
+    match &= rows['time_start'] <= pd.Timestamp(end)
+  return rows[match]
+
+
+#------------------------------
+def main(args):
+  """Main function for command line execution"""
+  if args.command == 'index':
+    for filename in args.files:
+      with xr.open_dataset(filename) as ds:
+        rows = write_index(ds, filename, args.tile, args.catalog)
+      print('Indexed %s (%d rows)' % (filename, len(rows)))
+    return
+
+  rows = query(read_catalog(args.catalog), args.variable, above=args.above, below=args.below, height=args.height,
+    bbox=args.bbox, start=args.start and common.parse_date(args.start), end=args.end and common.end_date(common.parse_date(args.end),1))
+  days = rows.groupby(['file', rows['time_start'].dt.date]).size()
+  for (filename, day), n in days.items():
+    print('%s %s' % (filename, day))
+  print('%d files, %d days match' % (rows['file'].nunique(), len(days)))